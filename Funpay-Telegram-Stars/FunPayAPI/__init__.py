@@ -1,5 +1,9 @@
 from .account import Account
+from .async_account import AsyncAccount
 from .updater.runner import Runner
+from .updater.async_runner import AsyncRunner
+from .updater.dispatcher import Dispatcher
+from .updater.supervisor import Supervisor
 from .updater import events
-from .common import exceptions, utils, enums
+from .common import exceptions, utils, enums, ratelimit
 from . import types
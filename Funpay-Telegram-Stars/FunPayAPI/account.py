@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Literal, Any, Optional, IO
+from typing import TYPE_CHECKING, Literal, Any, Optional, IO, Callable, Generator
 
 import FunPayAPI.common.enums
 from FunPayAPI.common.utils import parse_currency, RegularExpressions
@@ -9,6 +9,10 @@ if TYPE_CHECKING:
     from .updater.runner import Runner
 
 from requests_toolbelt import MultipartEncoder
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.cookiejar import CookiePolicy
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import requests
@@ -20,12 +24,58 @@ import time
 import re
 
 from . import types
-from .common import exceptions, utils, enums
+from .common import exceptions, utils, enums, ratelimit
+from .common.parsers import get_html_parser
+from .common.circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger("FunPayAPI.account")
 PRIVATE_CHAT_ID_RE = re.compile(r"users-\d+-\d+$")
 
 
+class _NoCookiesPolicy(CookiePolicy):
+    """
+    Политика куки для сессии :class:`FunPayAPI.account.Account`: куки передаются вручную в
+    :meth:`FunPayAPI.account.Account.method`, поэтому сессия не должна их накапливать.
+    """
+    netscape = True
+    rfc2965 = False
+    hide_cookie2 = False
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+    def domain_return_ok(self, domain, request):
+        return False
+
+    def path_return_ok(self, path, request):
+        return False
+
+
+def create_session(pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False,
+                   max_retries: int = 0, keep_alive: bool = True) -> requests.Session:
+    """
+    Создает HTTP-сессию с пулом соединений для :class:`FunPayAPI.account.Account`.
+
+    :return: объект сессии.
+    :rtype: :class:`requests.Session`
+    """
+    session = requests.Session()
+    session.cookies.set_policy(_NoCookiesPolicy())
+    # Повторяем только ошибки подключения: запрос до сервера не дошел, значит повтор безопасен и для POST.
+    retries = Retry(total=max_retries, connect=max_retries, read=0, status=0, other=0,
+                    backoff_factor=0.3, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                          max_retries=retries, pool_block=pool_block)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
 class Account:
     """
     Класс для управления аккаунтом FunPay.
@@ -44,11 +94,56 @@ class Account:
 
     :param locale: текущий язык аккаунта, опционально.
     :type locale: :obj:`Literal["ru", "en", "uk"]` or :obj:`None`
+
+    :param pool_connections: кол-во пулов соединений (хостов), которые хранятся в сессии.
+    :type pool_connections: :obj:`int`, опционально
+
+    :param pool_maxsize: макс. кол-во соединений, хранящихся в пуле одного хоста.
+    :type pool_maxsize: :obj:`int`, опционально
+
+    :param pool_block: ждать ли освобождения соединения, если все соединения хоста заняты
+        (иначе будет открыто временное соединение сверх лимита).
+    :type pool_block: :obj:`bool`, опционально
+
+    :param max_retries: кол-во повторных попыток при ошибках подключения.
+    :type max_retries: :obj:`int`, опционально
+
+    :param keep_alive: переиспользовать ли соединения между запросами?
+    :type keep_alive: :obj:`bool`, опционально
+
+    :param html_parser: парсер HTML-страниц FunPay: "bs4" (BeautifulSoup), "lxml" (быстрый парсер на lxml.html)
+        или собственная функция, возвращающая объект с интерфейсом :class:`bs4.BeautifulSoup`.
+    :type html_parser: :obj:`str` `bs4` or `lxml` or :obj:`Callable`, опционально
+
+    :param session: общая HTTP-сессия (например, :attr:`FunPayAPI.updater.supervisor.Supervisor.session`), если
+        нужно использовать один пул соединений для нескольких аккаунтов. Cookies аккаунта передаются в заголовках
+        запросов, поэтому сессию можно безопасно разделять. Параметры пула в этом случае игнорируются, а
+        :meth:`FunPayAPI.account.Account.close` не закрывает сессию. Сюда же передается сессия кассеты
+        (:meth:`FunPayAPI.common.cassette.Cassette.recorder` / :meth:`FunPayAPI.common.cassette.Cassette.player`)
+        для записи и воспроизведения ответов FunPay без сети.
+    :type session: :class:`requests.Session` or :obj:`None`, опционально
+
+    :param rate_limits: лимиты частоты запросов по классам эндпоинтов {класс: (запросов в секунду, burst)}
+        (см. :class:`FunPayAPI.common.ratelimit.RateLimiter`).
+    :type rate_limits: :obj:`dict` or :obj:`None`, опционально
+
+    :param retry_policy: политика повторных попыток запросов (по умолчанию - 3 попытки с экспоненциальной
+        задержкой, см. :class:`FunPayAPI.common.ratelimit.RetryPolicy`).
+    :type retry_policy: :class:`FunPayAPI.common.ratelimit.RetryPolicy` or :obj:`None`, опционально
+
+    :param circuit_breakers: использовать ли предохранители по классам эндпоинтов
+        (см. :class:`FunPayAPI.common.circuit_breaker.CircuitBreaker`).
+    :type circuit_breakers: :obj:`bool`, опционально
     """
 
     def __init__(self, golden_key: str, user_agent: str | None = None,
                  requests_timeout: int | float = 10, proxy: Optional[dict] = None,
-                 locale: Literal["ru", "en", "uk"] | None = None):
+                 locale: Literal["ru", "en", "uk"] | None = None,
+                 pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False,
+                 max_retries: int = 0, keep_alive: bool = True,
+                 html_parser: Literal["bs4", "lxml"] | Callable[[str], Any] = "bs4",
+                 session: requests.Session | None = None, rate_limits: dict[str, tuple[float, int] | None] | None = None,
+                 retry_policy: ratelimit.RetryPolicy | None = None, circuit_breakers: bool = True):
         self.golden_key: str = golden_key
         """Токен (golden_key) аккаунта."""
         self.user_agent: str | None = user_agent
@@ -57,6 +152,24 @@ class Account:
         """Тайм-аут ожидания ответа на запросы."""
         self.proxy = proxy
         """Прокси"""
+        self.keep_alive: bool = keep_alive
+        """Переиспользуются ли соединения между запросами."""
+        self.__own_session: bool = session is None
+        self.session: requests.Session = session or create_session(pool_connections, pool_maxsize, pool_block,
+                                                                   max_retries, keep_alive)
+        """HTTP-сессия с пулом соединений, через которую отправляются все запросы аккаунта."""
+        self.rate_limiter: ratelimit.RateLimiter = ratelimit.RateLimiter(rate_limits)
+        """Ограничитель частоты запросов по классам эндпоинтов."""
+        self.retry_policy: ratelimit.RetryPolicy = retry_policy or ratelimit.RetryPolicy()
+        """Политика повторных попыток запросов."""
+        self.circuit_breakers: dict[str, CircuitBreaker] = {
+            endpoint: CircuitBreaker(f"FunPay {endpoint}") for endpoint in ratelimit.ENDPOINT_CLASSES + ("send",)
+        } if circuit_breakers else {}
+        """Предохранители по классам эндпоинтов (состояние для мониторинга - CircuitBreaker.stats()).
+        Отправка сообщений (запросы к runner/ с полем "request") использует отдельный предохранитель "send",
+        чтобы ошибки отправки и получения обновлений не размыкали друг друга."""
+        self.__html_parser: Callable[[str], Any] = get_html_parser(html_parser)
+        """Функция парсинга HTML-страниц FunPay."""
         self.html: str | None = None
         """HTML основной страницы FunPay."""
         self.app_data: dict | None = None
@@ -104,8 +217,8 @@ class Account:
         self.last_update: int | None = None
         """Последнее время обновления аккаунта."""
 
-        self.interlocutor_ids: dict[int, int] = {}
-        """{id чата: id собеседника}"""
+        self.interlocutor_ids: utils.BoundedDict[int, int] = utils.BoundedDict(10000, 30 * 24 * 60 * 60)
+        """{id чата: id собеседника} (хранятся последние 10000 чатов не дольше 30 дней)."""
 
         self.__initiated: bool = False
 
@@ -133,6 +246,10 @@ class Account:
                locale: Literal["ru", "en", "uk"] | None = None) -> requests.Response:
         """
         Отправляет запрос к FunPay. Добавляет в заголовки запроса user_agent и куки.
+        Частота запросов ограничивается :attr:`FunPayAPI.account.Account.rate_limiter`, ответы 429 / 5xx и ошибки
+        соединения повторяются согласно :attr:`FunPayAPI.account.Account.retry_policy`. Если FunPay не отвечает
+        (ошибки соединения / 5xx подряд), запросы к тому же классу эндпоинтов сразу завершаются
+        :class:`FunPayAPI.common.exceptions.CircuitOpenError` (см. :attr:`FunPayAPI.account.Account.circuit_breakers`).
 
         :param request_method: метод запроса ("get" / "post").
         :type request_method: :obj:`str` `post` or `get`
@@ -187,20 +304,67 @@ class Account:
         locale = locale or self.__set_locale
         if request_method == "get" and locale and locale != self.locale:
             link += f'{"&" if "?" in link else "?"}setlocale={locale}'
-        for i in range(10):
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {}, allow_redirects=False)
-            if not (300 <= response.status_code < 400) or 'Location' not in response.headers:
-                break
-            link = response.headers['Location']
-            update_locale(link)
+
+        def send(link: str) -> requests.Response:
+            for i in range(10):
+                response = self.session.request(request_method, link, headers=headers, data=payload,
+                                                timeout=self.requests_timeout,
+                                                proxies=self.proxy or {}, allow_redirects=False)
+                if not (300 <= response.status_code < 400) or 'Location' not in response.headers:
+                    return response
+                link = response.headers['Location']
+                update_locale(link)
+            return self.session.request(request_method, link, headers=headers, data=payload,
+                                        timeout=self.requests_timeout,
+                                        proxies=self.proxy or {})
+
+        endpoint = ratelimit.classify_endpoint(link)
+        # потоковое тело (MultipartEncoder) после отправки уже прочитано - такой запрос повторить нельзя
+        retryable = payload is None or isinstance(payload, (dict, list, tuple, str, bytes))
+        idempotent = self.retry_policy.is_idempotent(request_method, endpoint, payload)
+        if endpoint == "runner" and isinstance(payload, dict) and payload.get("request"):
+            breaker = self.circuit_breakers.get("send")
         else:
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {})
-        if response.status_code == 429:
-            self.last_429_err_time = time.time()
+            breaker = self.circuit_breakers.get(endpoint)
+        if breaker is not None:
+            breaker.before_call()
+        start_time = time.time()
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                self.rate_limiter.acquire(endpoint)
+                try:
+                    response = send(link)
+                except (requests.ConnectionError, requests.Timeout):
+                    if not retryable or not self.retry_policy.should_retry(attempt, idempotent):
+                        raise
+                    delay = self.retry_policy.get_delay(attempt)
+                    logger.debug(f"Ошибка соединения ({endpoint}), повтор через {delay:.2f} сек.", exc_info=True)
+                    time.sleep(delay)
+                    continue
+
+                if response.status_code == 429:
+                    self.last_429_err_time = time.time()
+                    delay = self.retry_policy.get_delay(attempt, response)
+                    # пауза общая для всего класса эндпоинтов: повтор и параллельные запросы ждут в rate_limiter
+                    self.rate_limiter.throttle(endpoint, delay)
+                    logger.debug(f"429 от FunPay ({endpoint}), пауза {delay:.2f} сек.")
+                    if retryable and self.retry_policy.should_retry(attempt, idempotent, response):
+                        continue
+                elif retryable and self.retry_policy.should_retry(attempt, idempotent, response):
+                    delay = self.retry_policy.get_delay(attempt, response)
+                    logger.debug(f"Ответ {response.status_code} от FunPay ({endpoint}), повтор через {delay:.2f} сек.")
+                    time.sleep(delay)
+                    continue
+                break
+        except:
+            if breaker is not None:
+                breaker.record(False, time.time() - start_time)
+            raise
+        if breaker is not None:
+            # 429 и 4xx - ответы работающего сервера, ошибками для предохранителя считаются только 5xx
+            breaker.record(response.status_code < 500, time.time() - start_time)
 
         if response.status_code == 403:
             raise exceptions.UnauthorizedError(response)
@@ -208,6 +372,47 @@ class Account:
             raise exceptions.RequestFailedError(response)
         return response
 
+    @property
+    def pool_stats(self) -> dict[str, int | float]:
+        """
+        Возвращает статистику пула соединений.
+
+        :return: словарь со статистикой: кол-во запросов (requests), кол-во открытых соединений за все время
+            (connections), кол-во запросов, отправленных через уже открытое соединение (reused), доля переиспользованных
+            соединений (reuse_ratio), кол-во открытых соединений, простаивающих в пуле (open_sockets), кол-во пулов
+            (pools).
+        :rtype: :obj:`dict` {:obj:`str`: :obj:`int` or :obj:`float`}
+        """
+        total_requests, total_connections, open_sockets, pools_count = 0, 0, 0, 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                pools_count += 1
+                total_requests += pool.num_requests
+                total_connections += pool.num_connections
+                if pool.pool is not None:
+                    open_sockets += sum(1 for conn in list(pool.pool.queue)
+                                        if conn is not None and getattr(conn, "sock", None) is not None)
+        reused = max(total_requests - total_connections, 0)
+        return {
+            "requests": total_requests,
+            "connections": total_connections,
+            "reused": reused,
+            "reuse_ratio": reused / total_requests if total_requests else 0.0,
+            "open_sockets": open_sockets,
+            "pools": pools_count
+        }
+
+    def close(self):
+        """
+        Закрывает все соединения пула (если сессия не общая).
+        """
+        if self.__own_session:
+            self.session.close()
+
     def get(self, update_phpsessid: bool = True) -> Account:
         """
         Получает / обновляет данные об аккаунте. Необходимо вызывать каждые 40-60 минут, дабы обновить
@@ -225,7 +430,7 @@ class Account:
         if not self.is_initiated:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
             raise exceptions.UnauthorizedError(response)
@@ -282,7 +487,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -370,7 +575,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -427,7 +632,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
             raise exceptions.UnauthorizedError(response)
@@ -479,7 +684,7 @@ class Account:
             raise exceptions.AccountNotInitiatedError()
         response = self.method("get", f"lots/offer?id={lot_id}", {"accept": "*/*"}, {}, raise_not_200=True)
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -542,7 +747,9 @@ class Account:
                                      interlocutor_username, from_id)
 
     def get_chats_histories(self, chats_data: dict[int | str, str | None],
-                            interlocutor_ids: list[int] | None = None) -> dict[int, list[types.Message]]:
+                            interlocutor_ids: list[int] | None = None,
+                            buyers_viewing: dict[int, types.BuyerViewing] | None = None) -> \
+            dict[int, list[types.Message]]:
         """
         Получает историю сообщений сразу нескольких чатов
         (до 50 сообщений на личный чат, до 25 сообщений на публичный чат).
@@ -552,6 +759,14 @@ class Account:
             Например: {48392847: "SLLMK", 58392098: "Amongus", 38948728: None}
         :type chats_data: :obj:`dict` {:obj:`int` or :obj:`str`: :obj:`str` or :obj:`None`}
 
+        :param interlocutor_ids: ID собеседников, для которых нужно узнать, какие лоты они смотрят.
+        :type interlocutor_ids: :obj:`list` of :obj:`int` or :obj:`None`, опционально
+
+        :param buyers_viewing: словарь, в который записать информацию о просматриваемых лотах
+            (по умолчанию - Account.runner.buyers_viewing).
+        :type buyers_viewing: :obj:`dict` {:obj:`int`: :class:`FunPayAPI.types.BuyerViewing`} or :obj:`None`,
+            опционально
+
         :return: словарь с историями чатов в формате {ID чата: [список сообщений]}
         :rtype: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.types.Message`}
         """
@@ -578,7 +793,7 @@ class Account:
         for i in json_response["objects"]:
             if i.get("type") == "c-p-u":
                 bv = self.parse_buyer_viewing(i)
-                self.runner.buyers_viewing[bv.buyer_id] = bv
+                (self.runner.buyers_viewing if buyers_viewing is None else buyers_viewing)[bv.buyer_id] = bv
             elif i.get("type") == "chat_node":
                 if not i.get("data"):
                     result[i.get("id")] = []
@@ -1079,7 +1294,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -1163,7 +1378,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
         if (name := parser.find("div", {"class": "chat-header"}).find("div", {"class": "media-user-name"}).find(
                 "a").text) in ("Чат", "Chat"):
             raise Exception("chat not found")  # todo
@@ -1215,7 +1430,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
             raise exceptions.UnauthorizedError(response)
@@ -1335,7 +1550,8 @@ class Account:
                   state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
                   section: Optional[str] = None, server: Optional[int] = None,
                   side: Optional[int] = None, locale: Literal["ru", "en", "uk"] | None = None,
-                  subcategories: dict[str, tuple[types.SubCategoryTypes, int]] | None = None, **more_filters) -> \
+                  subcategories: dict[str, tuple[types.SubCategoryTypes, int]] | None = None,
+                  known_orders: dict[str, types.OrderStatuses] | None = None, **more_filters) -> \
             tuple[str | None, list[types.OrderShortcut], Literal["ru", "en", "uk"],
             dict[str, types.SubCategory]]:
         """
@@ -1380,6 +1596,11 @@ class Account:
         :param side: ID стороны (платформы).
         :type side: :obj:`int`, опционально.
 
+        :param known_orders: уже известные заказы ({ID заказа: статус}). Заказы из этого словаря с неизменившимся
+            статусом не парсятся и не попадают в список, а ID след. заказа будет None, если на странице встретился
+            хотя бы один такой заказ (дальше идут только более старые, уже известные заказы).
+        :type known_orders: :obj:`dict` {:obj:`str`: :class:`FunPayAPI.common.enums.OrderStatuses`}, опционально
+
         :param more_filters: доп. фильтры.
 
         :return: (ID след. заказа (для start_from), список заказов)
@@ -1410,7 +1631,7 @@ class Account:
             self.locale = self.__default_locale
         html_response = response.content.decode()
 
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = self.parse_html(html_response)
 
         if not start_from:
             username = parser.find("div", {"class": "user-link-name"})
@@ -1461,6 +1682,9 @@ class Account:
             order_id = div.find("div", {"class": "tc-order"}).text[1:]
             if order_id in exclude_ids:
                 continue
+            if known_orders is not None and known_orders.get(order_id) == order_status:
+                next_order_id = None
+                continue
 
             description = div.find("div", {"class": "order-desc"}).find("div").text
             tc_price = div.find("div", {"class": "tc-price"}).text
@@ -1505,6 +1729,60 @@ class Account:
 
         return next_order_id, sales, locale, subcategories
 
+    def iter_sales(self, start_from: str | None = None, until_date: datetime | None = None,
+                   until_id: str | None = None, stop: Callable[[types.OrderShortcut], bool] | None = None,
+                   max_pages: int | None = None, prefetch: bool = False,
+                   **kwargs) -> Generator[types.OrderShortcut, None, None]:
+        """
+        Лениво перебирает заказы со страницы https://funpay.com/orders/trade, переходя на следующие страницы
+        (через start_from) по мере необходимости. Заказы отдаются по мере парсинга страниц, от новых к старым.
+
+        :param start_from: ID заказа, с которого начать список (ID заказа должен быть без '#'!).
+        :type start_from: :obj:`str`, опционально
+
+        :param until_date: остановиться на первом заказе, оформленном раньше этой даты.
+        :type until_date: :class:`datetime.datetime`, опционально
+
+        :param until_id: остановиться на заказе с этим ID (сам заказ не возвращается), например, на последнем
+            уже известном заказе.
+        :type until_id: :obj:`str`, опционально
+
+        :param stop: функция, принимающая заказ; если она вернет True, перебор останавливается
+            (сам заказ не возвращается).
+        :type stop: :obj:`Callable`, опционально
+
+        :param max_pages: макс. кол-во запрашиваемых страниц.
+        :type max_pages: :obj:`int`, опционально
+
+        :param prefetch: запрашивать ли следующую страницу в фоне, пока обрабатывается текущая?
+        :type prefetch: :obj:`bool`, опционально
+
+        :param kwargs: остальные параметры :meth:`FunPayAPI.account.Account.get_sales` (фильтры, locale и т.д.).
+
+        :return: генератор заказов.
+        :rtype: :obj:`Generator` of :class:`FunPayAPI.types.OrderShortcut`
+        """
+        executor = ThreadPoolExecutor(1, thread_name_prefix="FunPayAPI-sales") if prefetch else None
+        try:
+            next_order_id, orders, _, subcategories = self.get_sales(start_from, **kwargs)
+            kwargs.setdefault("subcategories", subcategories)
+            pages = 1
+            while True:
+                has_next = next_order_id and (max_pages is None or pages < max_pages)
+                future = executor.submit(self.get_sales, next_order_id, **kwargs) if has_next and executor else None
+                for order in orders:
+                    if (until_id is not None and order.id == until_id) or \
+                            (until_date is not None and order.date < until_date) or (stop and stop(order)):
+                        return
+                    yield order
+                if not has_next:
+                    return
+                next_order_id, orders, _, _ = future.result() if future else self.get_sales(next_order_id, **kwargs)
+                pages += 1
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
     def get_sells(self, start_from: str | None = None, include_paid: bool = True, include_closed: bool = True,
                   include_refunded: bool = True, exclude_ids: list[str] | None = None,
                   id: Optional[str] = None, buyer: Optional[str] = None,
@@ -1710,7 +1988,7 @@ class Account:
         response = self.method("get", f"lots/offerEdit?offer={lot_id}", headers, {}, raise_not_200=True)
 
         html_response = response.content.decode()
-        bs = BeautifulSoup(html_response, "lxml")
+        bs = self.parse_html(html_response)
         error_message = bs.find("p", class_="lead")
         if error_message:
             raise exceptions.LotParsingError(response, error_message.text, lot_id)
@@ -1746,7 +2024,7 @@ class Account:
         response = self.method("get", f"chips/{subcategory_id}/trade", headers, {}, raise_not_200=True)
 
         html_response = response.content.decode()
-        bs = BeautifulSoup(html_response, "lxml")
+        bs = self.parse_html(html_response)
         result = {field["name"]: field.get("value") or "" for field in bs.find_all("input") if field["name"] != "query"}
         result.update({field["name"]: "on" for field in bs.find_all("input", {"type": "checkbox"}, checked=True)})
         return types.ChipFields(self.id, subcategory_id, result)
@@ -1930,7 +2208,7 @@ class Account:
 
         :param html: HTML страница.
         """
-        parser = BeautifulSoup(html, "lxml")
+        parser = self.parse_html(html)
         games_table = parser.find_all("div", {"class": "promo-game-list"})
         if not games_table:
             return
@@ -1983,15 +2261,15 @@ class Account:
         if interlocutor_id is not None:
             ids[interlocutor_id] = interlocutor_username
 
-        for i in json_messages:
-            if i["id"] < from_id:
-                continue
+        json_messages = [i for i in json_messages if i["id"] >= from_id]
+        # HTML каждого сообщения парсится один раз, дерево переиспользуется при заполнении полей сообщения.
+        parsed: list[tuple[types.Message, Any, Any]] = []
+        for i, parser in zip(json_messages, self.__parse_messages_html(json_messages)):
             author_id = i["author"]
-            parser = BeautifulSoup(i["html"].replace("<br>", "\n"), "lxml")
+            author_div = parser.find("div", {"class": "media-user-name"})
 
             # Если ник или бейдж написавшего неизвестен, но есть блок с данными об авторе сообщения
-            if None in [ids.get(author_id), badges.get(author_id)] and (
-                    author_div := parser.find("div", {"class": "media-user-name"})):
+            if None in [ids.get(author_id), badges.get(author_id)] and author_div:
                 if badges.get(author_id) is None:
                     badge = author_div.find("span", {"class": "chat-msg-author-label label label-success"})
                     badges[author_id] = badge.text if badge else 0
@@ -2037,12 +2315,12 @@ class Account:
             message_obj.type = types.MessageTypes.NON_SYSTEM if author_id != 0 else message_obj.get_message_type()
 
             messages.append(message_obj)
+            parsed.append((message_obj, parser, author_div))
 
-        for i in messages:
+        for i, parser, author_div in parsed:
             i.author = ids.get(i.author_id)
             i.chat_name = interlocutor_username
             i.badge = badges.get(i.author_id) if badges.get(i.author_id) != 0 else None
-            parser = BeautifulSoup(i.html, "lxml")
             if i.badge:
                 i.is_employee = True
                 if i.badge in ("поддержка", "підтримка", "support"):
@@ -2051,9 +2329,8 @@ class Account:
                     i.is_moderation = True
                 elif i.badge in ("арбитраж", "арбітраж", "arbitration"):
                     i.is_arbitration = True
-            default_label = parser.find("div", {"class": "media-user-name"})
-            default_label = default_label.find("span", {
-                "class": "chat-msg-author-label label label-default"}) if default_label else None
+            default_label = author_div.find("span", {
+                "class": "chat-msg-author-label label label-default"}) if author_div else None
             if default_label:
                 if default_label.text in ("автовідповідь", "автоответ", "auto-reply"):
                     i.is_autoreply = True
@@ -2100,6 +2377,42 @@ class Account:
 
         return messages
 
+    @staticmethod
+    def __parse_messages_html(json_messages: list[dict]) -> list[Any]:
+        """
+        Парсит HTML всех сообщений истории одним документом.
+
+        :param json_messages: сообщения из ответа FunPay.
+        :type json_messages: :obj:`list` of :obj:`dict`
+
+        :return: деревья сообщений (в том же порядке, что и json_messages).
+        :rtype: :obj:`list` of :class:`bs4.Tag`
+        """
+        if not json_messages:
+            return []
+        html = "".join(f'<div data-fp-message="{n}">{i["html"]}</div>'
+                       for n, i in enumerate(json_messages)).replace("<br>", "\n")
+        document = BeautifulSoup(html, "lxml")
+        fragments = document.body.find_all("div", attrs={"data-fp-message": True}, recursive=False) \
+            if document.body else []
+        if len(fragments) == len(json_messages) and \
+                all(fragment["data-fp-message"] == str(n) for n, fragment in enumerate(fragments)):
+            return fragments
+        # Если HTML одного из сообщений некорректен, границы сообщений в общем документе могут сместиться.
+        logger.debug("Не удалось распарсить сообщения одним документом, парсю по отдельности.")
+        return [BeautifulSoup(i["html"].replace("<br>", "\n"), "lxml") for i in json_messages]
+
+    def parse_html(self, html: str) -> Any:
+        """
+        Парсит HTML-страницу FunPay выбранным парсером (см. параметр html_parser).
+
+        :param html: HTML-код страницы.
+        :type html: :obj:`str`
+
+        :return: дерево страницы с интерфейсом :class:`bs4.BeautifulSoup`.
+        """
+        return self.__html_parser(html)
+
     def __update_csrf_token(self, parser: BeautifulSoup):
         try:
             app_data = json.loads(parser.find("body").get("data-app-data"))
@@ -0,0 +1,105 @@
+"""
+В данном модуле описана асинхронная обертка над :class:`FunPayAPI.account.Account`.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Literal, Optional, TypeVar
+
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import asyncio
+
+from .account import Account
+
+T = TypeVar("T")
+
+
+class AsyncAccount:
+    """
+    Асинхронная версия :class:`FunPayAPI.account.Account`.
+
+    Повторяет все публичные методы :class:`FunPayAPI.account.Account`: методы, отправляющие запросы к FunPay,
+    становятся корутинами и выполняются в пуле потоков (парсинг остается тем же, что и в синхронном классе),
+    остальные методы и свойства доступны напрямую.
+    Благодаря этому один event loop может одновременно опрашивать Runner, получать истории чатов, отправлять сообщения
+    и выполнять другие запросы.
+
+    !Внимание! Методы, временно меняющие язык аккаунта (параметр locale), не стоит вызывать параллельно.
+
+    :param golden_key: токен (golden_key) аккаунта.
+    :type golden_key: :obj:`str`
+
+    :param max_workers: макс. кол-во одновременно выполняемых запросов.
+    :type max_workers: :obj:`int`, опционально
+
+    :param kwargs: остальные параметры :class:`FunPayAPI.account.Account`.
+    """
+
+    ASYNC_METHODS: frozenset[str] = frozenset({
+        "method", "get", "get_subcategory_public_lots", "get_my_subcategory_lots", "get_lot_page", "get_balance",
+        "get_chat_history", "get_chats_histories", "upload_image", "send_message", "send_image", "send_review",
+        "delete_review", "refund", "withdraw", "get_raise_modal", "raise_lots", "get_user", "get_chat",
+        "get_order_shortcut", "get_order", "get_sales", "get_sells", "request_chats", "get_chats",
+        "get_chat_by_name", "get_chat_by_id", "calc", "get_lot_fields", "get_chip_fields", "save_offer", "save_chip",
+        "save_lot", "delete_lot", "get_exchange_rate", "logout"
+    })
+    """Методы :class:`FunPayAPI.account.Account`, которые выполняются асинхронно."""
+
+    def __init__(self, golden_key: str, user_agent: str | None = None,
+                 requests_timeout: int | float = 10, proxy: Optional[dict] = None,
+                 locale: Literal["ru", "en", "uk"] | None = None, max_workers: int = 10, **kwargs):
+        kwargs.setdefault("pool_maxsize", max_workers)
+        self.account: Account = Account(golden_key, user_agent, requests_timeout, proxy, locale, **kwargs)
+        """Экземпляр синхронного аккаунта."""
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers, thread_name_prefix="FunPayAPI")
+        """Пул потоков, в котором выполняются запросы."""
+
+    @classmethod
+    def from_account(cls, account: Account, max_workers: int = 10) -> AsyncAccount:
+        """
+        Создает асинхронную обертку над уже существующим аккаунтом.
+
+        :param account: экземпляр аккаунта.
+        :type account: :class:`FunPayAPI.account.Account`
+
+        :param max_workers: макс. кол-во одновременно выполняемых запросов.
+        :type max_workers: :obj:`int`, опционально
+
+        :return: асинхронный аккаунт.
+        :rtype: :class:`FunPayAPI.async_account.AsyncAccount`
+        """
+        obj = cls.__new__(cls)
+        obj.account = account
+        obj.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="FunPayAPI")
+        return obj
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Выполняет синхронную функцию в пуле потоков аккаунта.
+
+        :param func: функция.
+        :type func: :obj:`Callable`
+
+        :return: результат выполнения функции.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def close(self):
+        """
+        Останавливает пул потоков и закрывает соединения аккаунта.
+        """
+        await self.run(self.account.close)
+        self.executor.shutdown(wait=False)
+
+    def __getattr__(self, item: str) -> Any:
+        if item in ("account", "executor"):
+            raise AttributeError(item)
+        attr = getattr(self.account, item)
+        if item not in self.ASYNC_METHODS:
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        return wrapper
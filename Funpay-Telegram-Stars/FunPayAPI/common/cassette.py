@@ -0,0 +1,376 @@
+"""
+В данном модуле описаны "кассеты" - запись HTTP-ответов в сжатый файл и их воспроизведение без доступа к сети.
+
+Кассета подключается вместо HTTP-сессии (:class:`FunPayAPI.account.Account`, параметр session), поэтому
+:meth:`FunPayAPI.account.Account.method` и всё, что над ним (парсинг, :class:`FunPayAPI.updater.runner.Runner`),
+работают без изменений::
+
+    cassette = Cassette("funpay.cassette.gz", load=False)
+    account = Account(golden_key, session=cassette.recorder())   # запись реальных ответов
+    ...
+    cassette.save()
+
+    account = Account(golden_key, session=Cassette("funpay.cassette.gz").player(speed=0))   # воспроизведение
+
+Ответы воспроизводятся по порядку отдельно для каждого ключа (метод, ссылка, хэш тела запроса), поэтому повторный
+прогон детерминирован, а POST-запросы на одну ссылку с разными телами (например, runner с разными objects)
+не путаются между собой.
+Заголовки запросов (в т.ч. cookie с golden_key) и Set-Cookie ответов не сохраняются, но тела ответов содержат
+данные аккаунта - не публикуйте кассеты.
+"""
+from __future__ import annotations
+
+from collections import defaultdict, deque
+from typing import Any, Literal
+import threading
+import hashlib
+import logging
+import base64
+import gzip
+import json
+import time
+import os
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger("FunPayAPI.cassette")
+
+
+class CassetteError(Exception):
+    """
+    Исключение, которое возбуждается, если в кассете нет ответа на запрос.
+    """
+    def __init__(self, method: str, url: str, body: str = ""):
+        self.method = method
+        self.url = url
+        self.body = body
+
+    def __str__(self):
+        body = f" (тело {self.body})" if self.body else ""
+        return f"В кассете нет (больше) ответов на запрос {self.method} {self.url}{body}."
+
+
+class Cassette:
+    """
+    Набор записанных HTTP-ответов (gzip + JSON).
+
+    :param path: путь до файла кассеты.
+    :type path: :obj:`str`
+
+    :param load: загрузить ли записи из файла, если он существует (для новой записи - False).
+    :type load: :obj:`bool`, опционально
+    """
+    VERSION: int = 2
+    """Версия формата файла."""
+
+    BODY_FIELDS: tuple[str, ...] = ("objects", "request")
+    """Поля формы, по которым различаются запросы на одну ссылку (csrf_token и т.п. меняются между запусками)."""
+
+    SECRET_FIELDS: tuple[str, ...] = ("api_key", "phone_number", "mnemonics", "token", "password")
+    """Поля JSON-тела, не влияющие на хэш: кассета воспроизводится и с другими учётными данными."""
+
+    def __init__(self, path: str, load: bool = True):
+        self.path: str = path
+        """Путь до файла кассеты."""
+        self.interactions: list[dict[str, Any]] = []
+        """Записанные ответы в порядке получения."""
+        self.__lock = threading.Lock()
+        if load and os.path.exists(path):
+            self.load()
+
+    @classmethod
+    def body_digest(cls, data: Any = None, json_body: Any = None) -> str:
+        """
+        Стабильный хэш тела запроса: JSON-тело без :attr:`FunPayAPI.common.cassette.Cassette.SECRET_FIELDS`
+        или поля формы из :attr:`FunPayAPI.common.cassette.Cassette.BODY_FIELDS`.
+
+        :param data: тело формы (:obj:`dict`, список пар или строка).
+        :type data: :obj:`Any`, опционально
+
+        :param json_body: JSON-тело запроса.
+        :type json_body: :obj:`Any`, опционально
+
+        :return: первые 16 символов sha1 или пустая строка, если значимых полей нет.
+        :rtype: :obj:`str`
+        """
+        if isinstance(json_body, dict):
+            payload = {k: v for k, v in json_body.items() if k not in cls.SECRET_FIELDS}
+        elif json_body is not None:
+            payload = json_body
+        elif isinstance(data, (dict, list, tuple)):
+            pairs = data.items() if isinstance(data, dict) else data
+            payload = sorted([str(k), str(v)] for k, v in pairs if k in cls.BODY_FIELDS)
+        else:
+            payload = None
+        if not payload:
+            return ""
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def key(method: str, url: str, body: str = "") -> tuple[str, str, str]:
+        """
+        Ключ, по которому сопоставляются запрос и записанный ответ.
+
+        :param body: хэш тела запроса (:meth:`FunPayAPI.common.cassette.Cassette.body_digest`).
+        :type body: :obj:`str`, опционально
+
+        :rtype: :obj:`tuple` (:obj:`str`, :obj:`str`, :obj:`str`)
+        """
+        return method.upper(), url, body
+
+    def load(self):
+        """
+        Загружает записи из файла кассеты.
+        """
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != self.VERSION:
+            raise ValueError(f"Неподдерживаемая версия кассеты {self.path}: {data.get('version')}.")
+        with self.__lock:
+            self.interactions = data["interactions"]
+
+    def save(self, path: str | None = None):
+        """
+        Сохраняет записи в файл кассеты (атомарно: через временный файл).
+
+        :param path: путь до файла (по умолчанию - :attr:`FunPayAPI.common.cassette.Cassette.path`).
+        :type path: :obj:`str` or :obj:`None`, опционально
+        """
+        path = path or self.path
+        with self.__lock:
+            data = {"version": self.VERSION, "interactions": list(self.interactions)}
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def append(self, method: str, url: str, response: requests.Response, elapsed: float, body: str = ""):
+        """
+        Добавляет ответ в кассету.
+
+        :param method: метод запроса.
+        :type method: :obj:`str`
+
+        :param url: ссылка запроса.
+        :type url: :obj:`str`
+
+        :param response: ответ.
+        :type response: :class:`requests.Response`
+
+        :param elapsed: время выполнения запроса (в секундах).
+        :type elapsed: :obj:`float`
+
+        :param body: хэш тела запроса (:meth:`FunPayAPI.common.cassette.Cassette.body_digest`).
+        :type body: :obj:`str`, опционально
+        """
+        headers = {k: v for k, v in response.headers.items() if k.lower() != "set-cookie"}
+        with self.__lock:
+            self.interactions.append({
+                "method": method.upper(),
+                "url": url,
+                "body": body,
+                "status": response.status_code,
+                "headers": headers,
+                "content": base64.b64encode(response.content).decode(),
+                "elapsed": elapsed
+            })
+
+    def recorder(self, session: requests.Session | None = None, flush_every: int = 500,
+                 max_interactions: int | None = None) -> RecordingSession:
+        """
+        Создает сессию, которая выполняет реальные запросы и записывает ответы в кассету.
+
+        :param session: HTTP-сессия для реальных запросов (по умолчанию - :func:`FunPayAPI.account.create_session`).
+        :type session: :class:`requests.Session` or :obj:`None`, опционально
+
+        :param flush_every: сохранять кассету в файл каждые N новых ответов (0 - только при закрытии сессии).
+        :type flush_every: :obj:`int`, опционально
+
+        :param max_interactions: максимальное кол-во записей; после него запросы выполняются без записи.
+        :type max_interactions: :obj:`int` or :obj:`None`, опционально
+
+        :rtype: :class:`FunPayAPI.common.cassette.RecordingSession`
+        """
+        if session is None:
+            from ..account import create_session
+            session = create_session()
+        return RecordingSession(self, session, flush_every, max_interactions)
+
+    def player(self, speed: float = 1.0, on_missing: Literal["raise", "repeat"] = "raise") -> ReplaySession:
+        """
+        Создает сессию, которая отвечает записанными ответами без обращения к сети.
+
+        :param speed: множитель задержки ответа относительно записанной (1 - как при записи, 0 - без задержек).
+        :type speed: :obj:`float`, опционально
+
+        :param on_missing: что делать, если ответы на запрос закончились: "raise" -
+            :class:`FunPayAPI.common.cassette.CassetteError`, "repeat" - повторить последний ответ на такой запрос.
+        :type on_missing: :obj:`str`, опционально
+
+        :rtype: :class:`FunPayAPI.common.cassette.ReplaySession`
+        """
+        return ReplaySession(self, speed, on_missing)
+
+
+class RecordingSession:
+    """
+    Обертка над HTTP-сессией, записывающая ответы в кассету. Остальные атрибуты делегируются сессии.
+
+    :param cassette: кассета.
+    :type cassette: :class:`FunPayAPI.common.cassette.Cassette`
+
+    :param session: HTTP-сессия.
+    :type session: :class:`requests.Session`
+
+    :param flush_every: сохранять кассету каждые N новых ответов (0 - только при закрытии сессии).
+    :type flush_every: :obj:`int`, опционально
+
+    :param max_interactions: максимальное кол-во записей в кассете (:obj:`None` - без ограничения).
+    :type max_interactions: :obj:`int` or :obj:`None`, опционально
+    """
+    def __init__(self, cassette: Cassette, session: requests.Session, flush_every: int = 500,
+                 max_interactions: int | None = None):
+        self.cassette: Cassette = cassette
+        """Кассета."""
+        self.session: requests.Session = session
+        """HTTP-сессия для реальных запросов."""
+        self.flush_every: int = flush_every
+        """Сохранять кассету каждые N новых ответов."""
+        self.max_interactions: int | None = max_interactions
+        """Максимальное кол-во записей в кассете."""
+
+        self.__unsaved = 0
+        self.__full = False
+        self.__lock = threading.Lock()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        response = self.session.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self.__lock:
+            if self.max_interactions is not None and len(self.cassette.interactions) >= self.max_interactions:
+                if self.__full:
+                    return response
+                self.__full = True
+                logger.warning(f"Кассета {self.cassette.path} заполнена ({self.max_interactions} записей), "
+                               f"дальнейшие ответы не записываются.")
+                flush = self.__unsaved > 0
+            else:
+                body = Cassette.body_digest(kwargs.get("data"), kwargs.get("json"))
+                self.cassette.append(method, url, response, elapsed, body)
+                self.__unsaved += 1
+                flush = bool(self.flush_every) and self.__unsaved >= self.flush_every
+            if flush:
+                self.__unsaved = 0
+        if flush:
+            self.flush()
+        return response
+
+    def flush(self):
+        """
+        Сохраняет записанные ответы в файл кассеты, не прерывая запись.
+        """
+        try:
+            self.cassette.save()
+        except:
+            logger.warning(f"Не удалось сохранить кассету {self.cassette.path}.")
+            logger.debug("TRACEBACK", exc_info=True)
+
+    def close(self):
+        """
+        Сохраняет кассету и закрывает сессию.
+        """
+        self.cassette.save()
+        self.session.close()
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self.session, item)
+
+
+class ReplaySession:
+    """
+    Сессия, отвечающая записанными ответами из кассеты (совместима с используемой пакетом частью
+    :class:`requests.Session`).
+
+    :param cassette: кассета.
+    :type cassette: :class:`FunPayAPI.common.cassette.Cassette`
+
+    :param speed: множитель задержки ответа относительно записанной (0 - без задержек).
+    :type speed: :obj:`float`, опционально
+
+    :param on_missing: "raise" или "repeat" (см. :meth:`FunPayAPI.common.cassette.Cassette.player`).
+    :type on_missing: :obj:`str`, опционально
+    """
+    def __init__(self, cassette: Cassette, speed: float = 1.0, on_missing: Literal["raise", "repeat"] = "raise"):
+        self.cassette: Cassette = cassette
+        """Кассета."""
+        self.speed: float = speed
+        """Множитель задержки ответа."""
+        self.on_missing: Literal["raise", "repeat"] = on_missing
+        """Поведение при отсутствии ответа."""
+        self.headers: CaseInsensitiveDict = CaseInsensitiveDict()
+        """Заголовки сессии (для совместимости с :class:`requests.Session`)."""
+        self.adapters: dict = {}
+        """Адаптеры (для совместимости с :class:`requests.Session`, пул соединений не используется)."""
+        self.replayed: int = 0
+        """Кол-во воспроизведенных ответов."""
+
+        self.__queues: dict[tuple[str, str, str], deque[dict]] = defaultdict(deque)
+        self.__last: dict[tuple[str, str, str], dict] = {}
+        self.__lock = threading.Lock()
+        for interaction in cassette.interactions:
+            key = Cassette.key(interaction["method"], interaction["url"], interaction["body"])
+            self.__queues[key].append(interaction)
+
+    def request(self, method: str, url: str, headers: dict | None = None, data: Any = None,
+                json: Any = None, **kwargs) -> requests.Response:
+        body = Cassette.body_digest(data, json)
+        key = Cassette.key(method, url, body)
+        with self.__lock:
+            queue = self.__queues.get(key)
+            if queue:
+                interaction = queue.popleft()
+                self.__last[key] = interaction
+            elif self.on_missing == "repeat" and key in self.__last:
+                interaction = self.__last[key]
+            else:
+                raise CassetteError(method, url, body)
+            self.replayed += 1
+        if self.speed > 0 and interaction["elapsed"] > 0:
+            time.sleep(interaction["elapsed"] * self.speed)
+        return self.build_response(method, url, headers, interaction)
+
+    @staticmethod
+    def build_response(method: str, url: str, headers: dict | None, interaction: dict) -> requests.Response:
+        """
+        Создает объект ответа из записи кассеты.
+
+        :rtype: :class:`requests.Response`
+        """
+        request = requests.PreparedRequest()
+        request.method, request.url, request.body = method.upper(), url, None
+        request.headers = CaseInsensitiveDict(headers or {})
+
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        response._content = base64.b64decode(interaction["content"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = url
+        response.request = request
+        response.reason = "Replayed"
+        return response
+
+    def remaining(self) -> int:
+        """
+        Кол-во еще не воспроизведенных ответов.
+
+        :rtype: :obj:`int`
+        """
+        with self.__lock:
+            return sum(len(i) for i in self.__queues.values())
+
+    def close(self):
+        pass
@@ -0,0 +1,204 @@
+"""
+В данном модуле описан предохранитель (circuit breaker) для запросов к внешним сервисам.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Literal, TypeVar
+import threading
+import logging
+import time
+
+from .exceptions import CircuitOpenError
+
+logger = logging.getLogger("FunPayAPI.circuit_breaker")
+T = TypeVar("T")
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для запросов к сервису.
+
+    * closed - запросы проходят; после failure_threshold ошибок или медленных (дольше slow_call_threshold секунд)
+      вызовов подряд предохранитель размыкается.
+    * open - запросы сразу завершаются :class:`FunPayAPI.common.exceptions.CircuitOpenError`, не дожидаясь тайм-аута
+      сервиса. Через reset_timeout секунд предохранитель переходит в half_open.
+    * half_open - пропускается не более half_open_probes пробных запросов одновременно: успешный пробный запрос
+      замыкает предохранитель, ошибка - снова размыкает.
+
+    :param name: название (для логов и мониторинга).
+    :type name: :obj:`str`
+
+    :param failure_threshold: кол-во ошибок / медленных вызовов подряд, после которого предохранитель размыкается.
+    :type failure_threshold: :obj:`int`, опционально
+
+    :param reset_timeout: через сколько секунд после размыкания пропускать пробные запросы.
+    :type reset_timeout: :obj:`int` or :obj:`float`, опционально
+
+    :param slow_call_threshold: вызов дольше этого времени (в секундах) считается ошибкой (None - не учитывать).
+    :type slow_call_threshold: :obj:`int` or :obj:`float` or :obj:`None`, опционально
+
+    :param half_open_probes: кол-во одновременных пробных запросов в состоянии half_open.
+    :type half_open_probes: :obj:`int`, опционально
+
+    :param on_state_change: функция, вызываемая при смене состояния (название, старое состояние, новое состояние).
+    :type on_state_change: :obj:`Callable` or :obj:`None`, опционально
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: int | float = 30,
+                 slow_call_threshold: int | float | None = None, half_open_probes: int = 1,
+                 on_state_change: Callable[[str, str, str], Any] | None = None):
+        self.name: str = name
+        """Название предохранителя."""
+        self.failure_threshold: int = failure_threshold
+        """Кол-во ошибок подряд, после которого предохранитель размыкается."""
+        self.reset_timeout: int | float = reset_timeout
+        """Через сколько секунд после размыкания пропускать пробные запросы."""
+        self.slow_call_threshold: int | float | None = slow_call_threshold
+        """Вызов дольше этого времени (в секундах) считается ошибкой."""
+        self.half_open_probes: int = half_open_probes
+        """Кол-во одновременных пробных запросов в состоянии half_open."""
+        self.on_state_change: Callable[[str, str, str], Any] | None = on_state_change
+        """Функция, вызываемая при смене состояния."""
+
+        self.calls: int = 0
+        """Кол-во пропущенных вызовов."""
+        self.failures: int = 0
+        """Кол-во ошибок (в т.ч. медленных вызовов) за все время."""
+        self.rejected: int = 0
+        """Кол-во запросов, отклоненных без отправки."""
+        self.trips: int = 0
+        """Сколько раз предохранитель размыкался."""
+
+        self.__state: Literal["closed", "open", "half_open"] = "closed"
+        self.__consecutive_failures: int = 0
+        self.__opened_at: float = 0
+        self.__probes: int = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        """
+        Текущее состояние предохранителя ("closed", "open" или "half_open").
+
+        :rtype: :obj:`str`
+        """
+        with self.__lock:
+            self.__refresh()
+            return self.__state
+
+    def retry_after(self) -> float:
+        """
+        Через сколько секунд предохранитель начнет пропускать пробные запросы (0 - уже пропускает).
+
+        :rtype: :obj:`float`
+        """
+        with self.__lock:
+            if self.__state != "open":
+                return 0
+            return max(self.__opened_at + self.reset_timeout - time.time(), 0)
+
+    def before_call(self):
+        """
+        Проверяет, можно ли выполнить запрос, и регистрирует его.
+        После запроса необходимо вызвать :meth:`FunPayAPI.common.circuit_breaker.CircuitBreaker.record`.
+
+        :raises: :class:`FunPayAPI.common.exceptions.CircuitOpenError`, если запрос выполнять нельзя.
+        """
+        with self.__lock:
+            self.__refresh()
+            if self.__state == "open" or (self.__state == "half_open" and self.__probes >= self.half_open_probes):
+                self.rejected += 1
+                raise CircuitOpenError(self.name, max(self.__opened_at + self.reset_timeout - time.time(), 0))
+            if self.__state == "half_open":
+                self.__probes += 1
+            self.calls += 1
+
+    def record(self, success: bool, duration: float = 0):
+        """
+        Регистрирует результат запроса, разрешенного :meth:`FunPayAPI.common.circuit_breaker.CircuitBreaker.before_call`.
+
+        :param success: успешен ли запрос.
+        :type success: :obj:`bool`
+
+        :param duration: длительность запроса (в секундах).
+        :type duration: :obj:`float`, опционально
+        """
+        if success and self.slow_call_threshold is not None and duration > self.slow_call_threshold:
+            success = False
+        with self.__lock:
+            if self.__state == "half_open":
+                self.__probes = max(self.__probes - 1, 0)
+            if success:
+                self.__consecutive_failures = 0
+                if self.__state == "half_open":
+                    self.__set_state("closed")
+                return
+            self.failures += 1
+            self.__consecutive_failures += 1
+            if self.__state == "half_open" or \
+                    (self.__state == "closed" and self.__consecutive_failures >= self.failure_threshold):
+                self.__opened_at = time.time()
+                self.trips += 1
+                self.__set_state("open")
+
+    def call(self, func: Callable[..., T], *args, is_failure: Callable[[T], bool] | None = None, **kwargs) -> T:
+        """
+        Выполняет функцию через предохранитель: исключение или is_failure(результат) == True считаются ошибкой.
+
+        :param func: функция.
+        :type func: :obj:`Callable`
+
+        :param is_failure: проверка результата.
+        :type is_failure: :obj:`Callable` or :obj:`None`, опционально
+
+        :return: результат функции.
+        """
+        self.before_call()
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except:
+            self.record(False, time.time() - start)
+            raise
+        self.record(not (is_failure and is_failure(result)), time.time() - start)
+        return result
+
+    def reset(self):
+        """
+        Принудительно замыкает предохранитель.
+        """
+        with self.__lock:
+            self.__consecutive_failures = 0
+            self.__probes = 0
+            self.__set_state("closed")
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Состояние и статистика предохранителя (для мониторинга).
+
+        :return: {"state", "consecutive_failures", "retry_after", "calls", "failures", "rejected", "trips"}
+        :rtype: :obj:`dict`
+        """
+        state = self.state
+        return {"state": state, "consecutive_failures": self.__consecutive_failures,
+                "retry_after": self.retry_after(), "calls": self.calls, "failures": self.failures,
+                "rejected": self.rejected, "trips": self.trips}
+
+    def __refresh(self):
+        if self.__state == "open" and time.time() - self.__opened_at >= self.reset_timeout:
+            self.__probes = 0
+            self.__set_state("half_open")
+
+    def __set_state(self, state: Literal["closed", "open", "half_open"]):
+        old_state, self.__state = self.__state, state
+        if old_state == state:
+            return
+        if state == "open":
+            logger.warning(f"Предохранитель {self.name} разомкнут после {self.__consecutive_failures} ошибок подряд, "
+                           f"пробный запрос через {self.reset_timeout} сек.")
+        else:
+            logger.info(f"Предохранитель {self.name}: {old_state} -> {state}.")
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(self.name, old_state, state)
+            except:
+                logger.debug("TRACEBACK", exc_info=True)
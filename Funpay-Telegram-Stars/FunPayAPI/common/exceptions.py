@@ -195,3 +195,23 @@ class RefundError(RequestFailedError):
     def short_str(self):
         return f"Не удалось вернуть средства по заказу {self.order_id}" \
                f"{f': {self.error_message}' if self.error_message else '.'}"
+
+
+class CircuitOpenError(Exception):
+    """
+    Исключение, которое возбуждается, если запрос не отправлен, т.к. предохранитель
+    (:class:`FunPayAPI.common.circuit_breaker.CircuitBreaker`) сервиса разомкнут после серии ошибок.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        """
+        :param name: название предохранителя.
+
+        :param retry_after: через сколько секунд предохранитель пропустит пробный запрос.
+        """
+        self.name = name
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f"Запросы к {self.name} временно приостановлены после серии ошибок " \
+               f"(повтор через {self.retry_after:.0f} сек.)."
@@ -0,0 +1,190 @@
+"""
+В данном модуле описаны парсеры HTML-страниц FunPay.
+
+По умолчанию страницы парсятся с помощью BeautifulSoup. Парсер "lxml" строит дерево напрямую через lxml.html
+и оборачивает его в :class:`FunPayAPI.common.parsers.LxmlTag`, который повторяет используемую пакетом часть API
+BeautifulSoup, поэтому методы :class:`FunPayAPI.account.Account` работают с любым парсером без изменений.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Iterator, Literal
+
+from bs4 import BeautifulSoup
+import lxml.html
+
+MULTI_VALUED_ATTRIBUTES = ("class", "rel", "rev", "accept-charset", "headers", "accesskey", "dropzone")
+"""Атрибуты, значения которых BeautifulSoup возвращает в виде списка."""
+
+
+class LxmlTag:
+    """
+    Обертка над элементом lxml с интерфейсом, совместимым с :class:`bs4.Tag`
+    (find, find_all, find_parent, find_previous, get, text, attrs, parent).
+
+    :param element: элемент lxml.
+    :type element: :class:`lxml.html.HtmlElement`
+    """
+
+    __slots__ = ("element",)
+
+    def __init__(self, element: lxml.html.HtmlElement):
+        self.element: lxml.html.HtmlElement = element
+        """Элемент lxml."""
+
+    @classmethod
+    def from_string(cls, html: str) -> LxmlTag:
+        """
+        Парсит HTML-документ.
+
+        :param html: HTML-код.
+        :type html: :obj:`str`
+
+        :return: корневой элемент документа.
+        :rtype: :class:`FunPayAPI.common.parsers.LxmlTag`
+        """
+        return cls(lxml.html.document_fromstring(html or "<html></html>"))
+
+    @property
+    def name(self) -> str:
+        return self.element.tag
+
+    @property
+    def text(self) -> str:
+        return self.element.text_content()
+
+    @property
+    def attrs(self) -> dict[str, str | list[str]]:
+        return {k: self.get(k) for k in self.element.attrib}
+
+    @property
+    def parent(self) -> LxmlTag | None:
+        parent = self.element.getparent()
+        return LxmlTag(parent) if parent is not None else None
+
+    def get(self, key: str, default: Any = None) -> str | list[str] | Any:
+        value = self.element.get(key)
+        if value is None:
+            return default
+        if key in MULTI_VALUED_ATTRIBUTES:
+            return value.split()
+        return value
+
+    def __getitem__(self, key: str) -> str | list[str]:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LxmlTag) and self.element is other.element
+
+    def __hash__(self) -> int:
+        return hash(self.element)
+
+    def __str__(self) -> str:
+        return lxml.html.tostring(self.element, encoding="unicode", with_tail=False)
+
+    def __repr__(self) -> str:
+        return str(self)
+
+    def find(self, name: str | Callable | None = None, attrs: dict | None = None, recursive: bool = True,
+             **kwargs) -> LxmlTag | None:
+        for element in self.__iter_matches(name, attrs, recursive, kwargs):
+            return LxmlTag(element)
+        return None
+
+    def find_all(self, name: str | Callable | None = None, attrs: dict | None = None, recursive: bool = True,
+                 **kwargs) -> list[LxmlTag]:
+        return [LxmlTag(element) for element in self.__iter_matches(name, attrs, recursive, kwargs)]
+
+    def find_parent(self, name: str | Callable | None = None, attrs: dict | None = None,
+                    **kwargs) -> LxmlTag | None:
+        filters = self.__filters(attrs, kwargs)
+        for element in self.element.iterancestors():
+            if self.__match(element, name, filters):
+                return LxmlTag(element)
+        return None
+
+    def find_previous(self, name: str | Callable | None = None, attrs: dict | None = None,
+                      **kwargs) -> LxmlTag | None:
+        filters = self.__filters(attrs, kwargs)
+        if isinstance(name, str) and not filters:
+            found = self.element.xpath(f"(preceding::{name} | ancestor::{name})[last()]")
+            return LxmlTag(found[0]) if found else None
+        # Предыдущие элементы документа: предки и все, что закончилось до начала текущего элемента.
+        for element in self.element.xpath("preceding::* | ancestor::*")[::-1]:
+            if self.__match(element, name, filters):
+                return LxmlTag(element)
+        return None
+
+    @staticmethod
+    def __filters(attrs: dict | None, kwargs: dict) -> dict:
+        filters = dict(attrs or {})
+        if "class_" in kwargs:
+            filters["class"] = kwargs.pop("class_")
+        filters.update(kwargs)
+        return filters
+
+    def __iter_matches(self, name: str | Callable | None, attrs: dict | None, recursive: bool,
+                       kwargs: dict) -> Iterator[lxml.html.HtmlElement]:
+        filters = self.__filters(attrs, kwargs)
+        if recursive:
+            elements = self.element.iterdescendants(name if isinstance(name, str) else None)
+        else:
+            elements = self.element.iterchildren(name if isinstance(name, str) else None)
+        for element in elements:
+            if self.__match(element, name, filters):
+                yield element
+
+    @staticmethod
+    def __match(element: lxml.html.HtmlElement, name: str | Callable | None, filters: dict) -> bool:
+        if not isinstance(element.tag, str):  # комментарии и инструкции обработки
+            return False
+        if isinstance(name, str):
+            if element.tag != name:
+                return False
+        elif callable(name) and not name(LxmlTag(element)):
+            return False
+        for key, expected in filters.items():
+            value = element.get(key)
+            if expected is True:
+                if value is None:
+                    return False
+            elif expected is False or expected is None:
+                if value is not None:
+                    return False
+            elif callable(expected):
+                if not expected(value):
+                    return False
+            elif value is None:
+                return False
+            elif key in MULTI_VALUED_ATTRIBUTES:
+                if expected not in value.split() and expected != " ".join(value.split()):
+                    return False
+            elif value != expected:
+                return False
+        return True
+
+
+HTML_PARSERS: dict[str, Callable[[str], Any]] = {
+    "bs4": lambda html: BeautifulSoup(html, "lxml"),
+    "lxml": LxmlTag.from_string
+}
+"""Доступные парсеры HTML-страниц."""
+
+
+def get_html_parser(parser: Literal["bs4", "lxml"] | Callable[[str], Any]) -> Callable[[str], Any]:
+    """
+    Возвращает функцию парсинга HTML по названию парсера.
+
+    :param parser: название парсера ("bs4" / "lxml") или собственная функция парсинга, возвращающая объект
+        с интерфейсом :class:`bs4.BeautifulSoup`.
+    :type parser: :obj:`str` or :obj:`Callable`
+
+    :return: функция парсинга HTML.
+    :rtype: :obj:`Callable`
+    """
+    if callable(parser):
+        return parser
+    if parser not in HTML_PARSERS:
+        raise ValueError(f"Неизвестный парсер HTML: {parser}. Доступные парсеры: {', '.join(HTML_PARSERS)}.")
+    return HTML_PARSERS[parser]
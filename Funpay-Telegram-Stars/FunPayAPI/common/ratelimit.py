@@ -0,0 +1,295 @@
+"""
+В данном модуле описаны ограничитель частоты запросов (token bucket по классам эндпоинтов FunPay) и политика
+повторных попыток, которые использует :meth:`FunPayAPI.account.Account.method`.
+"""
+from __future__ import annotations
+
+from email.utils import parsedate_to_datetime
+from typing import Any, Literal
+import threading
+import random
+import time
+
+import requests
+
+ENDPOINT_CLASSES: tuple[str, ...] = ("runner", "orders", "chat", "lots", "other")
+"""Классы эндпоинтов FunPay, для которых ведутся отдельные лимиты."""
+
+
+def classify_endpoint(url: str) -> str:
+    """
+    Определяет класс эндпоинта FunPay по ссылке.
+
+    :param url: ссылка или метод API (например, "runner/", "https://funpay.com/en/orders/ABCDEFGH/").
+    :type url: :obj:`str`
+
+    :return: класс эндпоинта (см. :obj:`FunPayAPI.common.ratelimit.ENDPOINT_CLASSES`).
+    :rtype: :obj:`str`
+    """
+    path = url.split("://", 1)[-1]
+    if "://" in url:
+        path = path.split("/", 1)[1] if "/" in path else ""
+    for locale in ("en/", "uk/"):
+        if path.startswith(locale):
+            path = path[len(locale):]
+            break
+    if path.startswith("runner"):
+        return "runner"
+    if path.startswith("orders"):
+        return "orders"
+    if path.startswith("chat"):
+        return "chat"
+    if path.startswith(("lots", "chips")):
+        return "lots"
+    return "other"
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов по алгоритму token bucket: в среднем не более rate запросов в секунду,
+    кратковременно - до burst запросов подряд. Потокобезопасен.
+
+    :param rate: кол-во запросов в секунду.
+    :type rate: :obj:`int` or :obj:`float`
+
+    :param burst: размер "корзины" (макс. кол-во запросов подряд без ожидания).
+    :type burst: :obj:`int`
+    """
+    def __init__(self, rate: int | float, burst: int):
+        self.rate: int | float = rate
+        """Кол-во запросов в секунду."""
+        self.burst: int = burst
+        """Макс. кол-во запросов подряд без ожидания."""
+        self.waited: float = 0
+        """Суммарное время ожидания (в секундах)."""
+        self.acquired: int = 0
+        """Кол-во выданных разрешений."""
+
+        self.__tokens: float = burst
+        self.__updated: float = time.monotonic()
+        self.__paused_until: float = 0
+        self.__lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Забирает токен и возвращает, сколько нужно подождать перед запросом (не ожидая).
+
+        :return: время ожидания (в секундах).
+        :rtype: :obj:`float`
+        """
+        with self.__lock:
+            now = time.monotonic()
+            # во время паузы __updated указывает на ее конец: токены начинают копиться только после нее
+            if now > self.__updated:
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+            self.__tokens -= 1
+            wait = self.__updated - now
+            if self.__tokens < 0:
+                wait += -self.__tokens / self.rate if self.rate > 0 else 0
+            self.acquired += 1
+            self.waited += wait
+            return wait
+
+    def acquire(self):
+        """
+        Ожидает разрешения на запрос.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: int | float):
+        """
+        Приостанавливает выдачу разрешений (например, после 429 ошибки) и сбрасывает накопленные токены.
+
+        :param seconds: длительность паузы (в секундах).
+        :type seconds: :obj:`int` or :obj:`float`
+        """
+        with self.__lock:
+            now = time.monotonic()
+            if now > self.__updated:
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+            self.__paused_until = max(self.__paused_until, now + seconds)
+            self.__updated = max(self.__updated, self.__paused_until)
+            # после паузы разрешаем один запрос, остальные - с обычным интервалом
+            self.__tokens = min(self.__tokens, 1)
+
+    @property
+    def paused_for(self) -> float:
+        """
+        Сколько секунд еще длится пауза.
+
+        :rtype: :obj:`float`
+        """
+        return max(self.__paused_until - time.monotonic(), 0)
+
+
+class RateLimiter:
+    """
+    Набор :class:`FunPayAPI.common.ratelimit.TokenBucket` по классам эндпоинтов FunPay.
+
+    :param limits: лимиты {класс эндпоинта: (запросов в секунду, burst)}; отсутствующие классы берутся из
+        :attr:`FunPayAPI.common.ratelimit.RateLimiter.DEFAULT_LIMITS`, None вместо лимита - без ограничений.
+    :type limits: :obj:`dict` {:obj:`str`: :obj:`tuple` or :obj:`None`} or :obj:`None`, опционально
+    """
+    DEFAULT_LIMITS: dict[str, tuple[float, int]] = {
+        "runner": (2, 5),
+        "orders": (1, 3),
+        "chat": (2, 4),
+        "lots": (1, 3),
+        "other": (2, 5)
+    }
+    """Лимиты по умолчанию {класс эндпоинта: (запросов в секунду, burst)}."""
+
+    def __init__(self, limits: dict[str, tuple[float, int] | None] | None = None):
+        limits = {**self.DEFAULT_LIMITS, **(limits or {})}
+        self.buckets: dict[str, TokenBucket] = {endpoint: TokenBucket(*limit) for endpoint, limit in limits.items()
+                                                if limit is not None}
+        """Ограничители по классам эндпоинтов."""
+        self.throttled: dict[str, int] = {endpoint: 0 for endpoint in limits}
+        """Кол-во 429 ответов по классам эндпоинтов."""
+
+    def acquire(self, endpoint: str):
+        """
+        Ожидает разрешения на запрос к эндпоинту.
+
+        :param endpoint: класс эндпоинта.
+        :type endpoint: :obj:`str`
+        """
+        if bucket := self.buckets.get(endpoint):
+            bucket.acquire()
+
+    def throttle(self, endpoint: str, seconds: int | float):
+        """
+        Приостанавливает запросы к классу эндпоинтов после 429 ответа.
+
+        :param endpoint: класс эндпоинта.
+        :type endpoint: :obj:`str`
+
+        :param seconds: длительность паузы (в секундах).
+        :type seconds: :obj:`int` or :obj:`float`
+        """
+        self.throttled[endpoint] = self.throttled.get(endpoint, 0) + 1
+        if bucket := self.buckets.get(endpoint):
+            bucket.pause(seconds)
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        """
+        Статистика ограничителей.
+
+        :return: {класс эндпоинта: {"rate", "burst", "requests", "waited", "throttled", "paused_for"}}
+        :rtype: :obj:`dict`
+        """
+        return {endpoint: {"rate": bucket.rate, "burst": bucket.burst, "requests": bucket.acquired,
+                           "waited": bucket.waited, "throttled": self.throttled.get(endpoint, 0),
+                           "paused_for": bucket.paused_for}
+                for endpoint, bucket in self.buckets.items()}
+
+
+class RetryPolicy:
+    """
+    Политика повторных попыток запросов к FunPay: экспоненциальная задержка со случайным разбросом (full jitter)
+    и учет заголовка Retry-After.
+
+    Ответ 429 означает, что запрос не был обработан, поэтому он повторяется для любого метода. Ошибки 5xx и
+    ошибки соединения повторяются только для идемпотентных запросов (GET и запросы к runner/ без отправки
+    сообщения), чтобы не отправить дважды сообщение, возврат и т.п.
+
+    :param max_attempts: макс. кол-во попыток (включая первую).
+    :type max_attempts: :obj:`int`, опционально
+
+    :param base_delay: базовая задержка (в секундах).
+    :type base_delay: :obj:`int` or :obj:`float`, опционально
+
+    :param max_delay: макс. задержка (в секундах).
+    :type max_delay: :obj:`int` or :obj:`float`, опционально
+
+    :param retry_statuses: статус-коды, при которых запрос повторяется.
+    :type retry_statuses: :obj:`frozenset` of :obj:`int`, опционально
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: int | float = 0.5, max_delay: int | float = 30,
+                 retry_statuses: frozenset[int] = frozenset({429, 500, 502, 503, 504})):
+        self.max_attempts: int = max_attempts
+        """Макс. кол-во попыток (включая первую)."""
+        self.base_delay: int | float = base_delay
+        """Базовая задержка (в секундах)."""
+        self.max_delay: int | float = max_delay
+        """Макс. задержка (в секундах)."""
+        self.retry_statuses: frozenset[int] = retry_statuses
+        """Статус-коды, при которых запрос повторяется."""
+
+    @staticmethod
+    def is_idempotent(request_method: Literal["post", "get"], endpoint: str, payload: Any = None) -> bool:
+        """
+        Безопасно ли повторять запрос, который мог дойти до FunPay?
+        POST-запрос к runner/ идемпотентен, если в нем нет действия (поле "request" - отправка сообщения).
+
+        :rtype: :obj:`bool`
+        """
+        if request_method == "get":
+            return True
+        return endpoint == "runner" and isinstance(payload, dict) and not payload.get("request")
+
+    def should_retry(self, attempt: int, idempotent: bool, response: requests.Response | None = None) -> bool:
+        """
+        Нужно ли повторить запрос?
+
+        :param attempt: номер завершившейся попытки (с 1).
+        :type attempt: :obj:`int`
+
+        :param idempotent: безопасно ли повторять запрос (см.
+            :meth:`FunPayAPI.common.ratelimit.RetryPolicy.is_idempotent`).
+        :type idempotent: :obj:`bool`
+
+        :param response: ответ или None, если запрос завершился ошибкой соединения.
+        :type response: :class:`requests.Response` or :obj:`None`, опционально
+
+        :rtype: :obj:`bool`
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if response is None:
+            return idempotent
+        if response.status_code == 429:
+            return True
+        return response.status_code in self.retry_statuses and idempotent
+
+    def get_delay(self, attempt: int, response: requests.Response | None = None) -> float:
+        """
+        Задержка перед следующей попыткой: Retry-After, если FunPay его указал, иначе случайное значение
+        от 0 до base_delay * 2 ** (attempt - 1) (но не больше max_delay).
+
+        :param attempt: номер завершившейся попытки (с 1).
+        :type attempt: :obj:`int`
+
+        :param response: ответ.
+        :type response: :class:`requests.Response` or :obj:`None`, опционально
+
+        :return: задержка (в секундах).
+        :rtype: :obj:`float`
+        """
+        retry_after = self.parse_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.base_delay * 2 ** (attempt - 1), self.max_delay))
+
+    @staticmethod
+    def parse_retry_after(response: requests.Response) -> float | None:
+        """
+        Парсит заголовок Retry-After (кол-во секунд или HTTP-дата).
+
+        :return: задержка (в секундах) или None, если заголовка нет.
+        :rtype: :obj:`float` or :obj:`None`
+        """
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,808 @@
+"""
+В данном модуле описан локальный симулятор FunPay для нагрузочного тестирования.
+
+:class:`FunPayAPI.common.simulator.FunPaySimulator` - HTTP-сервер, который отвечает на используемые пакетом эндпоинты
+(главная страница, runner/, orders/trade, orders/{id}/, orders/refund, chat/history, lots/{id}/trade,
+lots/offerEdit, lots/offerSave) разметкой, которую разбирает :class:`FunPayAPI.account.Account`, с заданной частотой
+генерирует заказы и сообщения в чатах и ведет покупателей по диалогу с ботом, замеряя время ответа бота.
+Дополнительно симулируется используемая bot_fragment.py часть API Fragment (префикс /fragment/v1).
+
+Аккаунт направляется на симулятор через сессию (ссылки https://funpay.com/... переписываются на адрес
+симулятора)::
+
+    simulator = FunPaySimulator(orders_per_minute=30, messages_per_second=2).start()
+    account = Account("golden_key", session=simulator.session()).get()
+    ...
+    print(simulator.stats())
+
+Симулятор воспроизводит только ту часть разметки FunPay, которую разбирает пакет.
+Запуск отдельным процессом: python -m FunPayAPI.common.simulator --port 8080 --orders-per-minute 30
+"""
+from __future__ import annotations
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from collections import deque
+from datetime import datetime
+from typing import Any
+import threading
+import logging
+import random
+import heapq
+import html
+import json
+import time
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .utils import random_tag, MONTHS
+
+logger = logging.getLogger("FunPayAPI.simulator")
+
+FUNPAY_URL = "https://funpay.com/"
+"""Ссылка FunPay, которую переписывает :class:`FunPayAPI.common.simulator.SimulatorAdapter`."""
+
+DEFAULT_BUYER_SCRIPT: tuple[str, ...] = ("@{tag}", "+")
+"""Ответы покупателя по умолчанию (диалог bot_fragment.py: Telegram-тег, затем подтверждение)."""
+
+NOISE_MESSAGES: tuple[str, ...] = ("Здравствуйте", "Есть в наличии?", "Сколько ждать?", "Спасибо", "Добрый день!")
+"""Сообщения покупателей без заказов (фоновый трафик чатов)."""
+
+ORDER_RE = re.compile(r"orders/([A-Z0-9]{8})/")
+LOTS_TRADE_RE = re.compile(r"lots/(\d+)/trade")
+FRAGMENT_USER_RE = re.compile(r"fragment/v1/misc/user/([^/]+)/")
+
+
+class SimulatorAdapter(HTTPAdapter):
+    """
+    Адаптер, отправляющий запросы к https://funpay.com/ на адрес симулятора.
+
+    :param base_url: адрес симулятора (например, "http://127.0.0.1:8080").
+    :type base_url: :obj:`str`
+    """
+    def __init__(self, base_url: str, **kwargs):
+        self.base_url: str = base_url.rstrip("/") + "/"
+        """Адрес симулятора."""
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if request.url.startswith(FUNPAY_URL):
+            request.url = self.base_url + request.url[len(FUNPAY_URL):]
+        # симулятор локальный - прокси аккаунта / окружения не используются
+        kwargs["proxies"] = {}
+        return super().send(request, **kwargs)
+
+
+def simulator_session(base_url: str, session: requests.Session | None = None, **adapter_kwargs) -> requests.Session:
+    """
+    Создает HTTP-сессию для :class:`FunPayAPI.account.Account`, запросы которой к FunPay уходят на симулятор.
+
+    :param base_url: адрес симулятора (например, "http://127.0.0.1:8080").
+    :type base_url: :obj:`str`
+
+    :param session: сессия, в которую нужно подключить адаптер (по умолчанию - :func:`FunPayAPI.account.create_session`).
+    :type session: :class:`requests.Session` or :obj:`None`, опционально
+
+    :param adapter_kwargs: параметры :class:`requests.adapters.HTTPAdapter` (pool_connections, pool_maxsize, ...).
+
+    :rtype: :class:`requests.Session`
+    """
+    if session is None:
+        from ..account import create_session
+        session = create_session()
+    session.mount(FUNPAY_URL, SimulatorAdapter(base_url, **adapter_kwargs))
+    return session
+
+
+def summarize(values: list[float] | deque[float]) -> dict[str, int | float]:
+    """
+    Сводка по набору замеров (в секундах).
+
+    :return: {"count", "avg", "p50", "p90", "p99", "max"}
+    :rtype: :obj:`dict`
+    """
+    values = sorted(values)
+    if not values:
+        return {"count": 0, "avg": 0, "p50": 0, "p90": 0, "p99": 0, "max": 0}
+
+    def percentile(p: float) -> float:
+        return values[min(int(len(values) * p), len(values) - 1)]
+
+    return {"count": len(values), "avg": sum(values) / len(values), "p50": percentile(0.5),
+            "p90": percentile(0.9), "p99": percentile(0.99), "max": values[-1]}
+
+
+class _Chat:
+    def __init__(self, chat_id: int, name: str, buyer_id: int, buyer_name: str):
+        self.id = chat_id
+        self.name = name
+        self.buyer_id = buyer_id
+        self.buyer_name = buyer_name
+        self.messages: deque[dict[str, Any]] = deque(maxlen=100)
+        self.unread = False
+
+
+class _Order:
+    def __init__(self, order_id: str, buyer_id: int, buyer_name: str, chat: _Chat, stars: int, price: float):
+        self.id = order_id
+        self.buyer_id = buyer_id
+        self.buyer_name = buyer_name
+        self.chat = chat
+        self.stars = stars
+        self.price = price
+        self.status = "paid"
+        self.created = time.time()
+
+
+class _Dialog:
+    def __init__(self, order: _Order, script: tuple[str, ...]):
+        self.order = order
+        self.script = script
+        self.step = 0
+        self.started = time.time()
+        self.waiting_since: float | None = self.started
+
+
+class FunPaySimulator:
+    """
+    Локальный симулятор FunPay (и API Fragment) для нагрузочного тестирования.
+
+    Каждый заказ открывает диалог: покупатель ждет сообщения продавца, через think_time секунд отвечает следующей
+    строкой buyer_script и снова ждет. Время от сообщения покупателя (или оплаты) до ответа продавца - время ответа
+    бота; после последней строки сценария следующий ответ продавца завершает диалог (заказ закрывается).
+
+    :param host: адрес сервера.
+    :type host: :obj:`str`, опционально
+
+    :param port: порт сервера (0 - любой свободный).
+    :type port: :obj:`int`, опционально
+
+    :param user_id: ID аккаунта продавца.
+    :type user_id: :obj:`int`, опционально
+
+    :param username: никнейм продавца.
+    :type username: :obj:`str`, опционально
+
+    :param buyers: кол-во покупателей.
+    :type buyers: :obj:`int`, опционально
+
+    :param orders_per_minute: средняя частота новых заказов (0 - только :meth:`FunPayAPI.common.simulator.FunPaySimulator.add_order`).
+    :type orders_per_minute: :obj:`int` or :obj:`float`, опционально
+
+    :param messages_per_second: средняя частота сообщений покупателей без заказов.
+    :type messages_per_second: :obj:`int` or :obj:`float`, опционально
+
+    :param buyer_script: ответы покупателя ({tag} - Telegram-тег покупателя, {order_id} - ID заказа).
+    :type buyer_script: :obj:`tuple` of :obj:`str`, опционально
+
+    :param think_time: через сколько секунд покупатель отвечает продавцу.
+    :type think_time: :obj:`int` or :obj:`float`, опционально
+
+    :param dialog_timeout: через сколько секунд без ответа продавца диалог считается проваленным.
+    :type dialog_timeout: :obj:`int` or :obj:`float`, опционально
+
+    :param latency: задержка ответов FunPay (в секундах).
+    :type latency: :obj:`int` or :obj:`float`, опционально
+
+    :param fragment_latency: задержка ответов Fragment (в секундах; отправка звезд - в 5 раз дольше).
+    :type fragment_latency: :obj:`int` or :obj:`float`, опционально
+
+    :param subcategory_id: ID подкатегории заказов.
+    :type subcategory_id: :obj:`int`, опционально
+
+    :param seed: seed генератора случайных чисел (для воспроизводимой нагрузки).
+    :type seed: :obj:`int` or :obj:`None`, опционально
+    """
+    GAME_ID: int = 1000
+    """ID игры (категории), к которой относится подкатегория заказов."""
+    PAGE_SIZE: int = 50
+    """Кол-во заказов на странице orders/trade и чатов в ответе chat_bookmarks."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, user_id: int = 1000000, username: str = "SimSeller",
+                 buyers: int = 100, orders_per_minute: int | float = 6, messages_per_second: int | float = 0.5,
+                 buyer_script: tuple[str, ...] = DEFAULT_BUYER_SCRIPT, think_time: int | float = 1.0,
+                 dialog_timeout: int | float = 300, latency: int | float = 0, fragment_latency: int | float = 0,
+                 subcategory_id: int = 2418, seed: int | None = None):
+        self.user_id: int = user_id
+        """ID аккаунта продавца."""
+        self.username: str = username
+        """Никнейм продавца."""
+        self.orders_per_minute: int | float = orders_per_minute
+        """Средняя частота новых заказов."""
+        self.messages_per_second: int | float = messages_per_second
+        """Средняя частота сообщений покупателей без заказов."""
+        self.buyer_script: tuple[str, ...] = buyer_script
+        """Ответы покупателя."""
+        self.think_time: int | float = think_time
+        """Через сколько секунд покупатель отвечает продавцу."""
+        self.dialog_timeout: int | float = dialog_timeout
+        """Через сколько секунд без ответа продавца диалог считается проваленным."""
+        self.latency: int | float = latency
+        """Задержка ответов FunPay (в секундах)."""
+        self.fragment_latency: int | float = fragment_latency
+        """Задержка ответов Fragment (в секундах)."""
+        self.subcategory_id: int = subcategory_id
+        """ID подкатегории заказов."""
+        self.csrf_token: str = random_tag()
+        """CSRF-токен, который отдает симулятор."""
+        self.fragment_balance: float = 1_000_000
+        """Баланс кошелька Fragment."""
+
+        self.__random = random.Random(seed)
+        self.__lock = threading.RLock()
+        self.__buyers: list[tuple[int, str]] = [(2000000 + i, f"Buyer{i}") for i in range(buyers)]
+        self.__chats: dict[int, _Chat] = {}
+        self.__chats_by_name: dict[str, _Chat] = {}
+        self.__orders: dict[str, _Order] = {}
+        self.__dialogs: dict[int, _Dialog] = {}
+        self.__lots: dict[int, dict[str, Any]] = {
+            10000 + i: {"title": f"{n} звёзд Telegram", "price": n * 1.6, "amount": 1000, "active": True}
+            for i, n in enumerate((50, 100, 500))
+        }
+        self.__replies: list[tuple[float, int, int, str]] = []
+        self.__seq = 0
+        self.__message_id = 1000000000
+        self.__orders_tag = random_tag()
+        self.__chats_tag = random_tag()
+
+        self.__response_times: deque[float] = deque(maxlen=100000)
+        self.__dialog_times: deque[float] = deque(maxlen=100000)
+        self.__counters = {"orders": 0, "messages": 0, "seller_messages": 0, "completed": 0, "timed_out": 0,
+                           "max_active": 0}
+        self.__requests: dict[str, list[float]] = {}
+
+        self.__stop = threading.Event()
+        self.__threads: list[threading.Thread] = []
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self.__make_handler())
+        """HTTP-сервер симулятора."""
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """
+        Адрес симулятора.
+
+        :rtype: :obj:`str`
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def fragment_url(self) -> str:
+        """
+        Адрес симулированного API Fragment (для FRAGMENT_API_URL в bot_fragment.py).
+
+        :rtype: :obj:`str`
+        """
+        return f"{self.url}/fragment/v1"
+
+    def session(self, session: requests.Session | None = None, **adapter_kwargs) -> requests.Session:
+        """
+        Создает HTTP-сессию для :class:`FunPayAPI.account.Account`, запросы которой уходят на симулятор
+        (см. :func:`FunPayAPI.common.simulator.simulator_session`).
+
+        :rtype: :class:`requests.Session`
+        """
+        return simulator_session(self.url, session, **adapter_kwargs)
+
+    def start(self) -> FunPaySimulator:
+        """
+        Запускает HTTP-сервер и генератор нагрузки в фоновых потоках.
+
+        :return: этот симулятор.
+        :rtype: :class:`FunPayAPI.common.simulator.FunPaySimulator`
+        """
+        self.__stop.clear()
+        self.__threads = [threading.Thread(target=self.server.serve_forever, daemon=True,
+                                           name="FunPayAPI-simulator-server"),
+                          threading.Thread(target=self.__generate, daemon=True, name="FunPayAPI-simulator-load")]
+        for thread in self.__threads:
+            thread.start()
+        logger.info(f"Симулятор FunPay запущен на {self.url}.")
+        return self
+
+    def stop(self):
+        """
+        Останавливает генератор нагрузки и HTTP-сервер.
+        """
+        self.__stop.set()
+        self.server.shutdown()
+        self.server.server_close()
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+    def add_order(self, buyer_id: int | None = None, stars: int | None = None) -> str:
+        """
+        Создает оплаченный заказ и открывает диалог с покупателем.
+
+        :param buyer_id: ID покупателя (по умолчанию - случайный покупатель без открытого диалога).
+        :type buyer_id: :obj:`int` or :obj:`None`, опционально
+
+        :param stars: кол-во звезд в заказе (по умолчанию - случайное).
+        :type stars: :obj:`int` or :obj:`None`, опционально
+
+        :return: ID заказа.
+        :rtype: :obj:`str`
+        """
+        with self.__lock:
+            buyer = self.__pick_buyer(buyer_id)
+            if buyer is None:
+                buyer = self.__random.choice(self.__buyers)
+            buyer_id, buyer_name = buyer
+            chat = self.__get_chat(buyer_id, buyer_name)
+            stars = stars or self.__random.choice((50, 100, 250, 500, 1000))
+            while (order_id := "".join(self.__random.choices("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789", k=8))) \
+                    in self.__orders:
+                pass
+            order = _Order(order_id, buyer_id, buyer_name, chat, stars, round(stars * 1.6, 2))
+            self.__orders[order_id] = order
+            self.__counters["orders"] += 1
+            self.__orders_tag = random_tag()
+            text = (f'Покупатель <a href="https://funpay.com/users/{buyer_id}/">{buyer_name}</a> оплатил заказ '
+                    f'<a href="https://funpay.com/orders/{order_id}/">#{order_id}</a>. Telegram, Звёзды, '
+                    f'{stars} звёзд. <a href="https://funpay.com/users/{self.user_id}/">{self.username}</a>, '
+                    f'не забудьте потом нажать кнопку «Подтвердить выполнение заказа».')
+            self.__add_message(chat, 0, text, system=True)
+            self.__dialogs[chat.id] = _Dialog(order, self.buyer_script)
+            self.__counters["max_active"] = max(self.__counters["max_active"], len(self.__dialogs))
+            return order_id
+
+    def send_buyer_message(self, buyer_id: int, text: str):
+        """
+        Отправляет сообщение от имени покупателя.
+
+        :param buyer_id: ID покупателя.
+        :type buyer_id: :obj:`int`
+
+        :param text: текст сообщения.
+        :type text: :obj:`str`
+        """
+        with self.__lock:
+            buyer_name = next((name for id_, name in self.__buyers if id_ == buyer_id), f"Buyer{buyer_id}")
+            chat = self.__get_chat(buyer_id, buyer_name)
+            self.__add_message(chat, buyer_id, text)
+            if dialog := self.__dialogs.get(chat.id):
+                dialog.waiting_since = time.time()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Статистика нагрузки.
+
+        :return: {"orders", "messages", "seller_messages", "dialogs": {"active", "max_active", "completed",
+            "timed_out"}, "response_time": сводка, "dialog_time": сводка, "requests": {эндпоинт: сводка}}
+            (сводки - см. :func:`FunPayAPI.common.simulator.summarize`, время в секундах).
+        :rtype: :obj:`dict`
+        """
+        with self.__lock:
+            return {
+                "orders": self.__counters["orders"],
+                "messages": self.__counters["messages"],
+                "seller_messages": self.__counters["seller_messages"],
+                "dialogs": {"active": len(self.__dialogs), "max_active": self.__counters["max_active"],
+                            "completed": self.__counters["completed"], "timed_out": self.__counters["timed_out"]},
+                "response_time": summarize(self.__response_times),
+                "dialog_time": summarize(self.__dialog_times),
+                "requests": {endpoint: summarize(times) for endpoint, times in self.__requests.items()}
+            }
+
+    # ============ Генерация нагрузки ============
+    def __generate(self):
+        next_order = time.time() + self.__interval(self.orders_per_minute / 60)
+        next_message = time.time() + self.__interval(self.messages_per_second)
+        while not self.__stop.wait(0.05):
+            now = time.time()
+            try:
+                while now >= next_order:
+                    self.add_order()
+                    next_order += self.__interval(self.orders_per_minute / 60)
+                while now >= next_message:
+                    with self.__lock:
+                        if buyer := self.__pick_buyer():
+                            self.send_buyer_message(buyer[0], self.__random.choice(NOISE_MESSAGES))
+                    next_message += self.__interval(self.messages_per_second)
+                self.__process_replies(now)
+            except:
+                logger.debug("TRACEBACK", exc_info=True)
+
+    def __interval(self, rate: int | float) -> float:
+        # интервалы между событиями пуассоновского потока
+        return self.__random.expovariate(rate) if rate > 0 else float("inf")
+
+    def __process_replies(self, now: float):
+        with self.__lock:
+            while self.__replies and self.__replies[0][0] <= now:
+                _, _, chat_id, text = heapq.heappop(self.__replies)
+                if (dialog := self.__dialogs.get(chat_id)) is None:
+                    continue
+                self.__add_message(dialog.order.chat, dialog.order.buyer_id, text)
+                dialog.waiting_since = time.time()
+            for chat_id, dialog in list(self.__dialogs.items()):
+                if dialog.waiting_since is not None and now - dialog.waiting_since > self.dialog_timeout:
+                    del self.__dialogs[chat_id]
+                    self.__counters["timed_out"] += 1
+
+    def __on_seller_message(self, chat: _Chat):
+        if (dialog := self.__dialogs.get(chat.id)) is None or dialog.waiting_since is None:
+            return
+        now = time.time()
+        self.__response_times.append(now - dialog.waiting_since)
+        dialog.waiting_since = None
+        if dialog.step >= len(dialog.script):
+            self.__dialog_times.append(now - dialog.started)
+            self.__counters["completed"] += 1
+            del self.__dialogs[chat.id]
+            if dialog.order.status == "paid":
+                dialog.order.status = "closed"
+                self.__orders_tag = random_tag()
+            return
+        text = dialog.script[dialog.step].format(tag=f"{dialog.order.buyer_name.lower()}_tg", order_id=dialog.order.id)
+        dialog.step += 1
+        self.__seq += 1
+        heapq.heappush(self.__replies, (now + self.think_time, self.__seq, chat.id, text))
+
+    def __pick_buyer(self, buyer_id: int | None = None) -> tuple[int, str] | None:
+        busy = {dialog.order.buyer_id for dialog in self.__dialogs.values()}
+        if buyer_id is not None:
+            return next(((id_, name) for id_, name in self.__buyers if id_ == buyer_id), (buyer_id, f"Buyer{buyer_id}"))
+        free = [buyer for buyer in self.__buyers if buyer[0] not in busy]
+        return self.__random.choice(free) if free else None
+
+    def __get_chat(self, buyer_id: int, buyer_name: str) -> _Chat:
+        id1, id2 = sorted([buyer_id, self.user_id])
+        name = f"users-{id1}-{id2}"
+        if (chat := self.__chats_by_name.get(name)) is None:
+            chat = _Chat(100000000 + len(self.__chats), name, buyer_id, buyer_name)
+            self.__chats[chat.id] = chat
+            self.__chats_by_name[name] = chat
+        return chat
+
+    def __add_message(self, chat: _Chat, author_id: int, text: str, system: bool = False) -> dict[str, Any]:
+        self.__message_id += 1
+        if system:
+            body = f'<div class="alert alert-with-icon alert-info" role="alert">{text}</div>'
+            author = 'FunPay <span class="chat-msg-author-label label label-primary">оповещение</span>'
+        else:
+            body = f'<div class="chat-msg-text">{html.escape(text)}</div>'.replace("\n", "<br>")
+            name = self.username if author_id == self.user_id else chat.buyer_name
+            author = f'<a href="https://funpay.com/users/{author_id}/" class="chat-msg-author-link">{name}</a>'
+        message = {
+            "id": self.__message_id,
+            "author": author_id,
+            "text": re.sub(r"<[^>]+>", "", text) if system else text,
+            "html": f'<div class="chat-msg-item chat-msg-with-head" id="message-{self.__message_id}">'
+                    f'<div class="chat-message"><div class="media-user-name">{author}</div>'
+                    f'<div class="chat-msg-body">{body}</div></div></div>'
+        }
+        chat.messages.append(message)
+        chat.unread = author_id != self.user_id
+        self.__chats_tag = random_tag()
+        self.__counters["seller_messages" if author_id == self.user_id else "messages"] += 1
+        return message
+
+    # ============ HTTP ============
+    def __make_handler(self) -> type[BaseHTTPRequestHandler]:
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                simulator.handle(self, "GET")
+
+            def do_POST(self):
+                simulator.handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        """
+        Обрабатывает HTTP-запрос к симулятору.
+
+        :param request: обработчик запроса.
+        :type request: :class:`http.server.BaseHTTPRequestHandler`
+
+        :param method: метод запроса ("GET" / "POST").
+        :type method: :obj:`str`
+        """
+        start = time.time()
+        split = urlsplit(request.path)
+        path = split.path.lstrip("/")
+        for locale in ("en/", "uk/"):
+            if path.startswith(locale):
+                path = path[len(locale):]
+                break
+        query = {k: v[0] for k, v in parse_qs(split.query, keep_blank_values=True).items()}
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        form = {k: v[0] for k, v in parse_qs(body.decode(errors="replace"), keep_blank_values=True).items()}
+
+        endpoint, status, content_type, content, headers = "unknown", 404, "text/html", "Not found", {}
+        try:
+            if path.startswith("fragment/"):
+                endpoint = "fragment"
+                status, content = self.__fragment(method, path, body)
+                content_type = "application/json"
+            else:
+                if self.latency:
+                    time.sleep(self.latency)
+                endpoint, status, content_type, content = self.__funpay(method, path, query, form)
+                if endpoint == "main":
+                    headers["Set-Cookie"] = f"PHPSESSID={random_tag()}; path=/; HttpOnly"
+        except:
+            logger.debug("TRACEBACK", exc_info=True)
+            status, content_type, content = 500, "text/plain", "Internal simulator error"
+
+        data = content if isinstance(content, bytes) else \
+            (json.dumps(content, ensure_ascii=False) if not isinstance(content, str) else content).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", f"{content_type}; charset=UTF-8")
+        request.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            request.send_header(k, v)
+        request.end_headers()
+        request.wfile.write(data)
+        with self.__lock:
+            self.__requests.setdefault(endpoint, []).append(time.time() - start)
+            if len(self.__requests[endpoint]) > 100000:
+                del self.__requests[endpoint][:50000]
+
+    def __funpay(self, method: str, path: str, query: dict[str, str],
+                 form: dict[str, str]) -> tuple[str, int, str, Any]:
+        with self.__lock:
+            if path == "":
+                return "main", 200, "text/html", self.__main_page()
+            if path == "runner/" and method == "POST":
+                return "runner", 200, "application/json", self.__runner(form)
+            if path == "orders/trade":
+                return "orders/trade", 200, "text/html", self.__sales_page(form.get("continue"))
+            if path == "orders/refund" and method == "POST":
+                if order := self.__orders.get(form.get("id", "")):
+                    order.status = "refunded"
+                    self.__orders_tag = random_tag()
+                    return "orders/refund", 200, "application/json", {}
+                return "orders/refund", 200, "application/json", {"error": True, "msg": "Заказ не найден."}
+            if match := ORDER_RE.fullmatch(path):
+                if order := self.__orders.get(match.group(1)):
+                    return "orders/{id}", 200, "text/html", self.__order_page(order)
+                return "orders/{id}", 404, "text/html", "Not found"
+            if path == "chat/history":
+                chat = self.__find_chat(query.get("node", ""))
+                last_message = int(query.get("last_message") or 0)
+                if chat is None:
+                    return "chat/history", 200, "application/json", {"chat": None}
+                messages = [i for i in chat.messages if i["id"] < last_message][-100:]
+                return "chat/history", 200, "application/json", {"chat": {"node": self.__node(chat),
+                                                                          "messages": self.__strip(messages)}}
+            if match := LOTS_TRADE_RE.fullmatch(path):
+                return "lots/trade", 200, "text/html", self.__lots_page(int(match.group(1)))
+            if path == "lots/offerEdit":
+                lot_id = int(query.get("offer") or 0)
+                if lot_id not in self.__lots:
+                    return "lots/offerEdit", 200, "text/html", self.__page('<p class="lead">Лот не найден.</p>')
+                return "lots/offerEdit", 200, "text/html", self.__offer_edit_page(lot_id)
+            if path == "lots/offerSave" and method == "POST":
+                if (lot := self.__lots.get(int(form.get("offer_id") or 0))) is None:
+                    return "lots/offerSave", 200, "application/json", {"error": "Лот не найден."}
+                lot["active"] = form.get("active") == "on"
+                lot["price"] = float(form.get("price") or lot["price"])
+                return "lots/offerSave", 200, "application/json", {"done": True}
+        return "unknown", 404, "text/html", "Not found"
+
+    def __fragment(self, method: str, path: str, body: bytes) -> tuple[int, Any]:
+        if self.fragment_latency:
+            time.sleep(self.fragment_latency * (5 if path.endswith("order/stars/") else 1))
+        if path == "fragment/v1/auth/authenticate/":
+            return 200, {"token": "simulator-token"}
+        if path == "fragment/v1/misc/wallet/":
+            return 200, {"balance": self.fragment_balance}
+        if match := FRAGMENT_USER_RE.fullmatch(path):
+            return 200, {"username": match.group(1), "name": match.group(1)}
+        if path == "fragment/v1/order/stars/" and method == "POST":
+            data = json.loads(body or b"{}")
+            with self.__lock:
+                self.fragment_balance -= int(data.get("quantity") or 0) * 0.005
+            return 200, {"success": True, "id": random_tag(), "username": data.get("username"),
+                         "quantity": data.get("quantity")}
+        return 404, {"detail": "Not found."}
+
+    # ============ runner/ ============
+    def __runner(self, form: dict[str, str]) -> dict[str, Any]:
+        result = {"objects": [], "response": False}
+        if (request := form.get("request")) and request not in ("False", "false"):
+            request = json.loads(request)
+            if request.get("action") == "chat_message":
+                chat = self.__find_chat(str(request["data"]["node"]))
+                if chat is None:
+                    result["response"] = {"error": "Чат не найден."}
+                else:
+                    self.__add_message(chat, self.user_id, request["data"].get("content") or "")
+                    self.__on_seller_message(chat)
+                    result["response"] = {"error": None}
+        for obj in json.loads(form.get("objects") or "[]"):
+            type_ = obj.get("type")
+            if type_ == "orders_counters":
+                paid = sum(1 for i in self.__orders.values() if i.status == "paid")
+                data = {"buyer": 0, "seller": paid} if obj.get("tag") != self.__orders_tag else False
+                result["objects"].append({"type": type_, "id": obj.get("id"), "tag": self.__orders_tag,
+                                          "data": data})
+            elif type_ == "chat_bookmarks":
+                data = {"html": self.__bookmarks_html(), "counter": sum(1 for i in self.__chats.values() if i.unread)} \
+                    if obj.get("tag") != self.__chats_tag else False
+                result["objects"].append({"type": type_, "id": obj.get("id"), "tag": self.__chats_tag,
+                                          "data": data})
+            elif type_ == "chat_node":
+                chat = self.__find_chat(str(obj.get("id")))
+                data = {"node": self.__node(chat), "messages": self.__strip(list(chat.messages)[-50:])} \
+                    if chat else False
+                result["objects"].append({"type": type_, "id": obj.get("id"), "tag": random_tag(), "data": data})
+            elif type_ == "c-p-u":
+                link = f'<a href="https://funpay.com/lots/{self.subcategory_id}/">Telegram, Звёзды</a>'
+                result["objects"].append({"type": type_, "id": obj.get("id"), "tag": random_tag(),
+                                          "data": {"html": {"desktop": link}}})
+        return result
+
+    def __find_chat(self, node: str) -> _Chat | None:
+        if node.isdigit():
+            return self.__chats.get(int(node))
+        return self.__chats_by_name.get(node)
+
+    def __node(self, chat: _Chat) -> dict[str, Any]:
+        return {"id": chat.id, "name": chat.name, "silent": False}
+
+    @staticmethod
+    def __strip(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        return [{"id": i["id"], "author": i["author"], "html": i["html"]} for i in messages]
+
+    def __bookmarks_html(self) -> str:
+        chats = sorted((i for i in self.__chats.values() if i.messages), key=lambda i: i.messages[-1]["id"],
+                       reverse=True)[:self.PAGE_SIZE]
+        items = []
+        for chat in chats:
+            last = chat.messages[-1]
+            items.append(f'<a href="https://funpay.com/chat/?node={chat.id}" '
+                         f'class="contact-item{" unread" if chat.unread else ""}" data-id="{chat.id}" '
+                         f'data-node-msg="{last["id"]}" data-user-msg="{last["id"]}">'
+                         f'<div class="media-user-name">{chat.buyer_name}</div>'
+                         f'<div class="contact-item-message">{html.escape(last["text"])}</div>'
+                         f'<div class="contact-item-time">{datetime.now().strftime("%H:%M")}</div></a>')
+        return f'<div class="contact-list custom-scroll">{"".join(items)}</div>'
+
+    # ============ Страницы ============
+    def __page(self, content: str, nav: str = "") -> str:
+        app_data = html.escape(json.dumps({"locale": "ru", "csrf-token": self.csrf_token, "userId": self.user_id}))
+        paid = sum(1 for i in self.__orders.values() if i.status == "paid")
+        return (f'<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"><title>FunPay</title></head>'
+                f'<body data-app-data="{app_data}"><header>'
+                f'<ul class="nav navbar-nav navbar-right logged">'
+                f'<li{nav}><a href="https://funpay.com/orders/trade">Продажи '
+                f'<span class="badge badge-trade">{paid}</span></a></li>'
+                f'<li><a href="https://funpay.com/account/balance">Кошелёк '
+                f'<span class="badge badge-balance">{int(sum(i.price for i in self.__orders.values()))} ₽</span>'
+                f'</a></li></ul>'
+                f'<div class="user-link-name">{self.username}</div>'
+                f'<a class="menu-item-logout" href="https://funpay.com/account/logout?token={self.csrf_token}">'
+                f'Выход</a></header><div class="content">{content}</div></body></html>')
+
+    def __main_page(self) -> str:
+        sid = self.subcategory_id
+        return self.__page(f'<div class="promo-game-list"><div class="promo-game-item">'
+                           f'<div class="game-title" data-id="{self.GAME_ID}">'
+                           f'<a href="https://funpay.com/lots/{sid}/">Telegram</a></div>'
+                           f'<ul class="list-inline" data-id="{self.GAME_ID}">'
+                           f'<li><a href="https://funpay.com/lots/{sid}/">Звёзды</a></li></ul></div></div>')
+
+    def __sales_page(self, start_from: str | None = None) -> str:
+        orders = sorted(self.__orders.values(), key=lambda i: i.created, reverse=True)
+        if start_from:
+            ids = [i.id for i in orders]
+            orders = orders[ids.index(start_from):] if start_from in ids else []
+        page, rest = orders[:self.PAGE_SIZE], orders[self.PAGE_SIZE:]
+        items = []
+        for order in page:
+            classname = {"paid": " info", "refunded": " warning"}.get(order.status, "")
+            status = {"paid": "Оплачен", "refunded": "Возврат"}.get(order.status, "Закрыт")
+            items.append(f'<a href="https://funpay.com/orders/{order.id}/" class="tc-item{classname}">'
+                         f'<div class="tc-date"><div class="tc-date-time">{self.__format_date(order.created)}</div>'
+                         f'</div><div class="tc-order">#{order.id}</div>'
+                         f'<div class="order-desc"><div>{order.stars} звёзд Telegram</div>'
+                         f'<div class="text-muted">Telegram, Звёзды</div></div>'
+                         f'<div class="tc-user"><div class="media-user-name"><span class="pseudo-a" '
+                         f'data-href="https://funpay.com/users/{order.buyer_id}/">{order.buyer_name}</span></div></div>'
+                         f'<div class="tc-status">{status}</div>'
+                         f'<div class="tc-price">{order.price} <span class="unit">₽</span></div></a>')
+        next_input = f'<input type="hidden" name="continue" value="{rest[0].id}">' if rest else ""
+        sections = html.escape(json.dumps([[f"lot-{self.subcategory_id}", "Звёзды"]], ensure_ascii=False))
+        return self.__page(f'<select name="game" class="form-control"><option value="">Все игры</option>'
+                           f'<option value="{self.GAME_ID}" data-data="{sections}">Telegram</option></select>'
+                           f'<div class="tc">{"".join(items)}</div>{next_input}', nav=' class="active"')
+
+    def __order_page(self, order: _Order) -> str:
+        status = {"closed": '<span class="text-success">Закрыт</span>',
+                  "refunded": '<span class="text-warning">Возврат</span>'}.get(order.status, "")
+        sid = self.subcategory_id
+        return self.__page(f'<h1 class="page-header">Заказ #{order.id} {status}</h1>'
+                           f'<div class="param-item"><h5>Игра</h5><div><a href="https://funpay.com/lots/{sid}/">'
+                           f'Telegram</a></div></div>'
+                           f'<div class="param-item"><h5>Категория</h5><div><a href="https://funpay.com/lots/{sid}/">'
+                           f'Звёзды</a></div></div>'
+                           f'<div class="param-item"><h5>Краткое описание</h5><div>{order.stars} звёзд Telegram</div>'
+                           f'</div><div class="param-item"><h5>Количество</h5><div class="text-bold">1 шт.</div></div>'
+                           f'<div class="param-item"><h5>Сумма</h5><div><span>{order.price}</span> '
+                           f'<strong>₽</strong></div></div>'
+                           f'<div class="chat-header"><div class="media-user-name">'
+                           f'<a href="https://funpay.com/users/{order.buyer_id}/">{order.buyer_name}</a></div></div>'
+                           f'<div class="order-review"></div>', nav=' class="active"')
+
+    def __lots_page(self, subcategory_id: int) -> str:
+        items = []
+        if subcategory_id == self.subcategory_id:
+            for lot_id, lot in self.__lots.items():
+                items.append(f'<a href="https://funpay.com/lots/offerEdit?offer={lot_id}" '
+                             f'class="tc-item{"" if lot["active"] else " warning"}" data-offer="{lot_id}">'
+                             f'<div class="tc-desc"><div class="tc-desc-text">{lot["title"]}</div></div>'
+                             f'<div class="tc-amount">{lot["amount"]}</div>'
+                             f'<div class="tc-price" data-s="{lot["price"]}"><div>{lot["price"]} '
+                             f'<span class="unit">₽</span></div></div></a>')
+        return self.__page(f'<div class="tc">{"".join(items)}</div>')
+
+    def __offer_edit_page(self, lot_id: int) -> str:
+        lot = self.__lots[lot_id]
+        return self.__page(f'<form class="form-offer-editor">'
+                           f'<input type="hidden" name="csrf_token" value="{self.csrf_token}">'
+                           f'<input type="hidden" name="offer_id" value="{lot_id}">'
+                           f'<input type="hidden" name="node_id" value="{self.subcategory_id}">'
+                           f'<input type="hidden" name="location" value="trade">'
+                           f'<div class="form-group"><input type="text" name="fields[summary][ru]" '
+                           f'value="{lot["title"]}"></div>'
+                           f'<div class="form-group"><textarea name="fields[desc][ru]">{lot["title"]}</textarea></div>'
+                           f'<div class="form-group"><select name="fields[type]"><option value="stars" selected>'
+                           f'Звёзды</option></select></div>'
+                           f'<div class="form-group"><input type="text" name="amount" value="{lot["amount"]}"></div>'
+                           f'<div class="form-group has-feedback"><input type="text" name="price" '
+                           f'value="{lot["price"]}"><span class="form-control-feedback">₽</span></div>'
+                           f'<input type="checkbox" name="active"{" checked" if lot["active"] else ""}>'
+                           f'<table class="table-buyers-prices"><tr><th>Банковская карта</th>'
+                           f'<td>{round(lot["price"] * 1.1, 2)} ₽</td></tr></table></form>')
+
+    @staticmethod
+    def __format_date(timestamp: float) -> str:
+        date = datetime.fromtimestamp(timestamp)
+        if date.date() == datetime.now().date():
+            return f"сегодня, {date.strftime('%H:%M')}"
+        month = next(name for name, number in MONTHS.items() if number == date.month)
+        return f"{date.day} {month} {date.year}, {date.strftime('%H:%M')}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальный симулятор FunPay для нагрузочного тестирования.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--buyers", type=int, default=100)
+    parser.add_argument("--orders-per-minute", type=float, default=6)
+    parser.add_argument("--messages-per-second", type=float, default=0.5)
+    parser.add_argument("--think-time", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--fragment-latency", type=float, default=0)
+    parser.add_argument("--stats-interval", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = FunPaySimulator(args.host, args.port, buyers=args.buyers, orders_per_minute=args.orders_per_minute,
+                                messages_per_second=args.messages_per_second, think_time=args.think_time,
+                                latency=args.latency, fragment_latency=args.fragment_latency, seed=args.seed).start()
+    logger.info(f"FUNPAY_SIMULATOR={simulator.url}")
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            print(json.dumps(simulator.stats(), ensure_ascii=False), flush=True)
+    except KeyboardInterrupt:
+        simulator.stop()
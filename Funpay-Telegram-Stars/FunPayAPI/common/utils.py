@@ -1,11 +1,18 @@
 """
 В данном модуле написаны вспомогательные функции.
 """
+from __future__ import annotations
 
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Hashable, Iterator
+import threading
 import string
 import random
+import time
+import sys
 import re
-from .enums import Currency
+from .enums import Currency, MessageTypes
 
 MONTHS = {
     "января": 1,
@@ -82,6 +89,137 @@ def parse_currency(s: str) -> Currency:
             "¤": Currency.RUB}.get(s, Currency.UNKNOWN)
 
 
+class BoundedDict(MutableMapping):
+    """
+    Словарь с ограниченным кол-вом и возрастом записей: при переполнении (или по истечении max_age секунд с
+    последнего обновления) удаляются записи, которые дольше всех не обновлялись. Запись считается обновленной при
+    присваивании значения (чтение порядок не меняет). Поиск, вставка и удаление - O(1), операции потокобезопасны
+    (чтения тоже выполняются под блокировкой; итерация, items() и values() идут по снимку данных).
+
+    :param maxlen: макс. кол-во записей (None - без ограничения).
+    :type maxlen: :obj:`int` or :obj:`None`, опционально
+
+    :param max_age: макс. время жизни записи без обновлений (в секундах, None - без ограничения).
+    :type max_age: :obj:`int` or :obj:`float` or :obj:`None`, опционально
+
+    :param data: начальные данные.
+    :type data: :obj:`dict` or :obj:`None`, опционально
+    """
+    def __init__(self, maxlen: int | None = None, max_age: int | float | None = None, data: dict | None = None):
+        self.maxlen: int | None = maxlen
+        """Макс. кол-во записей."""
+        self.max_age: int | float | None = max_age
+        """Макс. время жизни записи без обновлений (в секундах)."""
+        self.evicted: int = 0
+        """Кол-во записей, удаленных из-за переполнения или возраста."""
+        self.__data: OrderedDict = OrderedDict()
+        self.__times: dict[Hashable, float] = {}
+        self.__lock = threading.RLock()
+        if data:
+            self.update(data)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self.__lock:
+            return self.__data[key]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.__lock:
+            return self.__data.get(key, default)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.__lock:
+            return key in self.__data
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+            if self.max_age is not None:
+                self.__times[key] = time.time()
+            self.__evict()
+
+    def __delitem__(self, key: Hashable):
+        with self.__lock:
+            del self.__data[key]
+            self.__times.pop(key, None)
+
+    def __iter__(self) -> Iterator:
+        # итерация по снимку ключей: вставка / вытеснение из другого потока не ломает итератор
+        with self.__lock:
+            keys = list(self.__data)
+        return iter(keys)
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__data)
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        with self.__lock:
+            return list(self.__data.items())
+
+    def values(self) -> list[Any]:
+        with self.__lock:
+            return list(self.__data.values())
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.__times.clear()
+
+    def expire(self):
+        """
+        Удаляет записи, превысившие max_age (также выполняется автоматически при каждом присваивании).
+        """
+        with self.__lock:
+            self.__evict()
+
+    def to_dict(self) -> dict:
+        """
+        Возвращает копию данных в виде обычного словаря (например, для сериализации в JSON).
+
+        :rtype: :obj:`dict`
+        """
+        with self.__lock:
+            return dict(self.__data)
+
+    def memory_stats(self) -> dict[str, int | float | None]:
+        """
+        Статистика использования памяти.
+
+        :return: {"size": кол-во записей, "maxlen", "max_age", "evicted", "bytes": примерный размер контейнера
+            и значений (без вложенных объектов) в байтах}
+        :rtype: :obj:`dict`
+        """
+        with self.__lock:
+            values = list(self.__data.values())
+            size = sys.getsizeof(self.__data) + sys.getsizeof(self.__times) + \
+                sum(sys.getsizeof(i) for i in values)
+            return {"size": len(values), "maxlen": self.maxlen, "max_age": self.max_age, "evicted": self.evicted,
+                    "bytes": size}
+
+    def __evict(self):
+        while self.maxlen is not None and len(self.__data) > self.maxlen:
+            key, _ = self.__data.popitem(last=False)
+            self.__times.pop(key, None)
+            self.evicted += 1
+        if self.max_age is None or not self.__times:
+            return
+        border = time.time() - self.max_age
+        while self.__data:
+            key = next(iter(self.__data))
+            if key not in self.__times:  # запись добавлена до установки max_age
+                self.__times[key] = time.time()
+                break
+            if self.__times[key] > border:
+                break
+            self.__data.popitem(last=False)
+            self.__times.pop(key, None)
+            self.evicted += 1
+
+
 class RegularExpressions(object):
     """
     В данном классе хранятся скомпилированные регулярные выражения, описывающие системные сообщения FunPay и прочие
@@ -89,12 +227,45 @@ class RegularExpressions(object):
     Класс является singleton'ом.
     """
 
+    SYSTEM_MESSAGE_TYPES: tuple[MessageTypes, ...] = (
+        MessageTypes.ORDER_CONFIRMED,
+        MessageTypes.NEW_FEEDBACK,
+        MessageTypes.NEW_FEEDBACK_ANSWER,
+        MessageTypes.FEEDBACK_CHANGED,
+        MessageTypes.FEEDBACK_DELETED,
+        MessageTypes.REFUND,
+        MessageTypes.FEEDBACK_ANSWER_CHANGED,
+        MessageTypes.FEEDBACK_ANSWER_DELETED,
+        MessageTypes.ORDER_CONFIRMED_BY_ADMIN,
+        MessageTypes.PARTIAL_REFUND,
+        MessageTypes.ORDER_REOPENED,
+        MessageTypes.REFUND_BY_ADMIN
+    )
+    """Типы системных сообщений с ID заказа в порядке от самых часто-используемых к самым редко-используемым."""
+
+    SYSTEM_MESSAGE_MARKERS: tuple[str, ...] = ("#", "Discord", "Уважаемые продавцы", "Dear vendors")
+    """Подстроки, хотя бы одна из которых обязательно есть в любом системном сообщении."""
+
     def __new__(cls, *args, **kwargs):
         if not hasattr(cls, "instance"):
             setattr(cls, "instance", super(RegularExpressions, cls).__new__(cls))
         return getattr(cls, "instance")
 
+    _init_lock = threading.Lock()
+
     def __init__(self):
+        # Класс - singleton, поэтому регулярные выражения компилируются только при первом создании объекта.
+        # Флаг выставляется после компиляции под блокировкой: иначе поток, создавший объект одновременно с первым,
+        # получил бы его без атрибутов.
+        if getattr(self, "_initialized", False):
+            return
+        with RegularExpressions._init_lock:
+            if getattr(self, "_initialized", False):
+                return
+            self.__compile()
+            self._initialized = True
+
+    def __compile(self):
         self.ORDER_PURCHASED = \
             re.compile(r"(Покупатель|The buyer) [a-zA-Z0-9]+ (оплатил заказ|has paid for order) #[A-Z0-9]{8}\.")
         """
@@ -226,3 +397,48 @@ class RegularExpressions(object):
         """
         Скомпилированное регулярное выражение, описывающее фразу о смене валюты.
         """
+
+        # ORDER_PURCHASED2 начинается с никнейма ([a-zA-Z0-9]+), из-за чего движку пришлось бы пробовать все варианты
+        # на каждой букве текста. Заменяем никнейм на эквивалентную проверку одного символа перед ", ",
+        # чтобы все ветки начинались с литералов.
+        purchased2 = self.ORDER_PURCHASED2.pattern.replace("[a-zA-Z0-9]+, ", "(?<=[a-zA-Z0-9]), ", 1)
+        self.SYSTEM_MESSAGE = re.compile("|".join(
+            f"(?P<{name}>{purchased2 if name == 'ORDER_PURCHASED2' else getattr(self, name).pattern})" for name in
+            ("DISCORD", "DEAR_VENDORS", "ORDER_PURCHASED", "ORDER_PURCHASED2",
+             *(i.name for i in self.SYSTEM_MESSAGE_TYPES))
+        ))
+        """
+        Скомпилированное регулярное выражение, объединяющее все системные сообщения (группа = тип сообщения).
+        Используется в :meth:`FunPayAPI.common.utils.RegularExpressions.get_message_type`.
+        """
+
+    def get_message_type(self, text: str | None) -> MessageTypes:
+        """
+        Определяет тип сообщения за один проход по тексту.
+
+        Внимание! Данный способ определения типа сообщения не является 100% правильным, т.к. он основан на сравнении с
+        регулярными выражениями. Возможно ложное "срабатывание", если пользователь напишет "поддельное" сообщение,
+        которое совпадет с одним из регулярных выражений.
+
+        :param text: текст сообщения.
+        :type text: :obj:`str` or :obj:`None`
+
+        :return: тип сообщения.
+        :rtype: :class:`FunPayAPI.common.enums.MessageTypes`
+        """
+        if not text or not any(i in text for i in self.SYSTEM_MESSAGE_MARKERS):
+            return MessageTypes.NON_SYSTEM
+
+        found = {match.lastgroup for match in self.SYSTEM_MESSAGE.finditer(text)}
+        if not found:
+            return MessageTypes.NON_SYSTEM
+        if "DISCORD" in found:
+            return MessageTypes.DISCORD
+        if "DEAR_VENDORS" in found:
+            return MessageTypes.DEAR_VENDORS
+        if "ORDER_PURCHASED" in found and "ORDER_PURCHASED2" in found:
+            return MessageTypes.ORDER_PURCHASED
+        for i in self.SYSTEM_MESSAGE_TYPES:
+            if i.name in found:
+                return i
+        return MessageTypes.NON_SYSTEM
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, AsyncGenerator
+
+if TYPE_CHECKING:
+    from ..async_account import AsyncAccount
+
+import asyncio
+import logging
+
+from .runner import Runner
+from .events import *
+
+logger = logging.getLogger("FunPayAPI.async_runner")
+
+
+class AsyncRunner:
+    """
+    Асинхронная версия :class:`FunPayAPI.updater.runner.Runner`.
+    Запросы и парсинг событий выполняются в пуле потоков :class:`FunPayAPI.async_account.AsyncAccount`, поэтому
+    ожидание ответа FunPay не блокирует event loop.
+
+    :param account: экземпляр асинхронного аккаунта (должен быть инициализирован с помощью метода
+        :meth:`FunPayAPI.async_account.AsyncAccount.get`).
+    :type account: :class:`FunPayAPI.async_account.AsyncAccount`
+
+    Остальные параметры совпадают с параметрами :class:`FunPayAPI.updater.runner.Runner`.
+    """
+
+    def __init__(self, account: AsyncAccount, disable_message_requests: bool = False,
+                 disabled_order_requests: bool = False,
+                 disabled_buyer_viewing_requests: bool = True, **kwargs):
+        self.account: AsyncAccount = account
+        """Экземпляр асинхронного аккаунта, к которому привязан Runner."""
+        self.runner: Runner = Runner(account.account, disable_message_requests, disabled_order_requests,
+                                     disabled_buyer_viewing_requests, **kwargs)
+        """Экземпляр синхронного Runner'а."""
+
+    async def listen(self, requests_delay: int | float = 6.0,
+                     ignore_exceptions: bool = True) -> AsyncGenerator[InitialChatEvent | ChatsListChangedEvent |
+                                                                       LastChatMessageChangedEvent | NewMessageEvent |
+                                                                       InitialOrderEvent | OrdersListChangedEvent |
+                                                                       NewOrderEvent | OrderStatusChangedEvent, None]:
+        """
+        Бесконечно отправляет запросы для получения новых событий.
+
+        :param requests_delay: задержка между запросами (в секундах).
+        :type requests_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param ignore_exceptions: игнорировать ошибки?
+        :type ignore_exceptions: :obj:`bool`, опционально
+
+        :return: асинхронный генератор событий FunPay.
+        :rtype: :obj:`AsyncGenerator` of :class:`FunPayAPI.updater.events.InitialChatEvent`,
+            :class:`FunPayAPI.updater.events.ChatsListChangedEvent`,
+            :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`,
+            :class:`FunPayAPI.updater.events.NewMessageEvent`, :class:`FunPayAPI.updater.events.InitialOrderEvent`,
+            :class:`FunPayAPI.updater.events.OrdersListChangedEvent`,
+            :class:`FunPayAPI.updater.events.NewOrderEvent`,
+            :class:`FunPayAPI.updater.events.OrderStatusChangedEvent`
+        """
+        events = []
+        while True:
+            start_time = time.time()
+            try:
+                ready_events, events = await self.account.run(self.runner.fetch_events, events)
+                for event in ready_events:
+                    yield event
+                await self.account.run(self.runner.save_checkpoint)
+            except Exception as e:
+                if not ignore_exceptions:
+                    raise e
+                else:
+                    logger.error("Произошла ошибка при получении событий. "
+                                 "(ничего страшного, если это сообщение появляется нечасто).")
+                    logger.debug("TRACEBACK", exc_info=True)
+            delay = self.runner.get_delay(requests_delay, time.time() - start_time)
+            if delay > 0:
+                await asyncio.sleep(delay)
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterable
+
+if TYPE_CHECKING:
+    from .runner import Runner
+    from .supervisor import Supervisor
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import logging
+
+from .events import *
+
+logger = logging.getLogger("FunPayAPI.dispatcher")
+
+
+class Handler:
+    """
+    Обработчик событий, зарегистрированный в :class:`FunPayAPI.updater.dispatcher.Dispatcher`.
+
+    :param func: функция-обработчик, принимающая событие.
+    :type func: :obj:`Callable`
+
+    :param event_types: типы событий, которые обрабатывает обработчик.
+    :type event_types: :obj:`frozenset` of :class:`FunPayAPI.common.enums.EventTypes`
+
+    :param filter_: доп. фильтр: функция, принимающая событие и возвращающая True, если его нужно обработать.
+    :type filter_: :obj:`Callable` or :obj:`None`
+
+    :param name: название обработчика (для статистики).
+    :type name: :obj:`str`
+    """
+    def __init__(self, func: Callable[[Any], Any], event_types: frozenset[EventTypes],
+                 filter_: Callable[[Any], bool] | None, name: str):
+        self.func: Callable[[Any], Any] = func
+        """Функция-обработчик."""
+        self.event_types: frozenset[EventTypes] = event_types
+        """Типы событий, которые обрабатывает обработчик."""
+        self.filter: Callable[[Any], bool] | None = filter_
+        """Доп. фильтр событий."""
+        self.name: str = name
+        """Название обработчика."""
+
+        self.calls: int = 0
+        """Кол-во вызовов."""
+        self.errors: int = 0
+        """Кол-во вызовов, завершившихся исключением."""
+        self.total_time: float = 0
+        """Суммарное время выполнения (в секундах)."""
+        self.max_time: float = 0
+        """Макс. время выполнения (в секундах)."""
+
+    def matches(self, event) -> bool:
+        """
+        Нужно ли обработать событие этим обработчиком?
+
+        :rtype: :obj:`bool`
+        """
+        return event.type in self.event_types and (self.filter is None or self.filter(event))
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Статистика задержек обработчика.
+
+        :return: {"calls", "errors", "avg", "max", "total"} (время - в секундах).
+        :rtype: :obj:`dict`
+        """
+        return {"calls": self.calls, "errors": self.errors, "avg": self.total_time / self.calls if self.calls else 0,
+                "max": self.max_time, "total": self.total_time}
+
+
+class Dispatcher:
+    """
+    Диспетчер событий :class:`FunPayAPI.updater.runner.Runner`.
+
+    Обработчики регистрируются по типам событий (:class:`FunPayAPI.common.enums.EventTypes`) с доп. фильтрами и
+    выполняются в пуле потоков. События с одинаковым ключом очереди (по умолчанию - собеседник / покупатель,
+    а если он неизвестен - чат) обрабатываются строго по очереди в порядке поступления, события с разными
+    ключами - параллельно. Обработчики одного события вызываются по порядку регистрации.
+
+    :param workers: кол-во потоков-обработчиков.
+    :type workers: :obj:`int`, опционально
+
+    :param key: функция, возвращающая ключ очереди события (None - событие можно обрабатывать в любом порядке).
+    :type key: :obj:`Callable` or :obj:`None`, опционально
+    """
+    def __init__(self, workers: int = 4, key: Callable[[Any], Hashable | None] | None = None):
+        self.handlers: list[Handler] = []
+        """Зарегистрированные обработчики."""
+        self.key: Callable[[Any], Hashable | None] = key or self.default_key
+        """Функция, возвращающая ключ очереди события."""
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(workers, thread_name_prefix="FunPayAPI-handler")
+        """Пул потоков-обработчиков."""
+        self.checkpoint_timeout: float = 30
+        """Сколько секунд :meth:`FunPayAPI.updater.dispatcher.Dispatcher.listen` ждет обработки событий перед
+        сохранением состояния Runner'а (если не дождался - сохранение переносится на следующую итерацию)."""
+
+        self.__queues: dict[Hashable, deque] = {}
+        self.__pending: int = 0
+        self.__lock = threading.Lock()
+        self.__idle = threading.Condition(self.__lock)
+
+    @staticmethod
+    def default_key(event) -> Hashable | None:
+        """
+        Ключ очереди по умолчанию: ID собеседника для сообщений и ID покупателя для заказов (чтобы новый заказ и
+        сообщения покупателя обрабатывались по порядку), ID чата для событий чатов. Очереди разных аккаунтов
+        (:attr:`FunPayAPI.updater.events.BaseEvent.account_id`) не пересекаются.
+
+        :rtype: :obj:`tuple` or :obj:`None`
+        """
+        account_id = getattr(event, "account_id", None)
+        if event.type == EventTypes.NEW_MESSAGE:
+            if event.message.interlocutor_id is not None:
+                return account_id, "user", event.message.interlocutor_id
+            return account_id, "chat", event.message.chat_id
+        if event.type in (EventTypes.INITIAL_ORDER, EventTypes.NEW_ORDER, EventTypes.ORDER_STATUS_CHANGED):
+            return account_id, "user", event.order.buyer_id
+        if event.type in (EventTypes.INITIAL_CHAT, EventTypes.LAST_CHAT_MESSAGE_CHANGED):
+            return account_id, "chat", event.chat.id
+        return None
+
+    def register(self, func: Callable[[Any], Any], event_types: EventTypes | Iterable[EventTypes],
+                 filter_: Callable[[Any], bool] | None = None, name: str | None = None) -> Handler:
+        """
+        Регистрирует обработчик.
+
+        :param func: функция-обработчик, принимающая событие.
+        :type func: :obj:`Callable`
+
+        :param event_types: тип или типы событий.
+        :type event_types: :class:`FunPayAPI.common.enums.EventTypes` or :obj:`list`
+
+        :param filter_: доп. фильтр: функция, принимающая событие и возвращающая True, если его нужно обработать.
+        :type filter_: :obj:`Callable` or :obj:`None`, опционально
+
+        :param name: название обработчика (по умолчанию - имя функции).
+        :type name: :obj:`str` or :obj:`None`, опционально
+
+        :return: обработчик.
+        :rtype: :class:`FunPayAPI.updater.dispatcher.Handler`
+        """
+        if isinstance(event_types, EventTypes):
+            event_types = [event_types]
+        handler = Handler(func, frozenset(event_types), filter_, name or getattr(func, "__name__", repr(func)))
+        self.handlers.append(handler)
+        return handler
+
+    def on(self, event_types: EventTypes | Iterable[EventTypes], filter_: Callable[[Any], bool] | None = None):
+        """
+        Декоратор для регистрации обработчика (см. :meth:`FunPayAPI.updater.dispatcher.Dispatcher.register`).
+        """
+        def decorator(func):
+            self.register(func, event_types, filter_)
+            return func
+        return decorator
+
+    def dispatch(self, event):
+        """
+        Передает событие подходящим обработчикам (не дожидаясь их выполнения).
+
+        :param event: событие.
+        """
+        handlers = [h for h in self.handlers if h.matches(event)]
+        if not handlers:
+            return
+        key = self.key(event)
+        with self.__lock:
+            self.__pending += 1
+            if key is not None:
+                if key in self.__queues:
+                    # по ключу уже выполняется событие - встаем в очередь за ним
+                    self.__queues[key].append((event, handlers))
+                    return
+                self.__queues[key] = deque()
+        self.executor.submit(self.__run, key, event, handlers)
+
+    def listen(self, runner: Runner | Supervisor, requests_delay: int | float = 6.0, ignore_exceptions: bool = True):
+        """
+        Получает события из :meth:`FunPayAPI.updater.runner.Runner.listen_batches`
+        (или :meth:`FunPayAPI.updater.supervisor.Supervisor.listen_batches`) и передает их обработчикам.
+
+        Когда Runner'у пора сохранить состояние (state_file), диспетчер сначала дожидается выполнения всех
+        переданных обработчикам событий: иначе при падении бота события, стоящие в очереди, были бы потеряны.
+
+        :param runner: экземпляр Runner'а или Supervisor'а.
+        :type runner: :class:`FunPayAPI.updater.runner.Runner` or :class:`FunPayAPI.updater.supervisor.Supervisor`
+
+        :param requests_delay: задержка между запросами (в секундах).
+        :type requests_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param ignore_exceptions: игнорировать ошибки получения событий?
+        :type ignore_exceptions: :obj:`bool`, опционально
+        """
+        for source, events in runner.listen_batches(requests_delay, ignore_exceptions):
+            for event in events:
+                self.dispatch(event)
+            if source.checkpoint_due():
+                if self.join(self.checkpoint_timeout):
+                    source.save_checkpoint()
+                else:
+                    logger.warning("Обработчики не успели обработать события, сохранение состояния Runner'а отложено.")
+
+    def join(self, timeout: float | None = None) -> bool:
+        """
+        Ожидает обработки всех переданных событий.
+
+        :param timeout: макс. время ожидания (в секундах).
+        :type timeout: :obj:`float` or :obj:`None`, опционально
+
+        :return: True, если все события обработаны.
+        :rtype: :obj:`bool`
+        """
+        with self.__idle:
+            return self.__idle.wait_for(lambda: not self.__pending, timeout)
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        """
+        Статистика задержек обработчиков.
+
+        :return: {название обработчика: статистика (см. :meth:`FunPayAPI.updater.dispatcher.Handler.stats`)}
+        :rtype: :obj:`dict`
+        """
+        return {handler.name: handler.stats() for handler in self.handlers}
+
+    def shutdown(self, wait: bool = True):
+        """
+        Останавливает пул потоков.
+
+        :param wait: дождаться ли выполнения уже переданных событий?
+        :type wait: :obj:`bool`, опционально
+        """
+        if wait:
+            self.join()
+        self.executor.shutdown(wait=wait)
+
+    def __run(self, key: Hashable | None, event, handlers: list[Handler]):
+        while True:
+            for handler in handlers:
+                start = time.perf_counter()
+                error = False
+                try:
+                    handler.func(event)
+                except Exception as e:
+                    error = True
+                    logger.error(f"Ошибка в обработчике {handler.name} (событие {event.type.name}): {e}")
+                    logger.debug("TRACEBACK", exc_info=True)
+                elapsed = time.perf_counter() - start
+                with self.__lock:
+                    handler.calls += 1
+                    handler.errors += error
+                    handler.total_time += elapsed
+                    handler.max_time = max(handler.max_time, elapsed)
+            with self.__lock:
+                self.__pending -= 1
+                if not self.__pending:
+                    self.__idle.notify_all()
+                if key is None:
+                    return
+                queue = self.__queues[key]
+                if not queue:
+                    del self.__queues[key]
+                    return
+                event, handlers = queue.popleft()
@@ -22,6 +22,8 @@ class BaseEvent:
         self.runner_tag = runner_tag
         self.type = event_type
         self.time = event_time if event_type is not None else time.time()
+        self.account_id = None
+        """ID аккаунта, к которому относится событие (заполняется :class:`FunPayAPI.updater.supervisor.Supervisor`)."""
 
 
 class InitialChatEvent(BaseEvent):
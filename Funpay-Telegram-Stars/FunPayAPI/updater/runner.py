@@ -1,13 +1,15 @@
 from __future__ import annotations
 
 import re
-from typing import TYPE_CHECKING, Generator
+from typing import TYPE_CHECKING, Callable, Generator
 
 if TYPE_CHECKING:
     from ..account import Account
 
 import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 
 from ..common import exceptions
@@ -39,11 +41,34 @@ class Runner:
         Из событий, связанных с заказами, будет возвращаться только
         :class:`FunPayAPI.updater.events.OrdersListChangedEvent`.
     :type disabled_order_requests: :obj:`bool`, опционально
+
+    :param state_file: путь до файла, в который периодически сохраняется состояние Runner'а (теги, ID последних
+        сообщений чатов, статусы известных заказов). Если файл существует, Runner продолжает работу с сохраненного
+        состояния: вместо первичного цикла (:class:`FunPayAPI.updater.events.InitialChatEvent`,
+        :class:`FunPayAPI.updater.events.InitialOrderEvent`) возвращаются события, произошедшие за время простоя
+        (в т.ч. :class:`FunPayAPI.updater.events.NewOrderEvent`).
+    :type state_file: :obj:`str` or :obj:`None`, опционально
+
+    :param state_save_interval: интервал сохранения состояния (в секундах).
+    :type state_save_interval: :obj:`int` or :obj:`float`, опционально
     """
 
+    MAX_CHATS: int = 5000
+    """Макс. кол-во чатов, для которых хранятся ID последних сообщений."""
+    CHAT_MAX_AGE: int = 30 * 24 * 60 * 60
+    """Сколько секунд без новых сообщений хранятся данные чата (ID сообщений новее - глобально, поэтому после
+    удаления повторно вернутся только действительно новые сообщения)."""
+    BY_BOT_MAX_AGE: int = 24 * 60 * 60
+    """Сколько секунд хранятся ID сообщений, отправленных ботом, если они так и не появились в истории чата."""
+    MAX_SAVED_ORDERS: int = 1000
+    """Макс. кол-во сохраненных объектов заказов (saved_orders)."""
+    MAX_KNOWN_ORDERS: int = 20000
+    """Макс. кол-во заказов, статусы которых хранятся для отслеживания изменений (known_orders)."""
+
     def __init__(self, account: Account, disable_message_requests: bool = False,
                  disabled_order_requests: bool = False,
-                 disabled_buyer_viewing_requests: bool = True):
+                 disabled_buyer_viewing_requests: bool = True,
+                 state_file: str | None = None, state_save_interval: int | float = 30):
         # todo добавить события и исключение событий о новых покупках (не продажах!)
         if not account.is_initiated:
             raise exceptions.AccountNotInitiatedError()
@@ -58,27 +83,49 @@ class Runner:
         """Делать ли доп запросы для получения поля "Покупатель смотрит"?"""
 
         self.__first_request = True
+        self.__orders_synced = False
         self.__last_msg_event_tag = utils.random_tag()
         self.__last_order_event_tag = utils.random_tag()
 
-        self.saved_orders: dict[str, types.OrderShortcut] = {}
+        # Словари ниже ограничены по размеру и возрасту записей (см. utils.BoundedDict), чтобы память не росла
+        # при долгой работе. Лимиты можно изменить через атрибуты maxlen / max_age, текущий расход - memory_report().
+        self.saved_orders: utils.BoundedDict[str, types.OrderShortcut] = utils.BoundedDict(self.MAX_SAVED_ORDERS)
         """Сохраненные состояния заказов ({ID заказа: экземпляр types.OrderShortcut})."""
 
-        self.runner_last_messages: dict[int, list[int, int, str | None]] = {}
+        self.known_orders: utils.BoundedDict[str, types.OrderStatuses] = utils.BoundedDict(self.MAX_KNOWN_ORDERS)
+        """Статусы известных заказов ({ID заказа: статус}). В отличие от saved_orders, сохраняются в state_file."""
+
+        self.runner_last_messages: utils.BoundedDict[int, list[int, int, str | None]] = \
+            utils.BoundedDict(self.MAX_CHATS, self.CHAT_MAX_AGE)
         """ID последний сообщений {ID чата: [ID последего сообщения чата, ID последнего прочитанного сообщения чата, 
         текст последнего сообщения или None, если это изображение]}."""
 
-        self.by_bot_ids: dict[int, list[int]] = {}
-        """ID сообщений, отправленных с помощью self.account.send_message ({ID чата: [ID сообщения, ...]})."""
+        self.by_bot_ids: utils.BoundedDict[int, set[int]] = utils.BoundedDict(self.MAX_CHATS, self.BY_BOT_MAX_AGE)
+        """ID сообщений, отправленных с помощью self.account.send_message ({ID чата: {ID сообщения, ...}})."""
 
-        self.last_messages_ids: dict[int, int] = {}
+        self.last_messages_ids: utils.BoundedDict[int, int] = utils.BoundedDict(self.MAX_CHATS, self.CHAT_MAX_AGE)
         """ID последних сообщений в чатах ({ID чата: ID последнего сообщения})."""
 
         self.buyers_viewing: dict[int, types.BuyerViewing] = {}
         """Что смотрит покупатель? ({ID покупателя: что смотрит}"""
 
+        self.max_order_pages: int = 5
+        """Макс. кол-во страниц продаж, запрашиваемых за одно обновление (если новых заказов больше одной страницы)."""
+
         self.runner_len: int = 10
-        """Количество событий, на которое успешно отвечает funpay.com/runner/"""
+        """Количество событий, на которое успешно отвечает funpay.com/runner/ (подбирается автоматически)."""
+        self.max_runner_len: int = 30
+        """Верхняя граница runner_len при автоподборе."""
+        self.runner_len_probe_every: int = 20
+        """После скольких полных (не обрезанных) ответов подряд пробовать увеличить runner_len на 1."""
+        self.runner_stats: dict[str, int] = {"requests": 0, "objects_requested": 0, "objects_received": 0,
+                                             "truncated": 0}
+        """Статистика запросов к funpay.com/runner/ (см. objects_per_request)."""
+        self.__full_responses: int = 0
+        self.__runner_len_ceiling: int | None = None
+        self.max_chat_requests: int = 4
+        """Макс. кол-во одновременных запросов историй чатов (пачек по runner_len чатов)."""
+        self.__executor: ThreadPoolExecutor | None = None
         self.__interlocutor_ids: set = set()
         """Айди собеседников, у которых будет получено поле "Покупатель смотрит\""""
 
@@ -86,6 +133,45 @@ class Runner:
         """Экземпляр аккаунта, к которому привязан Runner."""
         self.account.runner = self
 
+        self.state_file: str | None = state_file
+        """Путь до файла состояния Runner'а."""
+        self.state_save_interval: int | float = state_save_interval
+        """Интервал сохранения состояния (в секундах)."""
+        self.__last_state_save: float = 0
+        if state_file:
+            self.load_state()
+
+        self.event_types: set[EventTypes] | None = None
+        """Типы событий, на которые подписан Runner (None - все)."""
+        self.subcategory_ids: set[int] | None = None
+        """ID подкатегорий, события о заказах которых нужно возвращать (None - все)."""
+        self.chat_ids: set[int] | None = None
+        """ID чатов, истории которых нужно запрашивать (None - все, если не задан buyer_ids)."""
+        self.buyer_ids: set[int] | None = None
+        """ID собеседников, истории чатов с которыми нужно запрашивать (None - все, если не задан chat_ids)."""
+        self.__new_order_buyers: set[int] = set()
+        self.buyer_filter_grace: int | float = 300
+        """Сколько секунд чаты, не прошедшие фильтр buyer_ids, перепроверяются (покупатель может попасть в buyer_ids
+        позже, из обработчика нового заказа), прежде чем их сообщения будут считаться просмотренными."""
+        self.__deferred_chats: dict[int, tuple[LastChatMessageChangedEvent, float]] = {}
+
+        self.min_delay: int | float | None = None
+        """Мин. задержка между запросами при адаптивном интервале (None - адаптивный интервал выключен)."""
+        self.max_delay: int | float | None = None
+        """Макс. задержка между запросами при адаптивном интервале."""
+        self.idle_backoff: float = 1.5
+        """Множитель, с которым растет задержка при отсутствии активности."""
+        self.activity_window: int | float = 120
+        """Сколько секунд после последнего события Runner считается активным."""
+        self.activity_check: Callable[[], bool] | None = None
+        """Доп. проверка активности (например, есть ли незавершенные диалоги с покупателями)."""
+        self.last_activity_time: float = 0
+        """Время последнего события о новом сообщении / заказе / изменении статуса заказа."""
+        self.__idle_delay: float | None = None
+        self.delay_metrics: dict = {"delay": None, "reason": None, "idle_delay": None, "reasons": {}}
+        """Метрики выбора задержки: последняя задержка, причина ("fixed" / "active" / "idle" / "429"),
+        текущая задержка простоя и кол-во выборов каждой причины."""
+
     def get_updates(self) -> dict:
         """
         Запрашивает список событий FunPay.
@@ -123,6 +209,9 @@ class Runner:
         response = self.account.method("post", "runner/", headers, payload, raise_not_200=True)
         json_response = response.json()
         logger.debug(f"Получены данные о событиях: {json_response}")
+        self.runner_stats["requests"] += 1
+        self.runner_stats["objects_requested"] += 2 + len(buyers)
+        self.runner_stats["objects_received"] += len(json_response.get("objects") or [])
         return json_response
 
     def parse_updates(self, updates: dict) -> list[InitialChatEvent | ChatsListChangedEvent |
@@ -144,15 +233,25 @@ class Runner:
             :class:`FunPayAPI.updater.events.OrderStatusChangedEvent`
         """
         events = []
+        self.__new_order_buyers = set()
+        chats_parsed = False
         # сортируем в т.ч. для того, корректно реагировало на сообщения покупателей сразу после оплаты (плагины автовыдачи)
         for obj in sorted(updates["objects"], key=lambda x: x.get("type") == "orders_counters", reverse=True):
+            # После восстановления тегов из state_file FunPay может вернуть объект без data (data: false),
+            # если он не менялся; парсить такой объект нечего.
+            if obj.get("type") in ("chat_bookmarks", "orders_counters") and not obj.get("data"):
+                continue
             if obj.get("type") == "chat_bookmarks":
+                chats_parsed = True
                 events.extend(self.parse_chat_updates(obj))
             elif obj.get("type") == "orders_counters":
                 events.extend(self.parse_order_updates(obj))
             elif obj.get("type") == "c-p-u":
                 bv = self.account.parse_buyer_viewing(obj)
                 self.buyers_viewing[bv.buyer_id] = bv
+        if not chats_parsed and self.__deferred_chats and self.make_msg_requests:
+            # чаты не менялись, но собеседник отложенного чата мог попасть в buyer_ids
+            events.extend(self.fetch_new_messages([]))
         if self.__first_request:
             self.__first_request = False
         return events
@@ -231,15 +330,45 @@ class Runner:
         if not self.make_msg_requests:
             events.extend(lcmc_events)
             return events
+        events.extend(self.fetch_new_messages(lcmc_events))
+        return events
+
+    def fetch_new_messages(self, lcmc_events: list[LastChatMessageChangedEvent]) -> \
+            list[LastChatMessageChangedEvent | NewMessageEvent]:
+        """
+        Запрашивает истории изменившихся подписанных чатов (и отложенных фильтром buyer_ids чатов, собеседник которых
+        попал в buyer_ids) и возвращает события в порядке
+        [LastChatMessageChanged, NewMSG, NewMSG ..., LastChatMessageChanged, NewMSG, NewMSG ...].
+
+        :param lcmc_events: события изменения чатов этой итерации.
+        :type lcmc_events: :obj:`list` of :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`
 
+        :rtype: :obj:`list` of :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`,
+            :class:`FunPayAPI.updater.events.NewMessageEvent`
+        """
+        events = []
         lcmc_events_without_new_mess = []
         lcmc_events_with_new_mess = []
+        # Отложенные чаты, собеседник которых попал в buyer_ids: их LastChatMessageChangedEvent уже возвращен,
+        # запрашиваем только историю.
+        rechecked = self.recheck_deferred_chats({i.chat.id for i in lcmc_events})
         for lcmc_event in lcmc_events:
             if lcmc_event.chat.node_msg_id <= self.last_messages_ids.get(lcmc_event.chat.id, -1):
                 lcmc_events_without_new_mess.append(lcmc_event)
+            elif not self.wants(EventTypes.NEW_MESSAGE) or not self.is_chat_subscribed(lcmc_event.chat):
+                if self.wants(EventTypes.NEW_MESSAGE) and self.buyer_ids is not None:
+                    # Покупатель может попасть в buyer_ids позже (обработчик заказа еще не выполнен) -
+                    # перепроверяем чат в следующих итерациях.
+                    self.__deferred_chats[lcmc_event.chat.id] = (lcmc_event, time.time())
+                else:
+                    # Историю чата не запрашиваем, но считаем сообщения просмотренными, чтобы при подписке на чат
+                    # позже не получить старые сообщения как новые.
+                    self.last_messages_ids[lcmc_event.chat.id] = lcmc_event.chat.node_msg_id
+                lcmc_events_without_new_mess.append(lcmc_event)
             else:
                 lcmc_events_with_new_mess.append(lcmc_event)
         events.extend(lcmc_events_without_new_mess)
+        lcmc_events_with_new_mess.extend(rechecked)
 
         if self.make_buyer_viewing_requests:
             # в приоритете те, у которых не известен айди собеседника (чтобы быстрее узнать, что они смотрят)
@@ -248,33 +377,197 @@ class Runner:
                                                                      for i in lcmc_events_with_new_mess if
                                                                      i.chat.id in self.account.interlocutor_ids])
 
+        retried = set()
         while lcmc_events_with_new_mess or len(self.__interlocutor_ids) >= self.runner_len - 2:
-            chats_pack = lcmc_events_with_new_mess[:self.runner_len]
-            del lcmc_events_with_new_mess[:self.runner_len]
-            bv_pack = []
-            while self.make_buyer_viewing_requests and \
-                    len(chats_pack) + len(bv_pack) < self.runner_len and self.__interlocutor_ids:
-                interlocutor_id = self.__interlocutor_ids.pop()
-                if interlocutor_id not in self.buyers_viewing:
-                    bv_pack.append(interlocutor_id)
-
-            chats_data = {i.chat.id: i.chat.name for i in chats_pack}
-            new_msg_events = self.generate_new_message_events(chats_data, bv_pack)
-
-            if self.make_buyer_viewing_requests:
+            # После 429 ошибки не нагружаем FunPay параллельными запросами.
+            workers = self.max_chat_requests if time.time() - self.account.last_429_err_time > 60 else 1
+            packs = []
+            while len(packs) < workers and \
+                    (lcmc_events_with_new_mess or len(self.__interlocutor_ids) >= self.runner_len - 2):
+                chats_pack = lcmc_events_with_new_mess[:self.runner_len]
+                del lcmc_events_with_new_mess[:self.runner_len]
+                bv_pack = []
+                while self.make_buyer_viewing_requests and \
+                        len(chats_pack) + len(bv_pack) < self.runner_len and self.__interlocutor_ids:
+                    interlocutor_id = self.__interlocutor_ids.pop()
+                    if interlocutor_id not in self.buyers_viewing:
+                        bv_pack.append(interlocutor_id)
+                packs.append((chats_pack, {i.chat.id: i.chat.name for i in chats_pack}, bv_pack))
+
+            if len(packs) == 1:
+                histories = [self.fetch_chats_histories(packs[0][1], packs[0][2])]
+            else:
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(self.max_chat_requests, thread_name_prefix="FunPayAPI-runner")
+                histories = list(self.__executor.map(lambda pack: self.fetch_chats_histories(pack[1], pack[2]), packs))
+
+            # Обрабатываем ответы в исходном порядке пачек (buyers_viewing пополняется в этом потоке).
+            for (chats_pack, chats_data, bv_pack), (chats, buyers_viewing) in zip(packs, histories):
+                self.buyers_viewing.update(buyers_viewing)
+                if chats is not None:
+                    returned = len(chats) + len([i for i in bv_pack if i in self.buyers_viewing])
+                    if not self.record_runner_response(len(chats_data) + len(bv_pack), returned):
+                        # FunPay обрезал ответ: чаты, которых нет в ответе, запрашиваем повторно (один раз).
+                        missing = [i for i in chats_pack if i.chat.id not in chats and i.chat.id not in retried]
+                        retried.update(i.chat.id for i in missing)
+                        lcmc_events_with_new_mess[:0] = missing
+                        chats_pack = [i for i in chats_pack if i not in missing]
+                new_msg_events = self.make_new_message_events(chats or {})
+
                 # Если раньше айди не знали, то добавляем
-                for chat_id, msgs in new_msg_events.items():
-                    if chat_id not in self.account.interlocutor_ids and msgs and msgs[0].message.interlocutor_id:
-                        self.account.interlocutor_ids[chat_id] = msgs[0].message.interlocutor_id
-                        self.__interlocutor_ids.add(msgs[0].message.interlocutor_id)
-
-            # [LastChatMessageChanged, NewMSG, NewMSG ..., LastChatMessageChanged, NewMSG, NewMSG ...]
-            for i in chats_pack:
-                events.append(i)
-                if new_msg_events.get(i.chat.id):
-                    events.extend(new_msg_events[i.chat.id])
+                for chat_id, msgs in (chats or {}).items():
+                    if chat_id not in self.account.interlocutor_ids and msgs and msgs[0].interlocutor_id:
+                        self.account.interlocutor_ids[chat_id] = msgs[0].interlocutor_id
+                        if self.make_buyer_viewing_requests and new_msg_events.get(chat_id):
+                            self.__interlocutor_ids.add(msgs[0].interlocutor_id)
+
+                # [LastChatMessageChanged, NewMSG, NewMSG ..., LastChatMessageChanged, NewMSG, NewMSG ...]
+                for i in chats_pack:
+                    if i not in rechecked:
+                        events.append(i)
+                    if new_msg_events.get(i.chat.id):
+                        events.extend(new_msg_events[i.chat.id])
         return events
 
+    def recheck_deferred_chats(self, changed_chat_ids: set[int]) -> list[LastChatMessageChangedEvent]:
+        """
+        Перепроверяет чаты, отложенные фильтром buyer_ids: чаты, собеседник которых попал в buyer_ids, возвращаются
+        для запроса истории, а чаты, отложенные дольше buyer_filter_grace секунд, считаются просмотренными.
+
+        :param changed_chat_ids: ID чатов, изменившихся в этой итерации (их отложенные события заменяются новыми).
+        :type changed_chat_ids: :obj:`set` of :obj:`int`
+
+        :return: события чатов, историю которых нужно запросить.
+        :rtype: :obj:`list` of :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`
+        """
+        result = []
+        now = time.time()
+        for chat_id, (lcmc_event, deferred_at) in list(self.__deferred_chats.items()):
+            if chat_id in changed_chat_ids:
+                del self.__deferred_chats[chat_id]
+            elif self.wants(EventTypes.NEW_MESSAGE) and self.is_chat_subscribed(lcmc_event.chat):
+                del self.__deferred_chats[chat_id]
+                result.append(lcmc_event)
+            elif now - deferred_at >= self.buyer_filter_grace:
+                del self.__deferred_chats[chat_id]
+                self.last_messages_ids[chat_id] = max(lcmc_event.chat.node_msg_id,
+                                                      self.last_messages_ids.get(chat_id, -1))
+        return result
+
+    def subscribe(self, event_types: set[EventTypes] | list[EventTypes] | None = None,
+                  subcategory_ids: set[int] | list[int] | None = None, chat_ids=None, buyer_ids=None):
+        """
+        Ограничивает события, которые возвращает Runner. Фильтры применяются до доп. запросов:
+        истории чатов (:meth:`FunPayAPI.account.Account.get_chats_histories`) запрашиваются только для подписанных
+        чатов, а список продаж (:meth:`FunPayAPI.account.Account.get_sales`) - только при подписке на события заказов.
+
+        Для чатов, не прошедших фильтр, возвращается только
+        :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`, а их сообщения считаются просмотренными.
+        Чаты, не прошедшие фильтр buyer_ids, перепроверяются в течение
+        :attr:`FunPayAPI.updater.runner.Runner.buyer_filter_grace` секунд: если собеседник за это время попал в
+        buyer_ids, его новые сообщения будут возвращены.
+        Чаты, собеседник которых еще неизвестен, запрашиваются (чтобы узнать собеседника).
+
+        :param event_types: типы событий (None - все).
+        :type event_types: :obj:`set` of :class:`FunPayAPI.common.enums.EventTypes`, опционально
+
+        :param subcategory_ids: ID подкатегорий, по заказам которых возвращать события (None - все).
+            Заказы с неопределенной подкатегорией не отфильтровываются.
+        :type subcategory_ids: :obj:`set` of :obj:`int`, опционально
+
+        :param chat_ids: ID чатов (любой объект, поддерживающий `in`; None - без фильтра).
+
+        :param buyer_ids: ID собеседников (любой объект, поддерживающий `in`, например, изменяемое множество
+            покупателей с открытыми заказами; None - без фильтра).
+        """
+        self.event_types = set(event_types) if event_types is not None else None
+        self.subcategory_ids = set(subcategory_ids) if subcategory_ids is not None else None
+        self.chat_ids = chat_ids
+        self.buyer_ids = buyer_ids
+
+    def wants(self, *event_types: EventTypes) -> bool:
+        """
+        Подписан ли Runner хотя бы на один из переданных типов событий?
+
+        :rtype: :obj:`bool`
+        """
+        return self.event_types is None or any(i in self.event_types for i in event_types)
+
+    def is_chat_subscribed(self, chat: types.ChatShortcut) -> bool:
+        """
+        Нужно ли запрашивать историю чата (с учетом chat_ids и buyer_ids)?
+
+        :rtype: :obj:`bool`
+        """
+        if self.chat_ids is None and self.buyer_ids is None:
+            return True
+        if self.chat_ids is not None and chat.id in self.chat_ids:
+            return True
+        if self.buyer_ids is not None:
+            interlocutor_id = self.account.interlocutor_ids.get(chat.id)
+            # покупатели новых заказов из этого же ответа еще не могли попасть в buyer_ids
+            return interlocutor_id is None or interlocutor_id in self.buyer_ids or \
+                interlocutor_id in self.__new_order_buyers
+        return False
+
+    def is_order_subscribed(self, order: types.OrderShortcut) -> bool:
+        """
+        Нужно ли возвращать события о заказе (с учетом subcategory_ids)?
+
+        :rtype: :obj:`bool`
+        """
+        if self.subcategory_ids is None or order.subcategory is None:
+            return True
+        return order.subcategory.id in self.subcategory_ids
+
+    @property
+    def objects_per_request(self) -> float:
+        """
+        Среднее кол-во объектов, полученных за один запрос к funpay.com/runner/.
+
+        :rtype: :obj:`float`
+        """
+        return self.runner_stats["objects_received"] / self.runner_stats["requests"] \
+            if self.runner_stats["requests"] else 0.0
+
+    def record_runner_response(self, requested: int, returned: int) -> bool:
+        """
+        Учитывает ответ funpay.com/runner/ на запрос историй чатов и подбирает runner_len:
+        если FunPay вернул меньше объектов, чем было запрошено, runner_len уменьшается до кол-ва полученных объектов;
+        после runner_len_probe_every полных ответов подряд runner_len пробно увеличивается на 1
+        (но не выше max_runner_len и размера, на котором ответ уже обрезался).
+
+        :param requested: кол-во запрошенных объектов.
+        :type requested: :obj:`int`
+
+        :param returned: кол-во полученных объектов.
+        :type returned: :obj:`int`
+
+        :return: True, если ответ полный, False, если обрезан.
+        :rtype: :obj:`bool`
+        """
+        self.runner_stats["requests"] += 1
+        self.runner_stats["objects_requested"] += requested
+        self.runner_stats["objects_received"] += returned
+        if returned < requested:
+            self.runner_stats["truncated"] += 1
+            self.__full_responses = 0
+            self.__runner_len_ceiling = min(requested, self.__runner_len_ceiling or requested)
+            if returned and returned < self.runner_len:
+                logger.info(f"funpay.com/runner/ вернул {returned} объектов из {requested}, runner_len: "
+                            f"{self.runner_len} -> {max(returned, 3)}.")
+                self.runner_len = max(returned, 3)
+            return False
+        if requested < self.runner_len:
+            return True
+        self.__full_responses += 1
+        if self.__full_responses >= self.runner_len_probe_every and self.runner_len < self.max_runner_len and \
+                (self.__runner_len_ceiling is None or self.runner_len + 1 < self.__runner_len_ceiling):
+            self.__full_responses = 0
+            self.runner_len += 1
+            logger.debug(f"Пробую увеличить runner_len до {self.runner_len}.")
+        return True
+
     def generate_new_message_events(self, chats_data: dict[int, str],
                                     interlocutor_ids: list[int] | None = None) -> dict[int, list[NewMessageEvent]]:
         """
@@ -288,28 +581,54 @@ class Runner:
         :return: словарь с событиями новых сообщений в формате {ID чата: [список событий]}
         :rtype: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.updater.events.NewMessageEvent`}
         """
-        attempts = 3
-        while attempts:
-            attempts -= 1
-            try:
-                chats = self.account.get_chats_histories(chats_data, interlocutor_ids)
-                break
-            except exceptions.RequestFailedError as e:
-                logger.error(e)
-            except:
-                logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}.")
-                logger.debug("TRACEBACK", exc_info=True)
-            time.sleep(1)
-        else:
-            logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}: превышено кол-во попыток.")
-            return {}
+        chats, buyers_viewing = self.fetch_chats_histories(chats_data, interlocutor_ids)
+        self.buyers_viewing.update(buyers_viewing)
+        return self.make_new_message_events(chats or {})
+
+    def fetch_chats_histories(self, chats_data: dict[int, str], interlocutor_ids: list[int] | None = None) -> \
+            tuple[dict[int, list[types.Message]] | None, dict[int, types.BuyerViewing]]:
+        """
+        Получает истории переданных чатов (повторные попытки выполняет :meth:`FunPayAPI.account.Account.method`).
+        Не меняет состояние Runner'а (информация о просматриваемых лотах возвращается, а не записывается в
+        :attr:`FunPayAPI.updater.runner.Runner.buyers_viewing`), поэтому может вызываться из нескольких потоков
+        одновременно.
+
+        :param chats_data: ID чатов и никнеймы собеседников (None, если никнейм неизвестен).
+        :type chats_data: :obj:`dict` {:obj:`int`: :obj:`str` or :obj:`None`}
+
+        :param interlocutor_ids: ID собеседников, для которых нужно узнать, какие лоты они смотрят.
+        :type interlocutor_ids: :obj:`list` of :obj:`int` or :obj:`None`, опционально
 
+        :return: истории чатов ({ID чата: [список сообщений]}) или None, если запрос не удался, и информация о
+            просматриваемых лотах ({ID собеседника: BuyerViewing}).
+        :rtype: :obj:`tuple` (:obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.types.Message`} or
+            :obj:`None`, :obj:`dict` {:obj:`int`: :class:`FunPayAPI.types.BuyerViewing`})
+        """
+        buyers_viewing = {}
+        try:
+            return self.account.get_chats_histories(chats_data, interlocutor_ids, buyers_viewing), buyers_viewing
+        except exceptions.RequestFailedError as e:
+            logger.error(e)
+        except:
+            logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}.")
+            logger.debug("TRACEBACK", exc_info=True)
+        return None, buyers_viewing
+
+    def make_new_message_events(self, chats: dict[int, list[types.Message]]) -> dict[int, list[NewMessageEvent]]:
+        """
+        Генерирует события новых сообщений из историй чатов и обновляет ID последних сообщений.
+
+        :param chats: результат выполнения :meth:`FunPayAPI.updater.runner.Runner.fetch_chats_histories`.
+        :type chats: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.types.Message`}
+
+        :return: словарь с событиями новых сообщений в формате {ID чата: [список событий]}
+        :rtype: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.updater.events.NewMessageEvent`}
+        """
         result = {}
 
         for cid in chats:
             messages = chats[cid]
             result[cid] = []
-            self.by_bot_ids[cid] = self.by_bot_ids.get(cid) or []
 
             # Удаляем все сообщения, у которых ID меньше сохраненного последнего сообщения
             if self.last_messages_ids.get(cid):
@@ -318,9 +637,10 @@ class Runner:
                 continue
 
             # Отмечаем все сообщения, отправленные с помощью Account.send_message()
-            if self.by_bot_ids.get(cid):
+            by_bot_ids = self.by_bot_ids.get(cid)
+            if by_bot_ids:
                 for i in messages:
-                    if not i.by_bot and i.id in self.by_bot_ids[cid]:
+                    if not i.by_bot and i.id in by_bot_ids:
                         i.by_bot = True
 
             stack = MessageEventsStack()
@@ -331,7 +651,12 @@ class Runner:
                             m.id > min(self.last_messages_ids.values(), default=10 ** 20)] or messages[-1:]
 
             self.last_messages_ids[cid] = messages[-1].id  # Перезаписываем ID последнего сообщение
-            self.by_bot_ids[cid] = [i for i in self.by_bot_ids[cid] if i > self.last_messages_ids[cid]]  # чистим память
+            if by_bot_ids:  # чистим память
+                by_bot_ids = {i for i in by_bot_ids if i > messages[-1].id}
+                if by_bot_ids:
+                    self.by_bot_ids[cid] = by_bot_ids
+                else:
+                    self.by_bot_ids.pop(cid, None)
 
             for msg in messages:
                 event = NewMessageEvent(self.__last_msg_event_tag, msg, stack)
@@ -359,41 +684,67 @@ class Runner:
         if not self.__first_request:
             events.append(OrdersListChangedEvent(self.__last_order_event_tag,
                                                  obj["data"]["buyer"], obj["data"]["seller"]))
-        if not self.make_order_requests:
+        if not self.make_order_requests or not self.wants(EventTypes.INITIAL_ORDER, EventTypes.NEW_ORDER,
+                                                          EventTypes.ORDER_STATUS_CHANGED):
             return events
 
-        attempts = 3
-        while attempts:
-            attempts -= 1
-            try:
-                orders_list = self.account.get_sales()  # todo добавить возможность реакции на подтверждение очень старых заказов
+        initial = self.__first_request or not self.__orders_synced
+        orders, next_order_id, subcategories, pages = [], None, None, 0
+        while True:
+            result = self.__get_sales(start_from=next_order_id, subcategories=subcategories,
+                                      known_orders=None if initial else self.known_orders)
+            if result is None:
+                if not pages:
+                    return events
+                break
+            next_order_id, page_orders, _, page_subcategories = result
+            subcategories = subcategories or page_subcategories
+            orders.extend(page_orders)
+            pages += 1
+            # первичная синхронизация - только первая страница (как и раньше);
+            # далее листаем, пока не дойдем до уже известных заказов
+            if initial or not next_order_id or pages >= self.max_order_pages:
                 break
-            except exceptions.RequestFailedError as e:
-                logger.error(e)
-            except:
-                logger.error("Не удалось обновить список заказов.")
-                logger.debug("TRACEBACK", exc_info=True)
-            time.sleep(1)
-        else:
-            logger.error("Не удалось обновить список продаж: превышено кол-во попыток.")
-            return events
 
-        saved_orders = {}
-        for order in orders_list[1]:
-            saved_orders[order.id] = order
-            if order.id not in self.saved_orders:
-                if self.__first_request:
+        if initial:
+            self.saved_orders.clear()
+            self.known_orders.clear()
+        for order in orders:
+            if not self.is_order_subscribed(order):
+                # заказ запоминаем, но события по нему не возвращаем
+                pass
+            elif order.id not in self.known_orders:
+                if initial:
                     events.append(InitialOrderEvent(self.__last_order_event_tag, order))
                 else:
                     events.append(NewOrderEvent(self.__last_order_event_tag, order))
+                    self.__new_order_buyers.add(order.buyer_id)
                     if order.status == types.OrderStatuses.CLOSED:
                         events.append(OrderStatusChangedEvent(self.__last_order_event_tag, order))
 
-            elif order.status != self.saved_orders[order.id].status:
+            elif order.status != self.known_orders[order.id]:
                 events.append(OrderStatusChangedEvent(self.__last_order_event_tag, order))
-        self.saved_orders = saved_orders
+            self.saved_orders[order.id] = order
+            self.known_orders[order.id] = order.status
+        self.__orders_synced = True
         return events
 
+    def __get_sales(self, **kwargs) -> tuple | None:
+        """
+        Вызывает :meth:`FunPayAPI.account.Account.get_sales` (повторные попытки выполняет
+        :meth:`FunPayAPI.account.Account.method`).
+
+        :return: результат :meth:`FunPayAPI.account.Account.get_sales` или None, если запрос не удался.
+        """
+        try:
+            return self.account.get_sales(**kwargs)  # todo добавить возможность реакции на подтверждение очень старых заказов
+        except exceptions.RequestFailedError as e:
+            logger.error(e)
+        except:
+            logger.error("Не удалось обновить список заказов.")
+            logger.debug("TRACEBACK", exc_info=True)
+        return None
+
     def update_last_message(self, chat_id: int, message_id: int, message_text: str | None):
         """
         Обновляет сохраненный ID последнего сообщения чата.
@@ -419,10 +770,167 @@ class Runner:
         :param message_id: ID сообщения.
         :type message_id: :obj:`int`
         """
-        if self.by_bot_ids.get(chat_id) is None:
-            self.by_bot_ids[chat_id] = [message_id]
-        else:
-            self.by_bot_ids[chat_id].append(message_id)
+        self.by_bot_ids[chat_id] = self.by_bot_ids.get(chat_id, set()) | {message_id}
+
+    def memory_report(self) -> dict[str, dict[str, int | float | None]]:
+        """
+        Отчет об использовании памяти словарями Runner'а и :attr:`FunPayAPI.account.Account.interlocutor_ids`.
+
+        :return: {название словаря: статистика (см. :meth:`FunPayAPI.common.utils.BoundedDict.memory_stats`)};
+            для by_bot_ids дополнительно указывается общее кол-во ID сообщений (messages).
+        :rtype: :obj:`dict`
+        """
+        report = {name: getattr(self, name).memory_stats() for name in
+                  ("saved_orders", "known_orders", "runner_last_messages", "last_messages_ids", "by_bot_ids")}
+        report["by_bot_ids"]["messages"] = sum(len(i) for i in self.by_bot_ids.to_dict().values())
+        if isinstance(self.account.interlocutor_ids, utils.BoundedDict):
+            report["interlocutor_ids"] = self.account.interlocutor_ids.memory_stats()
+        return report
+
+    def get_state(self) -> dict:
+        """
+        Возвращает состояние Runner'а, достаточное для продолжения работы после перезапуска.
+
+        :return: состояние Runner'а.
+        :rtype: :obj:`dict`
+        """
+        return {
+            "version": 1,
+            "account_id": self.account.id,
+            "time": time.time(),
+            "msg_tag": self.__last_msg_event_tag,
+            "order_tag": self.__last_order_event_tag,
+            "runner_last_messages": self.runner_last_messages.to_dict(),
+            "last_messages_ids": self.last_messages_ids.to_dict(),
+            "runner_len": self.runner_len,
+            "orders_synced": self.__orders_synced,
+            "orders": {order_id: status.value for order_id, status in self.known_orders.to_dict().items()}
+        }
+
+    def set_state(self, state: dict):
+        """
+        Восстанавливает состояние Runner'а, полученное с помощью :meth:`FunPayAPI.updater.runner.Runner.get_state`.
+        Следующий запрос не будет считаться первым: новые заказы и сообщения, появившиеся с момента сохранения
+        состояния, будут возвращены как :class:`FunPayAPI.updater.events.NewOrderEvent` и
+        :class:`FunPayAPI.updater.events.NewMessageEvent`.
+
+        :param state: состояние Runner'а.
+        :type state: :obj:`dict`
+        """
+        self.__last_msg_event_tag = state["msg_tag"]
+        self.__last_order_event_tag = state["order_tag"]
+        self.runner_last_messages.clear()
+        self.runner_last_messages.update({int(k): v for k, v in state["runner_last_messages"].items()})
+        self.last_messages_ids.clear()
+        self.last_messages_ids.update({int(k): v for k, v in state["last_messages_ids"].items()})
+        self.known_orders.clear()
+        self.known_orders.update({k: types.OrderStatuses(v) for k, v in state["orders"].items()})
+        self.runner_len = state.get("runner_len", self.runner_len)
+        self.__orders_synced = state.get("orders_synced", bool(self.known_orders))
+        self.__first_request = False
+
+    def save_state(self, path: str | None = None):
+        """
+        Сохраняет состояние Runner'а в файл (атомарно: через временный файл).
+
+        :param path: путь до файла (по умолчанию - state_file).
+        :type path: :obj:`str` or :obj:`None`, опционально
+        """
+        path = path or self.state_file
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.get_state(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        self.__last_state_save = time.time()
+
+    def load_state(self, path: str | None = None) -> bool:
+        """
+        Загружает состояние Runner'а из файла.
+
+        :param path: путь до файла (по умолчанию - state_file).
+        :type path: :obj:`str` or :obj:`None`, опционально
+
+        :return: True, если состояние восстановлено, иначе False.
+        :rtype: :obj:`bool`
+        """
+        path = path or self.state_file
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") != 1 or state.get("account_id") != self.account.id:
+                logger.warning(f"Состояние Runner'а в {path} относится к другому аккаунту / версии, пропускаю.")
+                return False
+            self.set_state(state)
+        except Exception:
+            logger.error(f"Не удалось загрузить состояние Runner'а из {path}.")
+            logger.debug("TRACEBACK", exc_info=True)
+            return False
+        logger.info(f"Состояние Runner'а восстановлено из {path} "
+                    f"(сохранено {time.strftime('%d.%m.%Y %H:%M:%S', time.localtime(state['time']))}).")
+        return True
+
+    def save_checkpoint(self):
+        """
+        Сохраняет состояние в state_file, если с прошлого сохранения прошло не меньше state_save_interval секунд.
+        Сохраненное состояние считается обработанным: при падении бота события до него не повторятся. Поэтому
+        :meth:`FunPayAPI.updater.runner.Runner.listen` вызывает метод после того, как потребитель генератора вернул
+        управление для всех событий итерации, - это гарантирует обработку только для синхронных потребителей.
+        :meth:`FunPayAPI.updater.dispatcher.Dispatcher.listen` перед вызовом дожидается своих обработчиков.
+        Если события передаются в другие потоки или задачи (или используется
+        :meth:`FunPayAPI.updater.runner.Runner.listen_batches`), вызывайте метод сами после их обработки.
+        """
+        if not self.checkpoint_due():
+            return
+        try:
+            self.save_state()
+        except:
+            logger.error(f"Не удалось сохранить состояние Runner'а в {self.state_file}.")
+            logger.debug("TRACEBACK", exc_info=True)
+
+    def checkpoint_due(self) -> bool:
+        """
+        Пора ли сохранить состояние (прошло не меньше state_save_interval секунд с прошлого сохранения)?
+
+        :rtype: :obj:`bool`
+        """
+        return bool(self.state_file) and time.time() - self.__last_state_save >= self.state_save_interval
+
+    def listen_batches(self, requests_delay: int | float = 6.0,
+                       ignore_exceptions: bool = True) -> Generator[tuple[Runner, list]]:
+        """
+        Бесконечно отправляет запросы для получения новых событий и возвращает их пачками (по одной на запрос).
+        Состояние не сохраняется: вызовите :meth:`FunPayAPI.updater.runner.Runner.save_checkpoint`, когда события
+        пачки обработаны (так делает :meth:`FunPayAPI.updater.dispatcher.Dispatcher.listen`).
+
+        :param requests_delay: задержка между запросами (в секундах).
+        :type requests_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param ignore_exceptions: игнорировать ошибки?
+        :type ignore_exceptions: :obj:`bool`, опционально
+
+        :return: генератор пар (этот Runner, список событий).
+        :rtype: :obj:`Generator` of :obj:`tuple` (:class:`FunPayAPI.updater.runner.Runner`, :obj:`list`)
+        """
+        events = []
+        while True:
+            start_time = time.time()
+            try:
+                ready_events, events = self.fetch_events(events)
+                yield self, ready_events
+            except Exception as e:
+                if not ignore_exceptions:
+                    raise e
+                else:
+                    logger.error("Произошла ошибка при получении событий. "
+                                 "(ничего страшного, если это сообщение появляется нечасто).")
+                    logger.debug("TRACEBACK", exc_info=True)
+            delay = self.get_delay(requests_delay, time.time() - start_time)
+            if delay > 0:
+                time.sleep(delay)
 
     def listen(self, requests_delay: int | float = 6.0,
                ignore_exceptions: bool = True) -> Generator[InitialChatEvent | ChatsListChangedEvent |
@@ -447,38 +955,128 @@ class Runner:
             :class:`FunPayAPI.updater.events.NewOrderEvent`,
             :class:`FunPayAPI.updater.events.OrderStatusChangedEvent`
         """
-        events = []
-        while True:
-            start_time = time.time()
+        for runner, events in self.listen_batches(requests_delay, ignore_exceptions):
+            yield from events
+            runner.save_checkpoint()
+
+    def fetch_events(self, pending_events: list | None = None) -> tuple[list, list]:
+        """
+        Выполняет одну итерацию получения событий: запрашивает и парсит обновления FunPay.
+        Состояние не сохраняется: после обработки событий вызовите
+        :meth:`FunPayAPI.updater.runner.Runner.save_checkpoint`.
+
+        :param pending_events: события, отложенные на предыдущей итерации
+            (ожидающие получения поля "Покупатель смотрит").
+        :type pending_events: :obj:`list`, опционально
+
+        :return: (события, готовые к обработке, события, отложенные до следующей итерации)
+        :rtype: :obj:`tuple` (:obj:`list`, :obj:`list`)
+        """
+        events = list(pending_events or [])
+        self.__interlocutor_ids = set([event.message.interlocutor_id for event in events
+                                       if event.type == EventTypes.NEW_MESSAGE])
+        updates = self.get_updates()
+        events.extend(self.parse_updates(updates))
+        if self.event_types is not None:
+            events = [event for event in events if event.type in self.event_types]
+        if any(event.type in (EventTypes.NEW_MESSAGE, EventTypes.NEW_ORDER, EventTypes.ORDER_STATUS_CHANGED)
+               for event in events):
+            self.last_activity_time = time.time()
+        ready_events, next_events = [], []
+        for event in events:
+            if self.make_msg_requests and self.make_buyer_viewing_requests \
+                    and event.type == EventTypes.NEW_MESSAGE \
+                    and event.message.interlocutor_id is not None:
+                event.message.buyer_viewing = self.buyers_viewing.get(event.message.interlocutor_id)
+                if event.message.buyer_viewing is None:
+                    next_events.append(event)
+                    continue
+            ready_events.append(event)
+        self.buyers_viewing = {}
+        return ready_events, next_events
+
+    def set_adaptive_delay(self, min_delay: int | float, max_delay: int | float, idle_backoff: float = 1.5,
+                           activity_window: int | float = 120, activity_check: Callable[[], bool] | None = None):
+        """
+        Включает адаптивный интервал опроса: пока есть активность (новые сообщения / заказы за последние
+        activity_window секунд или activity_check() == True), запросы отправляются каждые min_delay секунд;
+        без активности задержка растет в idle_backoff раз за итерацию (начиная с requests_delay) до max_delay;
+        после 429 ошибки задержка увеличивается сильнее.
+
+        :param min_delay: задержка при активности (в секундах).
+        :type min_delay: :obj:`int` or :obj:`float`
+
+        :param max_delay: макс. задержка (в секундах).
+        :type max_delay: :obj:`int` or :obj:`float`
+
+        :param idle_backoff: множитель роста задержки при простое.
+        :type idle_backoff: :obj:`float`, опционально
+
+        :param activity_window: сколько секунд после последнего события Runner считается активным.
+        :type activity_window: :obj:`int` or :obj:`float`, опционально
+
+        :param activity_check: доп. проверка активности.
+        :type activity_check: :obj:`Callable`, опционально
+        """
+        self.min_delay, self.max_delay = min_delay, max_delay
+        self.idle_backoff = idle_backoff
+        self.activity_window = activity_window
+        self.activity_check = activity_check
+        self.__idle_delay = None
+
+    def is_active(self) -> bool:
+        """
+        Есть ли сейчас активность (недавние события или activity_check() == True)?
+
+        :rtype: :obj:`bool`
+        """
+        if time.time() - self.last_activity_time < self.activity_window:
+            return True
+        if self.activity_check is not None:
             try:
-                self.__interlocutor_ids = set([event.message.interlocutor_id for event in events
-                                               if event.type == EventTypes.NEW_MESSAGE])
-                updates = self.get_updates()
-                events.extend(self.parse_updates(updates))
-                next_events = []
-                for event in events:
-                    if self.make_msg_requests and self.make_buyer_viewing_requests \
-                            and event.type == EventTypes.NEW_MESSAGE \
-                            and event.message.interlocutor_id is not None:
-                        event.message.buyer_viewing = self.buyers_viewing.get(event.message.interlocutor_id)
-                        if event.message.buyer_viewing is None:
-                            next_events.append(event)
-                            continue
-
-                    yield event
-                events = next_events
-                self.buyers_viewing = {}
-            except Exception as e:
-                if not ignore_exceptions:
-                    raise e
-                else:
-                    logger.error("Произошла ошибка при получении событий. "
-                                 "(ничего страшного, если это сообщение появляется нечасто).")
-                    logger.debug("TRACEBACK", exc_info=True)
-            iteration_time = time.time() - start_time
-            if time.time() - self.account.last_429_err_time > 60:
-                rt = requests_delay - iteration_time
-                if rt > 0:
-                    time.sleep(rt)
+                return bool(self.activity_check())
+            except:
+                logger.debug("TRACEBACK", exc_info=True)
+        return False
+
+    def get_delay(self, requests_delay: int | float, iteration_time: int | float) -> float:
+        """
+        Вычисляет задержку перед следующим запросом к FunPay.
+        Причина выбора и задержка сохраняются в :attr:`FunPayAPI.updater.runner.Runner.delay_metrics`.
+
+        :param requests_delay: задержка между запросами (в секундах).
+        :type requests_delay: :obj:`int` or :obj:`float`
+
+        :param iteration_time: время, затраченное на текущую итерацию (в секундах).
+        :type iteration_time: :obj:`int` or :obj:`float`
+
+        :return: время ожидания (в секундах).
+        :rtype: :obj:`float`
+        """
+        recent_429 = time.time() - self.account.last_429_err_time <= 60
+        if self.min_delay is None:
+            reason = "429" if recent_429 else "fixed"
+            delay = requests_delay if recent_429 else max(requests_delay - iteration_time, 0)
+        elif recent_429:
+            reason = "429"
+            self.__idle_delay = min(max(self.__idle_delay or requests_delay, requests_delay) * 2, self.max_delay)
+            delay = max(self.__idle_delay, requests_delay)
+        elif self.is_active():
+            reason = "active"
+            self.__idle_delay = None
+            delay = max(self.min_delay - iteration_time, 0)
+        else:
+            reason = "idle"
+            if self.__idle_delay is None:
+                self.__idle_delay = requests_delay
             else:
-                time.sleep(requests_delay)
+                self.__idle_delay = min(self.__idle_delay * self.idle_backoff, self.max_delay)
+            delay = max(self.__idle_delay - iteration_time, 0)
+
+        if reason != self.delay_metrics["reason"]:
+            logger.debug(f"Интервал опроса: {reason}, {delay:.2f} сек.")
+        self.delay_metrics["delay"] = delay
+        self.delay_metrics["reason"] = reason
+        self.delay_metrics["idle_delay"] = self.__idle_delay
+        self.delay_metrics["reasons"][reason] = self.delay_metrics["reasons"].get(reason, 0) + 1
+        return delay
@@ -0,0 +1,325 @@
+"""
+В данном модуле описан Supervisor - опрос нескольких аккаунтов FunPay из одного процесса.
+"""
+from __future__ import annotations
+
+from typing import Any, Generator, Hashable
+
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import threading
+import logging
+import heapq
+import time
+
+import requests
+
+from ..account import Account, create_session
+from .runner import Runner
+
+logger = logging.getLogger("FunPayAPI.supervisor")
+
+
+class _Slot:
+    """
+    Аккаунт, опрашиваемый :class:`FunPayAPI.updater.supervisor.Supervisor`.
+    """
+    def __init__(self, account_id: Hashable, runner: Runner, requests_delay: int | float | None,
+                 min_poll_interval: int | float):
+        self.account_id: Hashable = account_id
+        self.runner: Runner = runner
+        self.requests_delay: int | float | None = requests_delay
+        self.min_poll_interval: int | float = min_poll_interval
+        self.pending_events: list = []
+        self.next_time: float = 0
+        self.running: bool = False
+        self.polls: int = 0
+        self.errors: int = 0
+        self.events: int = 0
+        self.last_poll_time: float = 0
+        self.last_iteration_time: float = 0
+
+
+class Supervisor:
+    """
+    Опрашивает несколько аккаунтов FunPay из одного процесса.
+
+    Для каждого аккаунта создается свой :class:`FunPayAPI.updater.runner.Runner`, но все аккаунты используют общую
+    HTTP-сессию (пул соединений) и общий пул потоков. Итерации Runner'ов планируются по времени следующего опроса:
+    аккаунты, которым пора делать запрос, обслуживаются по очереди (при равном времени - тот, кто дольше ждал),
+    поэтому ни один аккаунт не может занять все потоки. Один аккаунт никогда не опрашивается параллельно сам с собой,
+    поэтому порядок его событий сохраняется.
+
+    Интервал опроса аккаунта вычисляется его Runner'ом (:meth:`FunPayAPI.updater.runner.Runner.get_delay`, в т.ч.
+    адаптивный интервал и увеличение задержки после 429 ошибки), но не меньше min_poll_interval.
+
+    События всех аккаунтов возвращаются одним потоком (:meth:`FunPayAPI.updater.supervisor.Supervisor.listen`),
+    у каждого события заполнен :attr:`FunPayAPI.updater.events.BaseEvent.account_id`.
+
+    :param workers: кол-во потоков, в которых одновременно опрашиваются аккаунты.
+    :type workers: :obj:`int`, опционально
+
+    :param min_poll_interval: мин. интервал между запросами одного аккаунта (в секундах) по умолчанию.
+    :type min_poll_interval: :obj:`int` or :obj:`float`, опционально
+
+    :param pool_connections: кол-во пулов соединений (хостов) общей сессии.
+    :type pool_connections: :obj:`int`, опционально
+
+    :param pool_maxsize: макс. кол-во соединений, хранящихся в пуле одного хоста.
+    :type pool_maxsize: :obj:`int`, опционально
+
+    :param pool_block: ждать ли освобождения соединения, если все соединения хоста заняты.
+    :type pool_block: :obj:`bool`, опционально
+
+    :param max_retries: кол-во повторных попыток при ошибках подключения.
+    :type max_retries: :obj:`int`, опционально
+
+    :param keep_alive: переиспользовать ли соединения между запросами?
+    :type keep_alive: :obj:`bool`, опционально
+    """
+    def __init__(self, workers: int = 4, min_poll_interval: int | float = 1.0, pool_connections: int = 10,
+                 pool_maxsize: int = 20, pool_block: bool = False, max_retries: int = 0, keep_alive: bool = True):
+        self.session: requests.Session = create_session(pool_connections, pool_maxsize, pool_block, max_retries,
+                                                        keep_alive)
+        """Общая HTTP-сессия аккаунтов."""
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(workers, thread_name_prefix="FunPayAPI-supervisor")
+        """Пул потоков, в котором опрашиваются аккаунты."""
+        self.workers: int = workers
+        """Кол-во потоков."""
+        self.min_poll_interval: int | float = min_poll_interval
+        """Мин. интервал между запросами одного аккаунта (в секундах) по умолчанию."""
+        self.running: bool = False
+        """Запущен ли цикл опроса?"""
+
+        self.__slots: dict[Hashable, _Slot] = {}
+        self.__queue: list[tuple[float, int, Hashable]] = []
+        self.__seq: int = 0
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+
+    @property
+    def accounts(self) -> dict[Hashable, Account]:
+        """
+        Опрашиваемые аккаунты.
+
+        :rtype: :obj:`dict` {ID аккаунта: :class:`FunPayAPI.account.Account`}
+        """
+        with self.__lock:
+            return {account_id: slot.runner.account for account_id, slot in self.__slots.items()}
+
+    @property
+    def runners(self) -> dict[Hashable, Runner]:
+        """
+        Runner'ы опрашиваемых аккаунтов.
+
+        :rtype: :obj:`dict` {ID аккаунта: :class:`FunPayAPI.updater.runner.Runner`}
+        """
+        with self.__lock:
+            return {account_id: slot.runner for account_id, slot in self.__slots.items()}
+
+    def create_account(self, golden_key: str, user_agent: str | None = None, **kwargs) -> Account:
+        """
+        Создает и инициализирует аккаунт, использующий общую HTTP-сессию.
+
+        :param golden_key: токен (golden_key) аккаунта.
+        :type golden_key: :obj:`str`
+
+        :param user_agent: user-agent браузера, с которого был произведен вход в аккаунт.
+        :type user_agent: :obj:`str` or :obj:`None`, опционально
+
+        :param kwargs: остальные параметры :class:`FunPayAPI.account.Account`.
+
+        :return: инициализированный аккаунт.
+        :rtype: :class:`FunPayAPI.account.Account`
+        """
+        return Account(golden_key, user_agent, session=self.session, **kwargs).get()
+
+    def add(self, account: Account, account_id: Hashable | None = None, runner: Runner | None = None,
+            requests_delay: int | float | None = None, min_poll_interval: int | float | None = None,
+            **runner_kwargs) -> Runner:
+        """
+        Добавляет аккаунт в опрос (можно вызывать и во время :meth:`FunPayAPI.updater.supervisor.Supervisor.listen`).
+
+        :param account: инициализированный аккаунт.
+        :type account: :class:`FunPayAPI.account.Account`
+
+        :param account_id: ID аккаунта в событиях (по умолчанию - :attr:`FunPayAPI.account.Account.id`).
+        :type account_id: :obj:`Hashable` or :obj:`None`, опционально
+
+        :param runner: уже созданный Runner аккаунта (иначе будет создан новый с параметрами runner_kwargs).
+        :type runner: :class:`FunPayAPI.updater.runner.Runner` or :obj:`None`, опционально
+
+        :param requests_delay: задержка между запросами аккаунта (по умолчанию - из
+            :meth:`FunPayAPI.updater.supervisor.Supervisor.listen`).
+        :type requests_delay: :obj:`int` or :obj:`float` or :obj:`None`, опционально
+
+        :param min_poll_interval: мин. интервал между запросами аккаунта (в секундах).
+        :type min_poll_interval: :obj:`int` or :obj:`float` or :obj:`None`, опционально
+
+        :return: Runner аккаунта.
+        :rtype: :class:`FunPayAPI.updater.runner.Runner`
+        """
+        account_id = account.id if account_id is None else account_id
+        with self.__lock:
+            if account_id in self.__slots:
+                raise ValueError(f"Аккаунт {account_id} уже добавлен.")
+        runner = runner or Runner(account, **runner_kwargs)
+        slot = _Slot(account_id, runner, requests_delay,
+                     self.min_poll_interval if min_poll_interval is None else min_poll_interval)
+        with self.__lock:
+            self.__slots[account_id] = slot
+            self.__schedule(slot, time.time())
+        self.__wakeup.set()
+        logger.info(f"Аккаунт {account_id} добавлен в опрос.")
+        return runner
+
+    def remove(self, account_id: Hashable) -> Runner | None:
+        """
+        Убирает аккаунт из опроса (текущая итерация аккаунта, если она выполняется, будет завершена,
+        но ее события не будут возвращены).
+
+        :param account_id: ID аккаунта.
+        :type account_id: :obj:`Hashable`
+
+        :return: Runner аккаунта или None, если аккаунт не найден.
+        :rtype: :class:`FunPayAPI.updater.runner.Runner` or :obj:`None`
+        """
+        with self.__lock:
+            slot = self.__slots.pop(account_id, None)
+        return slot.runner if slot else None
+
+    def stats(self) -> dict[Hashable, dict[str, Any]]:
+        """
+        Статистика опроса аккаунтов.
+
+        :return: {ID аккаунта: {"polls", "errors", "events", "last_poll_time", "last_iteration_time", "next_poll_in",
+            "delay_reason"}}
+        :rtype: :obj:`dict`
+        """
+        now = time.time()
+        with self.__lock:
+            return {account_id: {"polls": slot.polls, "errors": slot.errors, "events": slot.events,
+                                 "last_poll_time": slot.last_poll_time,
+                                 "last_iteration_time": slot.last_iteration_time,
+                                 "next_poll_in": 0 if slot.running else max(slot.next_time - now, 0),
+                                 "delay_reason": slot.runner.delay_metrics["reason"]}
+                    for account_id, slot in self.__slots.items()}
+
+    def listen(self, requests_delay: int | float = 6.0, ignore_exceptions: bool = True) -> Generator:
+        """
+        Бесконечно опрашивает все добавленные аккаунты и возвращает их события
+        (до вызова :meth:`FunPayAPI.updater.supervisor.Supervisor.stop`).
+
+        :param requests_delay: задержка между запросами одного аккаунта (в секундах).
+        :type requests_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param ignore_exceptions: игнорировать ошибки? (иначе ошибка любого аккаунта останавливает опрос)
+        :type ignore_exceptions: :obj:`bool`, опционально
+
+        :return: генератор событий всех аккаунтов
+            (с заполненным :attr:`FunPayAPI.updater.events.BaseEvent.account_id`).
+        :rtype: :obj:`Generator`
+        """
+        for runner, events in self.listen_batches(requests_delay, ignore_exceptions):
+            yield from events
+            runner.save_checkpoint()
+
+    def listen_batches(self, requests_delay: int | float = 6.0, ignore_exceptions: bool = True) -> Generator:
+        """
+        То же, что :meth:`FunPayAPI.updater.supervisor.Supervisor.listen`, но события возвращаются пачками
+        (по одной на итерацию аккаунта) вместе с Runner'ом аккаунта. Состояние Runner'а не сохраняется
+        (см. :meth:`FunPayAPI.updater.runner.Runner.listen_batches`).
+
+        :param requests_delay: задержка между запросами одного аккаунта (в секундах).
+        :type requests_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param ignore_exceptions: игнорировать ошибки? (иначе ошибка любого аккаунта останавливает опрос)
+        :type ignore_exceptions: :obj:`bool`, опционально
+
+        :return: генератор пар (Runner аккаунта, список событий).
+        :rtype: :obj:`Generator` of :obj:`tuple` (:class:`FunPayAPI.updater.runner.Runner`, :obj:`list`)
+        """
+        self.running = True
+        running: dict[Future, tuple[_Slot, float]] = {}
+        try:
+            while self.running:
+                now = time.time()
+                with self.__lock:
+                    while self.__queue and len(running) < self.workers and self.__queue[0][0] <= now:
+                        _, _, account_id = heapq.heappop(self.__queue)
+                        slot = self.__slots.get(account_id)
+                        if slot is None:
+                            continue
+                        slot.running = True
+                        future = self.executor.submit(slot.runner.fetch_events, slot.pending_events)
+                        running[future] = (slot, now)
+                    next_time = self.__queue[0][0] if self.__queue else None
+
+                timeout = 1.0 if next_time is None else min(max(next_time - time.time(), 0), 1.0)
+                if len(running) >= self.workers:
+                    timeout = None
+                if not running:
+                    self.__wakeup.wait(timeout)
+                    self.__wakeup.clear()
+                    continue
+
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    slot, start_time = running.pop(future)
+                    events = self.__finish(slot, future, start_time, requests_delay, ignore_exceptions)
+                    yield slot.runner, events
+        finally:
+            self.running = False
+            for future, (slot, _) in running.items():
+                future.cancel()
+                slot.running = False
+
+    def stop(self):
+        """
+        Останавливает цикл опроса :meth:`FunPayAPI.updater.supervisor.Supervisor.listen`
+        (после завершения текущих итераций).
+        """
+        self.running = False
+        self.__wakeup.set()
+
+    def close(self):
+        """
+        Останавливает опрос, пул потоков и закрывает общую HTTP-сессию.
+        """
+        self.stop()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __schedule(self, slot: _Slot, next_time: float):
+        slot.next_time = next_time
+        self.__seq += 1
+        heapq.heappush(self.__queue, (next_time, self.__seq, slot.account_id))
+
+    def __finish(self, slot: _Slot, future: Future, start_time: float, requests_delay: int | float,
+                 ignore_exceptions: bool) -> list:
+        iteration_time = time.time() - start_time
+        events = []
+        try:
+            events, slot.pending_events = future.result()
+        except Exception as e:
+            slot.errors += 1
+            if not ignore_exceptions:
+                raise e
+            logger.error(f"Произошла ошибка при получении событий аккаунта {slot.account_id}. "
+                         "(ничего страшного, если это сообщение появляется нечасто).")
+            logger.debug("TRACEBACK", exc_info=True)
+
+        delay = slot.runner.get_delay(requests_delay if slot.requests_delay is None else slot.requests_delay,
+                                      iteration_time)
+        delay = max(delay, slot.min_poll_interval - iteration_time, 0)
+        with self.__lock:
+            slot.running = False
+            slot.polls += 1
+            slot.events += len(events)
+            slot.last_poll_time = start_time
+            slot.last_iteration_time = iteration_time
+            if self.__slots.get(slot.account_id) is not slot:
+                return []
+            self.__schedule(slot, time.time() + delay)
+        for event in events:
+            event.account_id = slot.account_id
+        return events
@@ -0,0 +1,122 @@
+"""
+Микро-бенчмарк определения типа сообщения: RegularExpressions.get_message_type (одно объединённое выражение)
+против прежней цепочки search-вызовов с перекомпиляцией выражений на каждый вызов.
+
+Запуск из корня проекта::
+
+    python benchmarks/bench_message_types.py [--number 20000]
+
+Системные сообщения FunPay распознаются только на русском и английском; украинские тексты (обычные сообщения
+покупателей и системные сообщения украинской версии сайта) проверяют путь NON_SYSTEM.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FunPayAPI.common.enums import MessageTypes
+from FunPayAPI.common.utils import RegularExpressions
+
+CORPUS: dict[str, list[str]] = {
+    "ru": [
+        "Покупатель buyer01 оплатил заказ #ABCD1234. buyer01, не забудьте потом нажать кнопку «Подтвердить выполнение заказа».",
+        "Покупатель buyer01 подтвердил успешное выполнение заказа #ABCD1234 и отправил деньги продавцу Seller.",
+        "Покупатель buyer01 написал отзыв к заказу #ABCD1234.",
+        "Покупатель buyer01 изменил отзыв к заказу #ABCD1234.",
+        "Покупатель buyer01 удалил отзыв к заказу #ABCD1234.",
+        "Продавец Seller ответил на отзыв к заказу #ABCD1234.",
+        "Продавец Seller изменил ответ на отзыв к заказу #ABCD1234.",
+        "Продавец Seller удалил ответ на отзыв к заказу #ABCD1234.",
+        "Продавец Seller вернул деньги покупателю buyer01 по заказу #ABCD1234.",
+        "Администратор Admin вернул деньги покупателю buyer01 по заказу #ABCD1234.",
+        "Администратор Admin подтвердил успешное выполнение заказа #ABCD1234 и отправил деньги продавцу Seller.",
+        "Часть средств по заказу #ABCD1234 возвращена покупателю.",
+        "Заказ #ABCD1234 открыт повторно.",
+        "Вы можете перейти в Discord. Внимание: общение за пределами сервера FunPay считается нарушением правил.",
+        "Здравствуйте! Мой тег @durov",
+        "+",
+        "Спасибо, всё пришло, заказ #ABCD1234 подтвердил",
+    ],
+    "en": [
+        "The buyer buyer01 has paid for order #ABCD1234. buyer01, do not forget to press the «Confirm order fulfilment» button once you finish.",
+        "The buyer buyer01 has confirmed that order #ABCD1234 has been fulfilled successfully and that the seller Seller has been paid.",
+        "The buyer buyer01 has given feedback to the order #ABCD1234.",
+        "The buyer buyer01 has edited their feedback to the order #ABCD1234.",
+        "The buyer buyer01 has deleted their feedback to the order #ABCD1234.",
+        "The seller Seller has replied to their feedback to the order #ABCD1234.",
+        "The seller Seller has edited a reply to their feedback to the order #ABCD1234.",
+        "The seller Seller has deleted a reply to their feedback to the order #ABCD1234.",
+        "The seller Seller has refunded the buyer buyer01 on order #ABCD1234.",
+        "The administrator Admin has refunded the buyer buyer01 on order #ABCD1234.",
+        "A part of the funds pertaining to the order #ABCD1234 has been refunded.",
+        "Order #ABCD1234 has been reopened.",
+        "You can switch to Discord. However, note that friending someone is considered a violation rules.",
+        "Hi, my username is @durov",
+        "thanks!",
+    ],
+    "uk": [
+        "Покупець buyer01 сплатив замовлення #ABCD1234. buyer01, не забудьте потім натиснути кнопку «Підтвердити виконання замовлення».",
+        "Покупець buyer01 підтвердив успішне виконання замовлення #ABCD1234 і відправив гроші продавцю Seller.",
+        "Покупець buyer01 написав відгук до замовлення #ABCD1234.",
+        "Продавець Seller повернув гроші покупцю buyer01 за замовленням #ABCD1234.",
+        "Замовлення #ABCD1234 відкрито повторно.",
+        "Доброго дня! Мій тег @durov",
+        "Дякую, зірки отримав",
+    ],
+}
+
+
+def legacy_get_message_type(text: str | None) -> MessageTypes:
+    """Прежняя реализация Message.get_message_type: __init__ синглтона заново компилирует выражения при каждом вызове."""
+    if not text:
+        return MessageTypes.NON_SYSTEM
+
+    res = RegularExpressions()
+    res._RegularExpressions__compile()
+    if res.DISCORD.search(text):
+        return MessageTypes.DISCORD
+    if res.DEAR_VENDORS.search(text):
+        return MessageTypes.DEAR_VENDORS
+
+    if res.ORDER_PURCHASED.findall(text) and res.ORDER_PURCHASED2.findall(text):
+        return MessageTypes.ORDER_PURCHASED
+
+    if res.ORDER_ID.search(text) is None:
+        return MessageTypes.NON_SYSTEM
+
+    for i in RegularExpressions.SYSTEM_MESSAGE_TYPES:
+        if getattr(res, i.name).search(text):
+            return i
+    return MessageTypes.NON_SYSTEM
+
+
+def current_get_message_type(text: str | None) -> MessageTypes:
+    return RegularExpressions().get_message_type(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="кол-во сообщений на замер для каждого языка")
+    args = parser.parse_args()
+
+    for lang, texts in CORPUS.items():
+        mismatches = [t for t in texts if legacy_get_message_type(t) != current_get_message_type(t)]
+        if mismatches:
+            raise SystemExit(f"[{lang}] результаты реализаций расходятся: {mismatches}")
+
+    print(f"{'язык':<6}{'было, сообщ./с':>18}{'стало, сообщ./с':>18}{'ускорение':>12}")
+    for lang, texts in CORPUS.items():
+        stream = (texts * (args.number // len(texts) + 1))[:args.number]
+        rates = []
+        for func in (legacy_get_message_type, current_get_message_type):
+            seconds = min(timeit.repeat(lambda: [func(t) for t in stream], number=1, repeat=3))
+            rates.append(args.number / seconds)
+        print(f"{lang:<6}{rates[0]:>18,.0f}{rates[1]:>18,.0f}{rates[1] / rates[0]:>11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Бенчмарк разбора истории чата (Account.__parse_messages), сообщений в секунду:
+
+* batched - текущий путь: весь HTML истории парсится одним документом;
+* fallback - в истории есть сообщение с некорректным HTML, поэтому каждое сообщение парсится отдельно;
+* legacy - Account.__parse_messages до 0ea6565 (из e185777, без изменений): два дерева BeautifulSoup на каждое
+  сообщение.
+
+Запуск из корня проекта::
+
+    python benchmarks/bench_parse_messages.py [--messages 50] [--histories 200]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import timeit
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+from FunPayAPI import account, types
+
+SELLER_ID, SELLER = 1000000, "SimSeller"
+BUYER_ID, BUYER = 2000001, "buyer01"
+CHAT_ID = 100000001
+
+
+def message_html(message_id: int, author: str, body: str) -> str:
+    return (f'<div class="chat-msg-item chat-msg-with-head" id="message-{message_id}">'
+            f'<div class="chat-message"><div class="media-user-name">{author}</div>'
+            f'<div class="chat-msg-body">{body}</div></div></div>')
+
+
+def make_history(size: int, malformed: bool = False) -> list[dict]:
+    """Синтетическая история: переписка покупателя и продавца, системные сообщения и изображения."""
+    buyer = f'<a href="https://funpay.com/users/{BUYER_ID}/" class="chat-msg-author-link">{BUYER}</a>'
+    seller = f'<a href="https://funpay.com/users/{SELLER_ID}/" class="chat-msg-author-link">{SELLER}</a>' \
+             f'<span class="chat-msg-author-label label label-default">автоответ</span>'
+    system = 'FunPay <span class="chat-msg-author-label label label-primary">оповещение</span>'
+    history = []
+    for n in range(size):
+        message_id = 1000 + n
+        kind = n % 5
+        if kind == 0:
+            order = f"ABC{n:05d}"[-8:].upper()
+            text = (f'Покупатель <a href="https://funpay.com/users/{BUYER_ID}/">{BUYER}</a> оплатил заказ '
+                    f'<a href="https://funpay.com/orders/{order}/">#{order}</a>. {BUYER}, не забудьте потом нажать '
+                    f'кнопку «Подтвердить выполнение заказа».')
+            history.append({"id": message_id, "author": 0, "html": message_html(
+                message_id, system, f'<div class="alert alert-with-icon alert-info" role="alert">{text}</div>')})
+        elif kind == 1:
+            history.append({"id": message_id, "author": SELLER_ID, "html": message_html(
+                message_id, seller, '<div class="chat-msg-text">Спасибо за покупку!<br>Пришлите ваш тег.</div>')})
+        elif kind == 4:
+            history.append({"id": message_id, "author": BUYER_ID, "html": message_html(
+                message_id, buyer, '<a class="chat-img-link" href="https://sfunpay.com/s/chat/img.jpg">'
+                                   '<img src="https://sfunpay.com/s/chat/img.jpg" alt="screenshot.png"></a>')})
+        else:
+            history.append({"id": message_id, "author": BUYER_ID, "html": message_html(
+                message_id, buyer, f'<div class="chat-msg-text">@user{n} +</div>')})
+    if malformed:
+        # незакрытый тег сдвигает границы сообщений в общем документе
+        history[size // 2]["html"] = history[size // 2]["html"].removesuffix("</div>")
+    return history
+
+
+class Account(account.Account):
+    """
+    Account с Account.__parse_messages из e185777 (родитель 0ea6565), скопированным без изменений:
+    git show e185777:Funpay-Telegram-Stars/FunPayAPI/account.py
+    Имя класса то же, что у исходного: self.__bot_character и т.п. в скопированном коде раскрываются в _Account__*.
+    """
+    def __parse_messages(self, json_messages: dict, chat_id: int | str,
+                         interlocutor_id: Optional[int] = None, interlocutor_username: Optional[str] = None,
+                         from_id: int = 0) -> list[types.Message]:
+        messages = []
+        ids = {self.id: self.username, 0: "FunPay"}
+        badges = {}
+        if interlocutor_id is not None:
+            ids[interlocutor_id] = interlocutor_username
+
+        for i in json_messages:
+            if i["id"] < from_id:
+                continue
+            author_id = i["author"]
+            parser = BeautifulSoup(i["html"].replace("<br>", "\n"), "lxml")
+
+            # Если ник или бейдж написавшего неизвестен, но есть блок с данными об авторе сообщения
+            if None in [ids.get(author_id), badges.get(author_id)] and (
+                    author_div := parser.find("div", {"class": "media-user-name"})):
+                if badges.get(author_id) is None:
+                    badge = author_div.find("span", {"class": "chat-msg-author-label label label-success"})
+                    badges[author_id] = badge.text if badge else 0
+                if ids.get(author_id) is None:
+                    author = author_div.find("a").text.strip()
+                    ids[author_id] = author
+                    if self.chat_id_private(chat_id) and author_id == interlocutor_id and not interlocutor_username:
+                        interlocutor_username = author
+                        ids[interlocutor_id] = interlocutor_username
+            by_bot = False
+            by_vertex = False
+            image_name = None
+            if self.chat_id_private(chat_id) and (image_tag := parser.find("a", {"class": "chat-img-link"})):
+                image_name = image_tag.find("img")
+                image_name = image_name.get('alt') if image_name else None
+                image_link = image_tag.get("href")
+                message_text = None
+                # "Отправлено_с_помощью_бота_FunPay_Cardinal.png", "funpay_cardinal_image.png"
+                if isinstance(image_name, str) and "funpay_cardinal" in image_name.lower():
+                    by_bot = True
+                elif image_name == "funpay_vertex_image.png":
+                    by_vertex = True
+
+            else:
+                image_link = None
+                if author_id == 0:
+                    message_text = parser.find("div", role="alert").text.strip()
+                else:
+                    message_text = parser.find("div", {"class": "chat-msg-text"}).text
+
+                if message_text.startswith(self.__bot_character) or \
+                        message_text.startswith(self.__old_bot_character) and author_id == self.id:
+                    message_text = message_text[1:]
+                    by_bot = True
+                # todo придумать, как отсеять юзеров со старыми версиями кардинала (подождать обнову фп?)
+                # elif message_text.startswith(self.__old_bot_character):
+                #     by_vertex = True
+
+            message_obj = types.Message(i["id"], message_text, chat_id, interlocutor_username, interlocutor_id,
+                                        None, author_id, i["html"], image_link, image_name, determine_msg_type=False)
+            message_obj.by_bot = by_bot
+            message_obj.by_vertex = by_vertex
+            message_obj.type = types.MessageTypes.NON_SYSTEM if author_id != 0 else message_obj.get_message_type()
+
+            messages.append(message_obj)
+
+        for i in messages:
+            i.author = ids.get(i.author_id)
+            i.chat_name = interlocutor_username
+            i.badge = badges.get(i.author_id) if badges.get(i.author_id) != 0 else None
+            parser = BeautifulSoup(i.html, "lxml")
+            if i.badge:
+                i.is_employee = True
+                if i.badge in ("поддержка", "підтримка", "support"):
+                    i.is_support = True
+                elif i.badge in ("модерация", "модерація", "moderation"):
+                    i.is_moderation = True
+                elif i.badge in ("арбитраж", "арбітраж", "arbitration"):
+                    i.is_arbitration = True
+            default_label = parser.find("div", {"class": "media-user-name"})
+            default_label = default_label.find("span", {
+                "class": "chat-msg-author-label label label-default"}) if default_label else None
+            if default_label:
+                if default_label.text in ("автовідповідь", "автоответ", "auto-reply"):
+                    i.is_autoreply = True
+            i.badge = default_label.text if (i.badge is None and default_label is not None) else i.badge
+            if i.type != types.MessageTypes.NON_SYSTEM:
+                users = parser.find_all('a', href=lambda href: href and '/users/' in href)
+                if users:
+                    i.initiator_username = users[0].text
+                    i.initiator_id = int(users[0]["href"].split("/")[-2])
+                    if i.type in (types.MessageTypes.ORDER_PURCHASED, types.MessageTypes.ORDER_CONFIRMED,
+                                  types.MessageTypes.NEW_FEEDBACK,
+                                  types.MessageTypes.FEEDBACK_CHANGED,
+                                  types.MessageTypes.FEEDBACK_DELETED):
+                        if i.initiator_id == self.id:
+                            i.i_am_seller = False
+                            i.i_am_buyer = True
+                        else:
+                            i.i_am_seller = True
+                            i.i_am_buyer = False
+                    elif i.type in (types.MessageTypes.NEW_FEEDBACK_ANSWER, types.MessageTypes.FEEDBACK_ANSWER_CHANGED,
+                                    types.MessageTypes.FEEDBACK_ANSWER_DELETED, types.MessageTypes.REFUND):
+                        if i.initiator_id == self.id:
+                            i.i_am_seller = True
+                            i.i_am_buyer = False
+                        else:
+                            i.i_am_seller = False
+                            i.i_am_buyer = True
+                    elif len(users) > 1:
+                        last_user_id = int(users[-1]["href"].split("/")[-2])
+                        if i.type == types.MessageTypes.ORDER_CONFIRMED_BY_ADMIN:
+                            if last_user_id == self.id:
+                                i.i_am_seller = True
+                                i.i_am_buyer = False
+                            else:
+                                i.i_am_seller = False
+                                i.i_am_buyer = True
+                        elif i.type == types.MessageTypes.REFUND_BY_ADMIN:
+                            if last_user_id == self.id:
+                                i.i_am_seller = False
+                                i.i_am_buyer = True
+                            else:
+                                i.i_am_seller = True
+                                i.i_am_buyer = False
+
+        return messages
+
+
+LegacyAccount = Account
+
+
+def snapshot(messages) -> list[dict]:
+    return [{k: v for k, v in vars(m).items() if k != "html"} for m in messages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50, help="сообщений в одной истории")
+    parser.add_argument("--histories", type=int, default=200, help="историй на один замер")
+    args = parser.parse_args()
+
+    accounts = {}
+    for name, cls in (("current", account.Account), ("legacy", LegacyAccount)):
+        instance = cls("benchmark")
+        instance.id, instance.username = SELLER_ID, SELLER
+        accounts[name] = instance._Account__parse_messages
+
+    def run(history, parser="current"):
+        return accounts[parser](history, CHAT_ID, BUYER_ID, BUYER)
+
+    history, malformed = make_history(args.messages), make_history(args.messages, malformed=True)
+    cases = {"batched": (history, "current"), "fallback": (malformed, "current"), "legacy": (history, "legacy")}
+
+    reference = snapshot(run(history))
+    if snapshot(run(malformed)) != reference:
+        raise SystemExit("fallback-путь вернул другие поля сообщений")
+    if snapshot(run(history, "legacy")) != reference:
+        raise SystemExit("legacy-путь вернул другие поля сообщений")
+
+    print(f"{'путь':<10}{'сообщ./с':>12}{'мс/история':>14}")
+    for name, (case, parser) in cases.items():
+        seconds = min(timeit.repeat(lambda: [run(case, parser) for _ in range(args.histories)], number=1, repeat=3))
+        print(f"{name:<10}{args.messages * args.histories / seconds:>12,.0f}{seconds / args.histories * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
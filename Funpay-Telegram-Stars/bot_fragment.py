@@ -3,21 +3,40 @@ import logging
 import time
 import json
 import re
+import sqlite3
+import threading
+import atexit
+import queue
+from collections import OrderedDict, deque
 import requests
 from typing import Optional, Tuple
 
 from dotenv import load_dotenv
-from FunPayAPI import Account
+from FunPayAPI import Account, Dispatcher
+from FunPayAPI.common.exceptions import MessageNotDeliveredError, CircuitOpenError
+from FunPayAPI.common.circuit_breaker import CircuitBreaker
+from FunPayAPI.common.cassette import Cassette, ReplaySession
+from FunPayAPI.common.simulator import simulator_session
+from FunPayAPI.common.enums import OrderStatuses, EventTypes
 from FunPayAPI.updater.runner import Runner
-from FunPayAPI.updater.events import NewOrderEvent, NewMessageEvent
+from FunPayAPI.updater.events import NewOrderEvent, NewMessageEvent, OrderStatusChangedEvent
 
 # ============ ENV ============
 load_dotenv()
 
 COOLDOWN_SECONDS = float(os.getenv("COOLDOWN_SECONDS", "1"))
-TOKEN_FILE = "auth_token.json"
-FRAGMENT_API_URL = "https://api.fragment-api.com/v1"
-waiting_for_nick: dict[int, dict] = {}
+
+# Нагрузочный тест на локальном симуляторе FunPay и Fragment (python -m FunPayAPI.common.simulator):
+# FUNPAY_SIMULATOR=http://127.0.0.1:8080 — все запросы бота уходят на симулятор, golden_key не нужен.
+# Состояние заказов, раннера и токен Fragment по умолчанию пишутся в отдельные файлы sim_*,
+# чтобы прогон на симуляторе не смешивался с данными боевого бота.
+FUNPAY_SIMULATOR = (os.getenv("FUNPAY_SIMULATOR") or "").strip().rstrip("/") or None
+_STATE_PREFIX = "sim_" if FUNPAY_SIMULATOR else ""
+
+TOKEN_FILE = os.getenv("TOKEN_FILE", f"{_STATE_PREFIX}auth_token.json")
+STATE_DB_FILE = os.getenv("STATE_DB_FILE", f"{_STATE_PREFIX}orders_state.db")
+RUNNER_STATE_FILE = os.getenv("RUNNER_STATE_FILE", f"{_STATE_PREFIX}runner_state.json")
+FRAGMENT_API_URL = f"{FUNPAY_SIMULATOR}/fragment/v1" if FUNPAY_SIMULATOR else "https://api.fragment-api.com/v1"
 
 FRAGMENT_TOKEN: Optional[str] = None
 FRAGMENT_API_KEY = os.getenv("FRAGMENT_API_KEY")
@@ -27,6 +46,70 @@ FRAGMENT_VERSION = (os.getenv("FRAGMENT_VERSION") or "V4R2").strip().upper()
 
 DEACTIVATE_CATEGORY_ID = 2418
 
+try:
+    FRAGMENT_STAR_PRICE = float(os.getenv("FRAGMENT_STAR_PRICE", "0.005"))
+    BALANCE_POLL_INTERVAL = float(os.getenv("BALANCE_POLL_INTERVAL", "60"))
+except Exception:
+    FRAGMENT_STAR_PRICE, BALANCE_POLL_INTERVAL = 0.005, 60.0
+try:
+    # частый опрос (POLL_MIN_DELAY) — только пока есть события или незавершённая работа, иначе интервал растёт
+    # до POLL_MAX_DELAY
+    POLL_MIN_DELAY = float(os.getenv("POLL_MIN_DELAY", "3"))
+    POLL_MAX_DELAY = float(os.getenv("POLL_MAX_DELAY", "15"))
+except Exception:
+    POLL_MIN_DELAY, POLL_MAX_DELAY = 3.0, 15.0
+try:
+    # через сколько секунд без ответа покупателя диалог (awaiting_nick / awaiting_confirmation) снимается, а резерв
+    # баланса освобождается
+    AWAITING_DIALOG_TTL = float(os.getenv("AWAITING_DIALOG_TTL", "86400"))
+except Exception:
+    AWAITING_DIALOG_TTL = 86400.0
+try:
+    USERNAME_CACHE_TTL = float(os.getenv("USERNAME_CACHE_TTL", "3600"))
+    USERNAME_CACHE_NEGATIVE_TTL = float(os.getenv("USERNAME_CACHE_NEGATIVE_TTL", "60"))
+except Exception:
+    USERNAME_CACHE_TTL, USERNAME_CACHE_NEGATIVE_TTL = 3600.0, 60.0
+try:
+    ORDER_CACHE_TTL = float(os.getenv("ORDER_CACHE_TTL", "300"))
+except Exception:
+    ORDER_CACHE_TTL = 300.0
+try:
+    FRAGMENT_CB_FAILURES = max(1, int(os.getenv("FRAGMENT_CB_FAILURES", "5")))
+    FRAGMENT_CB_RESET = float(os.getenv("FRAGMENT_CB_RESET", "60"))
+    FRAGMENT_CB_SLOW = float(os.getenv("FRAGMENT_CB_SLOW", "45"))
+except Exception:
+    FRAGMENT_CB_FAILURES, FRAGMENT_CB_RESET, FRAGMENT_CB_SLOW = 5, 60.0, 45.0
+try:
+    HANDLER_WORKERS = max(1, int(os.getenv("HANDLER_WORKERS", "4")))
+except Exception:
+    HANDLER_WORKERS = 4
+try:
+    DELIVERY_WORKERS = max(1, int(os.getenv("DELIVERY_WORKERS", "2")))
+except Exception:
+    DELIVERY_WORKERS = 2
+try:
+    DELIVERY_QUEUE_SIZE = max(1, int(os.getenv("DELIVERY_QUEUE_SIZE", "50")))
+except Exception:
+    DELIVERY_QUEUE_SIZE = 50
+
+# Запись / воспроизведение HTTP-ответов FunPay и Fragment (для профилирования без сети):
+# HTTP_CASSETTE=путь до файла, HTTP_CASSETTE_MODE=record|replay, HTTP_CASSETTE_SPEED=множитель задержек (0 — без них).
+# При записи кассета сохраняется каждые HTTP_CASSETTE_FLUSH_EVERY ответов и ограничена HTTP_CASSETTE_MAX записями.
+HTTP_CASSETTE = os.getenv("HTTP_CASSETTE")
+HTTP_CASSETTE_MODE = (os.getenv("HTTP_CASSETTE_MODE") or "replay").strip().lower()
+try:
+    HTTP_CASSETTE_SPEED = float(os.getenv("HTTP_CASSETTE_SPEED", "1"))
+except Exception:
+    HTTP_CASSETTE_SPEED = 1.0
+try:
+    HTTP_CASSETTE_FLUSH_EVERY = int(os.getenv("HTTP_CASSETTE_FLUSH_EVERY", "200"))
+except Exception:
+    HTTP_CASSETTE_FLUSH_EVERY = 200
+try:
+    HTTP_CASSETTE_MAX = int(os.getenv("HTTP_CASSETTE_MAX", "20000"))
+except Exception:
+    HTTP_CASSETTE_MAX = 20000
+
 def _env_bool_raw(name: str):
     return os.getenv(name)
 
@@ -93,6 +176,443 @@ def _excepthook(exc_type, exc, tb):
 import sys
 sys.excepthook = _excepthook
 
+# ============ ORDER STATE ============
+class OrderStateStore:
+    """
+    Состояния диалогов с покупателями (awaiting_nick / awaiting_confirmation / delivering / deferred /
+    manual_check), переживающие перезапуск бота.
+    Все чтения идут из памяти (индексы по buyer_id и chat_id), запись в SQLite (WAL) выполняется пачками
+    фоновым потоком раз в flush_interval секунд.
+
+    Индекс по buyer_id указывает на текущий диалог покупателя. Заказы в состояниях BACKGROUND_STATES
+    (оплачены и уже выдаются) при новом заказе того же покупателя не удаляются: они остаются в индексе
+    по order_id (get_order / update_order / pop_order, orders()) до завершения выдачи.
+    """
+    FIELDS = ("order_id", "buyer_id", "chat_id", "stars", "state", "temp_nick", "created_at", "updated_at")
+    BACKGROUND_STATES = ("delivering", "deferred", "manual_check")
+
+    def __init__(self, path: str, flush_interval: float = 0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._orders: dict[str, dict] = {}
+        self._by_buyer: dict[int, dict] = {}
+        self._by_chat: dict = {}
+        self._pending: dict[str, Optional[dict]] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            "order_id TEXT PRIMARY KEY, buyer_id INTEGER NOT NULL, chat_id TEXT, stars INTEGER, "
+            "state TEXT NOT NULL, temp_nick TEXT, created_at REAL, updated_at REAL)"
+        )
+        for row in self._conn.execute(f"SELECT {', '.join(self.FIELDS)} FROM orders ORDER BY created_at"):
+            item = dict(zip(self.FIELDS, row))
+            item["chat_id"] = self._decode_chat_id(item["chat_id"])
+            self._index(item)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="OrderStateFlusher", daemon=True)
+        self._flusher.start()
+
+    @staticmethod
+    def _decode_chat_id(chat_id):
+        return int(chat_id) if isinstance(chat_id, str) and chat_id.isdigit() else chat_id
+
+    def _index(self, item: dict):
+        previous = self._by_buyer.get(item["buyer_id"])
+        if previous is not None:
+            self._by_chat.pop(previous["chat_id"], None)
+            if str(previous["order_id"]) != str(item["order_id"]) and previous["state"] not in self.BACKGROUND_STATES:
+                self._orders.pop(str(previous["order_id"]), None)
+                self._pending[previous["order_id"]] = None
+        self._orders[str(item["order_id"])] = item
+        self._by_buyer[item["buyer_id"]] = item
+        self._by_chat[item["chat_id"]] = item
+
+    def _unindex(self, item: dict):
+        self._orders.pop(str(item["order_id"]), None)
+        if self._by_buyer.get(item["buyer_id"]) is item:
+            del self._by_buyer[item["buyer_id"]]
+            self._by_chat.pop(item["chat_id"], None)
+        self._pending[item["order_id"]] = None
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, buyer_id) -> bool:
+        return buyer_id in self._by_buyer
+
+    def __getitem__(self, buyer_id) -> dict:
+        return self._by_buyer[buyer_id]
+
+    def get(self, buyer_id, default=None) -> Optional[dict]:
+        return self._by_buyer.get(buyer_id, default)
+
+    def items(self) -> list[tuple[int, dict]]:
+        """Текущие диалоги: (buyer_id, состояние)."""
+        return list(self._by_buyer.items())
+
+    def orders(self) -> list[dict]:
+        """Все сохранённые заказы, включая выдаваемые заказы покупателей, у которых уже начат новый диалог."""
+        return list(self._orders.values())
+
+    def get_by_chat(self, chat_id) -> Optional[dict]:
+        return self._by_chat.get(chat_id)
+
+    def get_order(self, order_id) -> Optional[dict]:
+        return self._orders.get(str(order_id))
+
+    def __setitem__(self, buyer_id, state: dict):
+        now = time.time()
+        item = {k: state.get(k) for k in self.FIELDS}
+        item["buyer_id"] = buyer_id
+        item["created_at"] = item["created_at"] or now
+        item["updated_at"] = now
+        with self._lock:
+            self._index(item)
+            self._pending[item["order_id"]] = item
+
+    def update(self, buyer_id, **fields) -> Optional[dict]:
+        with self._lock:
+            item = self._by_buyer.get(buyer_id)
+            if item is None:
+                return None
+            item.update(fields)
+            item["updated_at"] = time.time()
+            self._pending[item["order_id"]] = item
+            return item
+
+    def update_order(self, order_id, **fields) -> Optional[dict]:
+        with self._lock:
+            item = self._orders.get(str(order_id))
+            if item is None:
+                return None
+            item.update(fields)
+            item["updated_at"] = time.time()
+            self._pending[item["order_id"]] = item
+            return item
+
+    def pop(self, buyer_id, default=None) -> Optional[dict]:
+        with self._lock:
+            item = self._by_buyer.get(buyer_id)
+            if item is None:
+                return default
+            self._unindex(item)
+            return item
+
+    def pop_order(self, order_id, default=None) -> Optional[dict]:
+        with self._lock:
+            item = self._orders.get(str(order_id))
+            if item is None:
+                return default
+            self._unindex(item)
+            return item
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            upserts = [tuple(str(item[k]) if k == "chat_id" and item[k] is not None else item.get(k)
+                             for k in self.FIELDS)
+                       for item in pending.values() if item is not None]
+            deletes = [(order_id,) for order_id, item in pending.items() if item is None]
+        try:
+            self._conn.execute("BEGIN")
+            if deletes:
+                self._conn.executemany("DELETE FROM orders WHERE order_id = ?", deletes)
+            if upserts:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO orders ({', '.join(self.FIELDS)}) "
+                    f"VALUES ({', '.join('?' * len(self.FIELDS))})", upserts)
+            self._conn.execute("COMMIT")
+        except Exception as e:
+            self._conn.execute("ROLLBACK")
+            logger.error(Fore.RED + f"[STATE] Не удалось сохранить состояния заказов: {e}")
+            with self._lock:
+                for order_id, item in pending.items():
+                    self._pending.setdefault(order_id, item)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join(timeout=self.flush_interval * 2)
+        self.flush()
+        self._conn.close()
+
+waiting_for_nick: Optional[OrderStateStore] = None
+
+# ============ OUTBOX ============
+class MessageScheduler:
+    """
+    Очередь исходящих сообщений FunPay. Входящие события больше не пропускаются из-за кулдауна: ответы ставятся
+    в очередь и отправляются одним потоком с соблюдением интервалов:
+
+    - между сообщениями — не чаще COOLDOWN_SECONDS;
+    - в один чат — после ошибки "слишком часто" (account.last_flood_err_time) чат ставится на паузу;
+    - разным пользователям — после ошибки "разным пользователям" (account.last_multiuser_flood_err_time)
+      отправка в другие чаты приостанавливается.
+
+    Порядок сообщений внутри чата сохраняется, чаты обслуживаются по кругу.
+    При MessageNotDeliveredError и ошибках сети сообщение отправляется повторно с растущей задержкой.
+    """
+    def __init__(self, account: Account, interval: float = COOLDOWN_SECONDS, flood_pause: float = 5.0,
+                 multiuser_flood_pause: float = 10.0, max_attempts: int = 5):
+        self.account = account
+        self.interval = interval
+        self.flood_pause = flood_pause
+        self.multiuser_flood_pause = multiuser_flood_pause
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.failed = 0
+        self._chats: "OrderedDict[object, deque]" = OrderedDict()
+        self._not_before: dict = {}
+        self._last_chat = None
+        self._last_send = 0.0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name="MessageScheduler", daemon=True)
+        self._thread.start()
+
+    def send(self, chat_id, text: str):
+        """Ставит сообщение в очередь чата и сразу возвращает управление."""
+        with self._cond:
+            self._chats.setdefault(chat_id, deque()).append([text, 0])
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._chats.values())
+
+    def join(self, timeout: float = 30.0) -> bool:
+        """Ждёт отправки всех сообщений из очереди (не дольше timeout секунд)."""
+        deadline = time.time() + timeout
+        while self.pending() and time.time() < deadline:
+            time.sleep(0.1)
+        return not self.pending()
+
+    def _next(self, now: float):
+        """Возвращает (chat_id, через сколько секунд можно отправить) для ближайшего готового чата."""
+        multiuser_until = self.account.last_multiuser_flood_err_time + self.multiuser_flood_pause
+        best, best_wait = None, None
+        for chat_id in self._chats:
+            wait = self._not_before.get(chat_id, 0) - now
+            if chat_id != self._last_chat:
+                wait = max(wait, multiuser_until - now)
+            if best_wait is None or wait < best_wait:
+                best, best_wait = chat_id, wait
+                if wait <= 0:
+                    break
+        return best, max(best_wait or 0, self._last_send + self.interval - now)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._chats:
+                    self._cond.wait()
+                chat_id, wait = self._next(time.time())
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                item = self._chats[chat_id][0]
+                # Чат уходит в конец очереди — остальные чаты обслуживаются по кругу.
+                self._chats.move_to_end(chat_id)
+            text, attempts = item
+            try:
+                self.account.send_message(chat_id, text)
+                ok = True
+            except CircuitOpenError as e:
+                # Запрос не отправлялся — попытка не засчитывается, ждём, пока предохранитель пропустит пробный запрос.
+                logger.warning(Fore.YELLOW + f"[OUTBOX] Отправка в чат {chat_id} отложена: {e}")
+                with self._cond:
+                    self._not_before[chat_id] = time.time() + max(e.retry_after, self.interval)
+                continue
+            except Exception as e:
+                ok = False
+                item[1] = attempts = attempts + 1
+                if isinstance(e, MessageNotDeliveredError) and \
+                        self.account.last_flood_err_time >= time.time() - 1:
+                    pause = self.flood_pause * attempts
+                elif isinstance(e, MessageNotDeliveredError) and \
+                        self.account.last_multiuser_flood_err_time >= time.time() - 1:
+                    pause = 0
+                else:
+                    pause = min(2 ** attempts, 60)
+                logger.warning(Fore.YELLOW + f"[OUTBOX] Сообщение в чат {chat_id} не доставлено "
+                                             f"(попытка {attempts}/{self.max_attempts}): {e}")
+                self._not_before[chat_id] = time.time() + pause
+            with self._cond:
+                self._last_send = time.time()
+                queue_ = self._chats[chat_id]
+                if ok or item[1] >= self.max_attempts:
+                    queue_.popleft()
+                    if ok:
+                        self.sent += 1
+                        self._last_chat = chat_id
+                    else:
+                        self.failed += 1
+                        logger.error(Fore.RED + f"[OUTBOX] Сообщение в чат {chat_id} отброшено после "
+                                                f"{self.max_attempts} попыток: {text!r}")
+                if not queue_:
+                    del self._chats[chat_id]
+                    self._not_before.pop(chat_id, None)
+
+outbox: Optional[MessageScheduler] = None
+
+# ============ USERNAME CACHE ============
+class UsernameCache:
+    """
+    LRU-кэш результатов проверки Telegram-ников во Fragment с отдельным временем жизни для найденных
+    (positive_ttl) и ненайденных (negative_ttl) ников. Кэшируются только однозначные ответы Fragment.
+    """
+    def __init__(self, maxsize: int = 4096, positive_ttl: float = USERNAME_CACHE_TTL,
+                 negative_ttl: float = USERNAME_CACHE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple[bool, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(username: str) -> str:
+        return username.strip().lstrip("@").strip().lower()
+
+    def get(self, username: str) -> Optional[bool]:
+        """Возвращает закэшированный результат проверки или None, если его нет / он устарел."""
+        key = self.key(username)
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, username: str, exists: bool):
+        ttl = self.positive_ttl if exists else self.negative_ttl
+        if ttl <= 0:
+            return
+        key = self.key(username)
+        with self._lock:
+            self._data[key] = (exists, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0}
+
+username_cache = UsernameCache()
+
+# ============ ORDER CACHE ============
+class OrderCache:
+    """
+    TTL-кэш полных заказов (Account.get_order) с объединением одновременных запросов: если заказ уже загружается
+    в другом потоке, вызывающий ждёт тот же результат вместо повторной загрузки страницы orders/{id}/.
+    Запись сбрасывается, когда приходит OrderStatusChangedEvent с другим статусом.
+    """
+    def __init__(self, ttl: float = ORDER_CACHE_TTL, maxsize: int = 512):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._data: "OrderedDict[str, tuple[object, float]]" = OrderedDict()
+        self._inflight: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, account: Account, order_id: str):
+        with self._lock:
+            item = self._data.get(order_id)
+            if item is not None and item[1] > time.time():
+                self._data.move_to_end(order_id)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._data[order_id]
+            flight = self._inflight.get(order_id)
+            if flight is None:
+                flight = self._inflight[order_id] = {"done": threading.Event(), "order": None, "error": None}
+                leader = True
+                self.misses += 1
+            else:
+                leader = False
+                self.shared += 1
+
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["order"]
+
+        try:
+            flight["order"] = account.get_order(order_id)
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(order_id, None)
+                if flight["error"] is None and self.ttl > 0 and not flight.get("invalidated"):
+                    self._data[order_id] = (flight["order"], time.time() + self.ttl)
+                    self._data.move_to_end(order_id)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+            flight["done"].set()
+        return flight["order"]
+
+    def invalidate(self, order_id: str, status: Optional[OrderStatuses] = None):
+        """Сбрасывает заказ из кэша (если передан status — только если закэширован другой статус)."""
+        with self._lock:
+            item = self._data.get(order_id)
+            if item is not None and (status is None or getattr(item[0], "status", None) != status):
+                del self._data[order_id]
+            if order_id in self._inflight:
+                # загрузка началась до смены статуса — её результат не кэшируем
+                self._inflight[order_id]["invalidated"] = True
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses + self.shared
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "shared": self.shared,
+                "hit_ratio": (self.hits + self.shared) / total if total else 0.0}
+
+order_cache = OrderCache()
+
+# ============ FRAGMENT CIRCUIT BREAKER ============
+# После FRAGMENT_CB_FAILURES ошибок / ответов дольше FRAGMENT_CB_SLOW сек. подряд запросы к Fragment сразу
+# завершаются CircuitOpenError: выдачи откладываются (без возврата), а через FRAGMENT_CB_RESET сек. пробный запрос
+# (например, проверка баланса) решает, можно ли продолжать.
+fragment_breaker = CircuitBreaker("Fragment", failure_threshold=FRAGMENT_CB_FAILURES,
+                                  reset_timeout=FRAGMENT_CB_RESET, slow_call_threshold=FRAGMENT_CB_SLOW)
+
+# ============ HTTP CASSETTE ============
+def _make_cassette_session():
+    if not HTTP_CASSETTE:
+        return None
+    if HTTP_CASSETTE_MODE == "record":
+        cassette = Cassette(HTTP_CASSETTE, load=False)
+        atexit.register(cassette.save)
+        logger.warning(Fore.YELLOW + f"[CASSETTE] Запись HTTP-ответов в {HTTP_CASSETTE} (файл содержит данные аккаунтов!), "
+                                     f"сохранение каждые {HTTP_CASSETTE_FLUSH_EVERY} ответов, максимум {HTTP_CASSETTE_MAX}")
+        return cassette.recorder(flush_every=HTTP_CASSETTE_FLUSH_EVERY, max_interactions=HTTP_CASSETTE_MAX or None)
+    logger.warning(Fore.YELLOW + f"[CASSETTE] Воспроизведение HTTP-ответов из {HTTP_CASSETTE} "
+                                 f"(скорость {HTTP_CASSETTE_SPEED}), запросы в сеть не отправляются")
+    return Cassette(HTTP_CASSETTE).player(HTTP_CASSETTE_SPEED)
+
+# Одна сессия кассеты на FunPay и Fragment: ответы сопоставляются по методу, ссылке и хэшу тела запроса.
+cassette_session = _make_cassette_session()
+fragment_http = cassette_session or requests
+
 # ============ HELPERS ============
 def _token_file_path() -> str:
     return TOKEN_FILE
@@ -133,10 +653,12 @@ def authenticate_fragment() -> Optional[str]:
             "version": FRAGMENT_VERSION,
             "mnemonics": mnemonics_list
         }
-        res = requests.post(f"{FRAGMENT_API_URL}/auth/authenticate/", json=payload, timeout=60)
+        res = fragment_http.request("POST", f"{FRAGMENT_API_URL}/auth/authenticate/", json=payload, timeout=60)
         if res.status_code == 200:
             token = res.json().get("token")
-            save_fragment_token(token)
+            if not isinstance(fragment_http, ReplaySession):
+                # токен из кассеты недействителен и не должен затирать сохранённый боевой токен
+                save_fragment_token(token)
             logger.info(Fore.GREEN + f"✅ Успешная авторизация Fragment (version={FRAGMENT_VERSION}).")
             return token
         logger.error(Fore.RED + f"❌ Ошибка авторизации Fragment [{res.status_code}]: {res.text}")
@@ -156,27 +678,38 @@ def fragment_request(method: str, path: str, retry_on_auth: bool = True, **kwarg
         headers["Authorization"] = f"JWT {FRAGMENT_TOKEN}"
     timeout = kwargs.pop("timeout", 10)
 
+    fragment_breaker.before_call()
+    started = time.time()
     try:
-        r = requests.request(method, url, headers=headers, timeout=timeout, **kwargs)
+        r = fragment_http.request(method, url, headers=headers, timeout=timeout, **kwargs)
         if r.status_code in (401, 403) and retry_on_auth:
             logger.info(Fore.YELLOW + "🔑 Токен недействителен. Переавторизация…")
             FRAGMENT_TOKEN = authenticate_fragment()
             if FRAGMENT_TOKEN:
                 headers["Authorization"] = f"JWT {FRAGMENT_TOKEN}"
-                r = requests.request(method, url, headers=headers, timeout=timeout, **kwargs)
-        return r
+                r = fragment_http.request(method, url, headers=headers, timeout=timeout, **kwargs)
     except Exception as e:
+        fragment_breaker.record(False, time.time() - started)
         logger.error(Fore.RED + f"❌ Ошибка HTTP-запроса к Fragment {method} {path}: {e}")
         raise
+    fragment_breaker.record(r.status_code < 500, time.time() - started)
+    return r
 
 def check_username_exists(username: str) -> bool:
     uname = username.lstrip('@').strip()
+    cached = username_cache.get(uname)
+    if cached is not None:
+        return cached
     try:
         r = fragment_request("GET", f"/misc/user/{uname}/", timeout=8)
         ok = (r.status_code == 200 and isinstance(r.json(), dict) and "username" in r.json())
         if not ok:
             logger.info(f"[USERCHECK] {uname}: HTTP {r.status_code} | {r.text[:500]}")
+        if r.status_code in (200, 400, 404):
+            username_cache.put(uname, ok)
         return ok
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error(Fore.RED + f"❌ Ошибка при проверке ника @{uname}: {e}")
         return False
@@ -186,6 +719,8 @@ def direct_send_stars(username: str, quantity: int) -> Tuple[bool, str, int]:
     try:
         r = fragment_request("POST", "/order/stars/", json=data, timeout=60)
         return (r.status_code == 200, r.text, r.status_code)
+    except CircuitOpenError:
+        raise
     except Exception as e:
         return (False, str(e), 0)
 
@@ -251,12 +786,12 @@ def refund_order(account, order_id, chat_id, reason: str = ""):
         account.refund(order_id)
         logger.warning(Fore.YELLOW + f"↩️ Возврат оформлен для заказа {order_id}. Причина: {reason}")
         if chat_id:
-            account.send_message(chat_id, "✅ Средства успешно возвращены.")
+            outbox.send(chat_id, "✅ Средства успешно возвращены.")
         return True
     except Exception as e:
         logger.error(Fore.RED + f"❌ Не удалось вернуть средства за заказ {order_id}: {e}")
         if chat_id:
-            account.send_message(chat_id, "❌ Ошибка возврата. Свяжитесь с админом.")
+            outbox.send(chat_id, "❌ Ошибка возврата. Свяжитесь с админом.")
         return False
 
 def log_order_api_error(order_id, api_response_text, short_error, status_code: int = 0):
@@ -267,7 +802,7 @@ def get_subcategory_id_safe(order, account):
     if subcat and hasattr(subcat, "id"):
         return subcat.id, subcat
     try:
-        full_order = account.get_order(order.id)
+        full_order = order_cache.get(account, order.id)
         subcat = getattr(full_order, "subcategory", None) or getattr(full_order, "sub_category", None)
         if subcat and hasattr(subcat, "id"):
             return subcat.id, subcat
@@ -413,10 +948,330 @@ def deactivate_category(account: Account, category_id: int):
     logger.warning(Fore.YELLOW + f"[LOTS] Всего деактивировано: {deactivated}")
     return deactivated
 
+# ============ BALANCE LEDGER ============
+class BalanceLedger:
+    """
+    Кэшированный баланс Fragment и резервы под принятые, но ещё не выданные заказы.
+
+    Баланс обновляется фоновым потоком раз в BALANCE_POLL_INTERVAL секунд, поэтому reserve() не делает запросов:
+    заказ принимается, только если после резерва (баланс − все резервы − стоимость заказа) остаётся не меньше
+    FRAGMENT_MIN_BALANCE. Стоимость оценивается как stars * FRAGMENT_STAR_PRICE.
+    Когда свободный остаток опускается ниже порога, лоты подкатегории деактивируются (AUTO_DEACTIVATE).
+    """
+    def __init__(self, account: Account, poll_interval: float = BALANCE_POLL_INTERVAL,
+                 min_balance: float = FRAGMENT_MIN_BALANCE, star_price: float = FRAGMENT_STAR_PRICE):
+        self.account = account
+        self.poll_interval = poll_interval
+        self.min_balance = min_balance
+        self.star_price = star_price
+        self.balance: Optional[float] = None
+        self.updated_at: float = 0
+        self.reserved: dict[str, float] = {}
+        self.deactivated = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="BalancePoller", daemon=True)
+        self._thread.start()
+
+    def cost(self, stars: int) -> float:
+        return stars * self.star_price
+
+    def available(self) -> Optional[float]:
+        """Баланс за вычетом резервов (None, если баланс ещё не получен)."""
+        with self._lock:
+            if self.balance is None:
+                return None
+            return self.balance - sum(self.reserved.values())
+
+    def reserve(self, order_id, stars: int) -> bool:
+        """Резервирует стоимость заказа. False — средств не хватит, заказ нужно отклонить."""
+        cost = self.cost(stars)
+        with self._lock:
+            if str(order_id) in self.reserved:
+                return True
+            if self.balance is not None:
+                free = self.balance - sum(self.reserved.values()) - cost
+                if free < self.min_balance:
+                    logger.warning(Fore.YELLOW + f"[BALANCE] Заказ {order_id} ({stars} ⭐ ≈ {cost:.4f}) отклонён: "
+                                                 f"баланс {self.balance}, в резерве {sum(self.reserved.values()):.4f}, "
+                                                 f"порог {self.min_balance}")
+                    self._wakeup.set()
+                    return False
+            self.reserved[str(order_id)] = cost
+            if self.balance is not None and self.balance - sum(self.reserved.values()) < self.min_balance:
+                self._wakeup.set()
+        return True
+
+    def release(self, order_id, spent: bool = False):
+        """Снимает резерв. spent=True — звёзды выданы, стоимость списывается с кэшированного баланса до опроса."""
+        with self._lock:
+            cost = self.reserved.pop(str(order_id), None)
+            if spent and cost is not None and self.balance is not None:
+                self.balance -= cost
+
+    def poll_now(self):
+        self._wakeup.set()
+
+    def _loop(self):
+        while True:
+            balance = check_fragment_balance()
+            with self._lock:
+                if balance is not None:
+                    self.balance, self.updated_at = balance, time.time()
+                free = None if self.balance is None else self.balance - sum(self.reserved.values())
+            if balance is None:
+                logger.warning(Fore.YELLOW + "[BALANCE] Не удалось определить баланс Fragment (endpoint /misc/wallet/ вернул некорректный формат).")
+            else:
+                logger.debug(Fore.MAGENTA + f"[BALANCE] Баланс Fragment: {balance}, свободно: {free:.4f}")
+            if free is not None and free < self.min_balance:
+                if not self.deactivated:
+                    logger.warning(Fore.YELLOW + f"[BALANCE] Свободный баланс Fragment {free:.4f} < порога {self.min_balance}")
+                    if AUTO_DEACTIVATE:
+                        deactivated = deactivate_category(self.account, DEACTIVATE_CATEGORY_ID)
+                        logger.warning(Fore.MAGENTA + f"Авто-деактивировано {deactivated} лотов в подкатегории {DEACTIVATE_CATEGORY_ID}")
+                    else:
+                        logger.warning(Fore.MAGENTA + f"AUTO_DEACTIVATE отключён — требуется ручная деактивация лотов (подкатегория {DEACTIVATE_CATEGORY_ID}).")
+                    self.deactivated = True
+            elif free is not None:
+                self.deactivated = False
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+ledger: Optional[BalanceLedger] = None
+
+# ============ DELIVERY QUEUE ============
+class DeliveryJob:
+    """Выдача звёзд по одному заказу. status: queued → running → done / failed (или deferred, пока Fragment недоступен)."""
+    def __init__(self, order_id, buyer_id, chat_id, username: str, stars: int):
+        self.order_id = order_id
+        self.buyer_id = buyer_id
+        self.chat_id = chat_id
+        self.username = username
+        self.stars = stars
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.buyer_notified = False
+
+    def __repr__(self):
+        return f"<DeliveryJob {self.order_id} @{self.username} {self.stars}⭐ {self.status}>"
+
+
+class DeliveryQueue:
+    """
+    Ограниченная очередь выдач с пулом воркеров: запросы к Fragment, возвраты, проверка баланса и деактивация лотов
+    выполняются вне цикла runner.listen, поэтому опрос FunPay и ответы покупателям не ждут Fragment.
+    """
+    def __init__(self, account: Account, workers: int = DELIVERY_WORKERS, maxsize: int = DELIVERY_QUEUE_SIZE,
+                 history_size: int = 1000):
+        self.account = account
+        self.history_size = history_size
+        self.jobs: "OrderedDict[str, DeliveryJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[DeliveryJob]" = queue.Queue(maxsize=maxsize)
+        self._deferred: "deque[DeliveryJob]" = deque()
+        self._workers = [threading.Thread(target=self._worker, name=f"Delivery-{i}", daemon=True)
+                         for i in range(workers)]
+        self._workers.append(threading.Thread(target=self._resume_deferred, name="Delivery-resume", daemon=True))
+        for w in self._workers:
+            w.start()
+
+    def submit(self, order_id, buyer_id, chat_id, username: str, stars: int) -> Optional[DeliveryJob]:
+        """Ставит выдачу в очередь. Возвращает None, если очередь заполнена."""
+        job = DeliveryJob(order_id, buyer_id, chat_id, username, stars)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            return None
+        with self._lock:
+            self.jobs[str(order_id)] = job
+            while len(self.jobs) > self.history_size:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.status in ("queued", "running"):
+                    break
+                self.jobs.popitem(last=False)
+        return job
+
+    def defer(self, order_id, buyer_id, chat_id, username: str, stars: int) -> DeliveryJob:
+        """Откладывает выдачу до восстановления Fragment (например, отложенную до перезапуска бота)."""
+        job = DeliveryJob(order_id, buyer_id, chat_id, username, stars)
+        job.buyer_notified = True
+        with self._lock:
+            self.jobs[str(order_id)] = job
+        self._defer(job, None)
+        return job
+
+    def status(self, order_id) -> Optional[str]:
+        job = self.jobs.get(str(order_id))
+        return job.status if job else None
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            result = {"queued": 0, "running": 0, "done": 0, "failed": 0, "deferred": 0}
+            for job in self.jobs.values():
+                result[job.status] += 1
+        return result
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            job.status, job.started_at = "running", time.time()
+            try:
+                ok, job.error = process_delivery(self.account, job)
+                job.status = "done" if ok else "failed"
+            except CircuitOpenError as e:
+                self._defer(job, e)
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+                logger.exception(Fore.RED + f"❌ Ошибка выдачи по заказу {job.order_id}: {e}")
+                # резерв снимаем, баланс перечитываем: неизвестно, успели ли уйти звёзды
+                ledger.release(job.order_id)
+                ledger.poll_now()
+                waiting_for_nick.update_order(job.order_id, state="manual_check")
+                logger.warning(Fore.YELLOW + f"[STATE] Заказ {job.order_id} требует ручной проверки: "
+                                             f"https://funpay.com/orders/{job.order_id}/")
+            finally:
+                if job.status != "deferred":
+                    job.finished_at = time.time()
+                    state = waiting_for_nick.get_order(job.order_id)
+                    if state is not None and state["state"] == "delivering":
+                        waiting_for_nick.pop_order(job.order_id)
+                    logger.info(Fore.CYAN + f"[DELIVERY] {job} за {job.finished_at - job.started_at:.1f}с. "
+                                            f"Очередь: {self.stats()}, кэш ников: {username_cache.stats()}, "
+                                            f"Fragment: {fragment_breaker.state}")
+                self._queue.task_done()
+
+    def _defer(self, job: DeliveryJob, error: Optional[CircuitOpenError]):
+        # Fragment недоступен, звёзды не отправлялись: резерв баланса сохраняем, возврат не оформляем.
+        job.status, job.error = "deferred", str(error) if error else None
+        waiting_for_nick.update_order(job.order_id, state="deferred")
+        with self._lock:
+            self._deferred.append(job)
+        if not job.buyer_notified:
+            job.buyer_notified = True
+            outbox.send(job.chat_id, "⏳ Сервис Fragment временно недоступен. Ваш заказ в очереди — звёзды будут "
+                                     "отправлены автоматически, как только сервис восстановится.")
+        logger.warning(Fore.YELLOW + f"[DELIVERY] Fragment недоступен, выдача по заказу {job.order_id} отложена "
+                                     f"(отложено: {len(self._deferred)}, {fragment_breaker.stats()})")
+
+    def _resume_deferred(self):
+        while True:
+            time.sleep(5)
+            state = fragment_breaker.state
+            if state == "open":
+                continue
+            with self._lock:
+                # в half_open пробуем один заказ: если Fragment ещё не восстановился, остальные не ждут тайм-аут
+                count = len(self._deferred) if state == "closed" else min(len(self._deferred), 1)
+                jobs = [self._deferred.popleft() for _ in range(count)]
+            for job in jobs:
+                if waiting_for_nick.update_order(job.order_id, state="delivering") is None:
+                    # заказ закрыт или возвращён, пока выдача была отложена
+                    job.status, job.error, job.finished_at = "failed", "order closed", time.time()
+                    logger.info(Fore.CYAN + f"[DELIVERY] Заказ {job.order_id} закрыт, отложенная выдача отменена")
+                    continue
+                job.status = "queued"
+                logger.info(Fore.CYAN + f"[DELIVERY] Возобновляю выдачу по заказу {job.order_id}")
+                self._queue.put(job)
+
+
+def process_delivery(account: Account, job: DeliveryJob) -> Tuple[bool, Optional[str]]:
+    order_id, chat_id, username, stars = job.order_id, job.chat_id, job.username, job.stars
+    # Ник проверялся при вводе; если результат ещё в кэше, повторный запрос не нужен,
+    # иначе (например, после долгого ожидания подтверждения) проверяем заново перед списанием.
+    if not check_username_exists(username):
+        current = waiting_for_nick.get(job.buyer_id)
+        if current is not None and str(current["order_id"]) == str(order_id):
+            outbox.send(chat_id, f'❌ Ник "@{username}" не найден. Пожалуйста, введите правильный Telegram-тег.')
+            waiting_for_nick.update(job.buyer_id, state="awaiting_nick", temp_nick=None)
+        else:
+            # покупатель уже ведёт диалог по другому заказу — второй запрос ника в том же чате их перепутает
+            outbox.send(chat_id, f'❌ Ник "@{username}" для заказа #{order_id} не найден. Продавец свяжется с вами.')
+            waiting_for_nick.update_order(order_id, state="manual_check")
+            logger.warning(Fore.YELLOW + f"[STATE] Заказ {order_id}: ник @{username} не найден — проверьте заказ вручную.")
+        return False, "username not found"
+    if fragment_breaker.state == "open":
+        raise CircuitOpenError(fragment_breaker.name, fragment_breaker.retry_after())
+    outbox.send(chat_id, f"🚀 Отправляю {stars} ⭐ пользователю @{username}...")
+    success, response, status_code = direct_send_stars(username, stars)
+    ledger.release(order_id, spent=success)
+    if success:
+        outbox.send(chat_id, f"✅ Успешно отправлено {stars} ⭐ пользователю @{username}!")
+        logger.info(Fore.GREEN + f"✅ @{username} получил {stars} ⭐ (order {order_id})")
+
+        order_url = f"https://funpay.com/orders/{order_id}/"
+        outbox.send(
+            chat_id,
+            "🙏 Пожалуйста, подтвердите выполнение заказа и оставьте отзыв — это очень помогает!\n"
+            f"Ссылка на заказ: {order_url}"
+        )
+        return True, None
+
+    short_error = parse_fragment_error(response, status_code=status_code)
+    log_order_api_error(order_id, response, short_error, status_code=status_code)
+
+    if AUTO_REFUND:
+        outbox.send(chat_id, short_error + "\n🔁 Пытаюсь оформить возврат…")
+        refunded = refund_order(account, order_id, chat_id, reason=short_error)
+        if not refunded:
+            notify_text = f"Не удалось автоматически вернуть средства по заказу {order_id}. Причина: {short_error}"
+            logger.warning(Fore.MAGENTA + notify_text)
+    else:
+        outbox.send(chat_id, short_error + "\n⚠️ Автоматический возврат отключён. Свяжитесь с админом для возврата.")
+        logger.warning(Fore.MAGENTA + f"Авто-возврат отключён. Заказ {order_id} требует ручного возврата. Причина: {short_error}")
+
+    ledger.poll_now()
+    return False, short_error
+
+# ============ ORDER LIFECYCLE ============
+AWAITING_STATES = ("awaiting_nick", "awaiting_confirmation")
+
+def finish_order_state(order_id, status: OrderStatuses) -> Optional[dict]:
+    """
+    Заказ закрыт или возвращён на FunPay: снимает резерв баланса и удаляет состояние заказа.
+    Заказ, который выдаётся прямо сейчас, не трогаем — его завершит воркер DeliveryQueue.
+    """
+    if status not in (OrderStatuses.CLOSED, OrderStatuses.REFUNDED):
+        return None
+    state = waiting_for_nick.get_order(order_id)
+    if state is None or state["state"] == "delivering":
+        return None
+    ledger.release(order_id)
+    waiting_for_nick.pop_order(order_id)
+    logger.info(Fore.CYAN + f"[STATE] Заказ {order_id} ({status.name}) в состоянии {state['state']} снят, резерв освобождён")
+    return state
+
+def expire_stale_dialogs(ttl: float = AWAITING_DIALOG_TTL, now: Optional[float] = None) -> list[dict]:
+    """Снимает диалоги, в которых покупатель не отвечает дольше ttl секунд, и освобождает их резервы."""
+    now = time.time() if now is None else now
+    expired = []
+    for state in waiting_for_nick.orders():
+        if state["state"] not in AWAITING_STATES or now - state["updated_at"] <= ttl:
+            continue
+        ledger.release(state["order_id"])
+        waiting_for_nick.pop_order(state["order_id"])
+        if outbox is not None:
+            outbox.send(state["chat_id"], "⌛ Мы так и не получили ваш Telegram-тег. Напишите продавцу, "
+                                          "чтобы получить звёзды или оформить возврат.")
+        logger.warning(Fore.YELLOW + f"[STATE] Заказ {state['order_id']}: покупатель не отвечает, диалог снят — "
+                                     f"проверьте заказ вручную: https://funpay.com/orders/{state['order_id']}/")
+        expired.append(state)
+    return expired
+
+def _expire_stale_dialogs_loop(interval: float = 60):
+    while True:
+        time.sleep(interval)
+        try:
+            expire_stale_dialogs()
+        except:
+            logger.debug("TRACEBACK", exc_info=True)
+
 # ============ MAIN LOOP ============
 def main():
-    global FRAGMENT_TOKEN
-    golden_key = os.getenv("FUNPAY_AUTH_TOKEN")
+    global FRAGMENT_TOKEN, waiting_for_nick, outbox, ledger
+    golden_key = os.getenv("FUNPAY_AUTH_TOKEN") or ("simulator" if FUNPAY_SIMULATOR else None)
     if not golden_key:
         logger.error(Fore.RED + "❌ FUNPAY_AUTH_TOKEN не найден в .env")
         return
@@ -424,7 +1279,9 @@ def main():
     if FRAGMENT_VERSION not in ("V4R2", "W5"):
         logger.warning(Fore.YELLOW + f"⚠️ Неизвестная FRAGMENT_VERSION={FRAGMENT_VERSION}. Разрешены: V4R2, W5.")
 
-    account = Account(golden_key)
+    if FUNPAY_SIMULATOR:
+        logger.warning(Fore.YELLOW + f"[SIMULATOR] FunPay и Fragment подменены симулятором {FUNPAY_SIMULATOR}")
+    account = Account(golden_key, session=simulator_session(FUNPAY_SIMULATOR) if FUNPAY_SIMULATOR else cassette_session)
     account.get()
 
     if AUTO_REFUND_RAW is None:
@@ -439,43 +1296,93 @@ def main():
                             f"FRAGMENT_MIN_BALANCE={FRAGMENT_MIN_BALANCE}, DEACTIVATE_CATEGORY_ID={DEACTIVATE_CATEGORY_ID}, "
                             f"FRAGMENT_VERSION={FRAGMENT_VERSION}")
 
-    runner = Runner(account)
+    runner = Runner(account, state_file=RUNNER_STATE_FILE)
+    atexit.register(runner.save_state)
 
     FRAGMENT_TOKEN = load_fragment_token() or authenticate_fragment()
     if not FRAGMENT_TOKEN:
         logger.error(Fore.RED + "❌ Не удалось авторизоваться в Fragment.")
         return
 
-    logger.info(Style.BRIGHT + Fore.WHITE + "🚀 StarsBot запущен. Ожидание событий...")
-
-    last_reply_time = 0.0
-
-    for event in runner.listen(requests_delay=3.0):
-        try:
-            now = time.time()
-            if now - last_reply_time < COOLDOWN_SECONDS:
-                continue
-
-            if isinstance(event, NewOrderEvent):
-                subcat_id, subcat = get_subcategory_id_safe(event.order, account)
-                if subcat_id != 2418:
-                    logger.info(Fore.BLUE + f"⏭ Пропуск заказа — не Telegram Stars (ID: {subcat_id or 'неизвестно'})")
-                    continue
-
-                order = account.get_order(event.order.id)
-                title = getattr(order, "title", "") or getattr(order, "short_description", "") or getattr(order, "full_description", "") or ""
-                desc = getattr(order, "full_description", "") or getattr(order, "short_description", "") or ""
-                stars = extract_stars_count(title, desc)
+    waiting_for_nick = OrderStateStore(STATE_DB_FILE)
+    atexit.register(waiting_for_nick.close)
+    if len(waiting_for_nick):
+        logger.info(Fore.CYAN + f"[STATE] Восстановлено незавершённых заказов: {len(waiting_for_nick)}")
+    ledger = BalanceLedger(account)
+    for state in waiting_for_nick.orders():
+        if state["state"] not in ("delivering", "manual_check"):
+            ledger.reserve(state["order_id"], state["stars"] or 0)
+    outbox = MessageScheduler(account)
+    atexit.register(outbox.join)
+    for state in waiting_for_nick.orders():
+        if state["state"] == "delivering":
+            # Бот остановился во время выдачи: неизвестно, дошли ли звёзды, поэтому повторно не отправляем.
+            # Заказ остаётся в базе как manual_check, пока продавец не закроет его или не оформит возврат.
+            waiting_for_nick.update_order(state["order_id"], state="manual_check")
+            outbox.send(state["chat_id"], "⚠️ Выдача по вашему заказу была прервана. Продавец проверит её вручную "
+                                          "и свяжется с вами — повторно ничего отправлять не нужно.")
+        if state["state"] == "manual_check":
+            logger.warning(Fore.YELLOW + f"[STATE] Заказ {state['order_id']} прерван во время выдачи "
+                                         f"(@{(state['temp_nick'] or '?').lstrip('@')}, {state['stars']} ⭐) — "
+                                         f"проверьте его вручную: https://funpay.com/orders/{state['order_id']}/")
+    deliveries = DeliveryQueue(account)
+    for state in waiting_for_nick.orders():
+        if state["state"] == "deferred":
+            # выдача была отложена из-за недоступности Fragment — звёзды точно не отправлялись
+            deliveries.defer(state["order_id"], state["buyer_id"], state["chat_id"],
+                             (state["temp_nick"] or "").lstrip("@"), state["stars"])
+    threading.Thread(target=_expire_stale_dialogs_loop, name="StaleDialogs", daemon=True).start()
+
+    def has_active_dialogs() -> bool:
+        # Активна только работа в очередях: выдачи и неотправленные сообщения. Ответы покупателей и так держат
+        # частый опрос (activity_window Runner'а после каждого события), а ожидающие тег диалоги — нет.
+        stats = deliveries.stats()
+        return bool(stats["queued"] or stats["running"] or outbox.pending())
+
+    # Истории запрашиваются только для чатов покупателей с незавершёнными заказами,
+    # события о заказах — только по подкатегории Telegram Stars.
+    runner.subscribe(event_types={EventTypes.NEW_ORDER, EventTypes.NEW_MESSAGE, EventTypes.ORDER_STATUS_CHANGED},
+                     subcategory_ids={DEACTIVATE_CATEGORY_ID}, buyer_ids=waiting_for_nick)
+    runner.set_adaptive_delay(POLL_MIN_DELAY, POLL_MAX_DELAY, activity_check=has_active_dialogs)
 
-                logger.info(Style.BRIGHT + Fore.WHITE + "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                logger.info(Fore.CYAN + f"🆕 Новый заказ #{order.id}")
-                logger.info(Fore.CYAN + f"📦 Товар: {title}")
-                logger.info(Fore.MAGENTA + f"💫 Извлечено звёзд: {stars}")
-                logger.info(Style.BRIGHT + Fore.WHITE + "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+    logger.info(Style.BRIGHT + Fore.WHITE + "🚀 StarsBot запущен. Ожидание событий...")
 
-                buyer_id, chat_id = order.buyer_id, order.chat_id
-                waiting_for_nick[buyer_id] = {"chat_id": chat_id, "stars": stars, "order_id": order.id, "state": "awaiting_nick", "temp_nick": None}
-                msg_after_purchase = f"""🎉 Спасибо за покупку!
+    def handle_new_order(event: NewOrderEvent):
+        if event.order.status != OrderStatuses.PAID:
+            # заказ, пришедший за время простоя бота, уже закрыт или возвращён
+            logger.info(Fore.BLUE + f"⏭ Пропуск заказа #{event.order.id} — статус {event.order.status.name}")
+            return
+        subcat_id, subcat = get_subcategory_id_safe(event.order, account)
+        if subcat_id != 2418:
+            logger.info(Fore.BLUE + f"⏭ Пропуск заказа — не Telegram Stars (ID: {subcat_id or 'неизвестно'})")
+            return
+
+        order = order_cache.get(account, event.order.id)
+        title = getattr(order, "title", "") or getattr(order, "short_description", "") or getattr(order, "full_description", "") or ""
+        desc = getattr(order, "full_description", "") or getattr(order, "short_description", "") or ""
+        stars = extract_stars_count(title, desc)
+
+        logger.info(Style.BRIGHT + Fore.WHITE + "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+        logger.info(Fore.CYAN + f"🆕 Новый заказ #{order.id}")
+        logger.info(Fore.CYAN + f"📦 Товар: {title}")
+        logger.info(Fore.MAGENTA + f"💫 Извлечено звёзд: {stars}")
+        logger.info(Style.BRIGHT + Fore.WHITE + "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+
+        buyer_id, chat_id = order.buyer_id, order.chat_id
+        if not ledger.reserve(order.id, stars):
+            reason = "недостаточно средств для выдачи звёзд"
+            if AUTO_REFUND:
+                outbox.send(chat_id, "😔 К сожалению, звёзды временно закончились.\n🔁 Оформляю возврат…")
+                refund_order(account, order.id, chat_id, reason=reason)
+            else:
+                outbox.send(chat_id, "😔 К сожалению, звёзды временно закончились. Свяжитесь с админом для возврата.")
+                logger.warning(Fore.MAGENTA + f"Авто-возврат отключён. Заказ {order.id} требует ручного возврата. Причина: {reason}")
+            return
+        if (previous := waiting_for_nick.get(buyer_id)) is not None and \
+                previous["state"] not in ("delivering", "deferred", "manual_check"):
+            ledger.release(previous["order_id"])
+        waiting_for_nick[buyer_id] = {"chat_id": chat_id, "stars": stars, "order_id": order.id, "state": "awaiting_nick", "temp_nick": None}
+        msg_after_purchase = f"""🎉 Спасибо за покупку!
 
                 К выдаче: {stars} звезд⭐
 
@@ -483,89 +1390,66 @@ def main():
                 Если не знаете свой тег: откройте профиль Telegram → «Имя пользователя».
 
                 После отправки тега я попрошу вас его подтвердить."""
-                account.send_message(chat_id, msg_after_purchase)
-                last_reply_time = now
-
-            elif isinstance(event, NewMessageEvent):
-                msg, chat_id, user_id = event.message, event.message.chat_id, event.message.author_id
-                text = (event.message.text or "").strip()
-                if user_id == account.id or user_id not in waiting_for_nick:
-                    continue
+        outbox.send(chat_id, msg_after_purchase)
 
-                user_state = waiting_for_nick[user_id]
-                stars, order_id = user_state["stars"], user_state["order_id"]
+    def handle_new_message(event: NewMessageEvent):
+        msg, chat_id, user_id = event.message, event.message.chat_id, event.message.author_id
+        text = (event.message.text or "").strip()
+        if user_id == account.id or user_id not in waiting_for_nick:
+            return
 
-                if user_state["state"] == "awaiting_nick":
+        try:
+            user_state = waiting_for_nick[user_id]
+            stars, order_id = user_state["stars"], user_state["order_id"]
+
+            if user_state["state"] == "awaiting_nick":
+                if not check_username_exists(text):
+                    outbox.send(chat_id, f'❌ Ник "{text}" не найден. Пожалуйста, введите правильный Telegram-тег (пример: @username).')
+                    return
+                else:
+                    waiting_for_nick.update(user_id, temp_nick=text, state="awaiting_confirmation")
+                    outbox.send(
+                        chat_id,
+                        f"⁡Вы указали: {text}.\nЕсли верно — отправьте +.\nЕсли нужно изменить — пришлите другой тег в формате @username."
+                    )
+
+            elif user_state["state"] == "awaiting_confirmation":
+                if text == "+":
+                    username = user_state["temp_nick"].lstrip("@")
+                    # состояние меняем до постановки в очередь: воркер может завершить выдачу раньше, чем мы вернёмся
+                    waiting_for_nick.update(user_id, state="delivering")
+                    job = deliveries.submit(order_id, user_id, chat_id, username, stars)
+                    if job is None:
+                        waiting_for_nick.update(user_id, state="awaiting_confirmation")
+                        outbox.send(chat_id, "⏳ Сейчас много заказов в обработке. Отправьте + ещё раз через минуту.")
+                        logger.warning(Fore.YELLOW + f"[DELIVERY] Очередь заполнена, заказ {order_id} не поставлен в очередь")
+                else:
                     if not check_username_exists(text):
-                        account.send_message(chat_id, f'❌ Ник "{text}" не найден. Пожалуйста, введите правильный Telegram-тег (пример: @username).')
-                        last_reply_time = now
-                        continue
+                        outbox.send(chat_id, f'❌ Ник "{text}" не найден. Пожалуйста, введите правильный Telegram-тег.')
                     else:
-                        user_state["temp_nick"] = text
-                        user_state["state"] = "awaiting_confirmation"
-                        account.send_message(
+                        waiting_for_nick.update(user_id, temp_nick=text)
+                        outbox.send(
                             chat_id,
                             f"⁡Вы указали: {text}.\nЕсли верно — отправьте +.\nЕсли нужно изменить — пришлите другой тег в формате @username."
                         )
-                        last_reply_time = now
-
-                elif user_state["state"] == "awaiting_confirmation":
-                    if text == "+":
-                        username = user_state["temp_nick"].lstrip("@")
-                        account.send_message(chat_id, f"🚀 Отправляю {stars} ⭐ пользователю @{username}...")
-                        success, response, status_code = direct_send_stars(username, stars)
-                        if success:
-                            account.send_message(chat_id, f"✅ Успешно отправлено {stars} ⭐ пользователю @{username}!")
-                            logger.info(Fore.GREEN + f"✅ @{username} получил {stars} ⭐ (order {order_id})")
-
-                            order_url = f"https://funpay.com/orders/{order_id}/"
-                            account.send_message(
-                                chat_id,
-                                "🙏 Пожалуйста, подтвердите выполнение заказа и оставьте отзыв — это очень помогает!\n"
-                                f"Ссылка на заказ: {order_url}"
-                            )
-                        else:
-                            short_error = parse_fragment_error(response, status_code=status_code)
-                            log_order_api_error(order_id, response, short_error, status_code=status_code)
-
-                            if AUTO_REFUND:
-                                account.send_message(chat_id, short_error + "\n🔁 Пытаюсь оформить возврат…")
-                                refunded = refund_order(account, order_id, chat_id, reason=short_error)
-                                if not refunded:
-                                    notify_text = f"Не удалось автоматически вернуть средства по заказу {order_id}. Причина: {short_error}"
-                                    logger.warning(Fore.MAGENTA + notify_text)
-                            else:
-                                account.send_message(chat_id, short_error + "\n⚠️ Автоматический возврат отключён. Свяжитесь с админом для возврата.")
-                                logger.warning(Fore.MAGENTA + f"Авто-возврат отключён. Заказ {order_id} требует ручного возврата. Причина: {short_error}")
-
-                            balance = check_fragment_balance()
-                            if balance is not None:
-                                logger.info(Fore.MAGENTA + f"[BALANCE] Текущий баланс Fragment: {balance}")
-                                if balance < FRAGMENT_MIN_BALANCE:
-                                    logger.warning(Fore.YELLOW + f"[BALANCE] Баланс Fragment {balance} < порога {FRAGMENT_MIN_BALANCE}")
-                                    if AUTO_DEACTIVATE:
-                                        deactivated = deactivate_category(account, DEACTIVATE_CATEGORY_ID)
-                                        logger.warning(Fore.MAGENTA + f"Авто-деактивировано {deactivated} лотов в подкатегории {DEACTIVATE_CATEGORY_ID}")
-                                    else:
-                                        logger.warning(Fore.MAGENTA + f"AUTO_DEACTIVATE отключён — требуется ручная деактивация лотов (подкатегория {DEACTIVATE_CATEGORY_ID}).")
-                            else:
-                                logger.warning(Fore.YELLOW + "[BALANCE] Не удалось определить баланс Fragment (endpoint /misc/wallet/ вернул некорректный формат).")
-
-                        waiting_for_nick.pop(user_id, None)
-                        last_reply_time = now
-                    else:
-                        if not check_username_exists(text):
-                            account.send_message(chat_id, f'❌ Ник "{text}" не найден. Пожалуйста, введите правильный Telegram-тег.')
-                        else:
-                            user_state["temp_nick"] = text
-                            account.send_message(
-                                chat_id,
-                                f"⁡Вы указали: {text}.\nЕсли верно — отправьте +.\nЕсли нужно изменить — пришлите другой тег в формате @username."
-                            )
-                        last_reply_time = now
-
-        except Exception as e:
-            logger.exception(Fore.RED + f"❌ Ошибка обработки события: {e}")
+        except CircuitOpenError:
+            outbox.send(chat_id, "⏳ Сервис Fragment временно недоступен, не получается проверить тег. "
+                                 "Пришлите его ещё раз через пару минут.")
+
+    def handle_order_status_changed(event: OrderStatusChangedEvent):
+        order_cache.invalidate(event.order.id, event.order.status)
+        finish_order_state(event.order.id, event.order.status)
+
+    dispatcher = Dispatcher(workers=HANDLER_WORKERS)
+    dispatcher.register(handle_new_order, EventTypes.NEW_ORDER)
+    dispatcher.register(handle_order_status_changed, EventTypes.ORDER_STATUS_CHANGED)
+    # Без фильтра по waiting_for_nick: состояние покупателя может появиться в handle_new_order, который ещё
+    # в очереди перед этим сообщением (события одного покупателя обрабатываются по порядку). Runner тоже не
+    # теряет такие сообщения: чаты не из waiting_for_nick он перепроверяет buyer_filter_grace секунд.
+    dispatcher.register(handle_new_message, EventTypes.NEW_MESSAGE)
+    atexit.register(lambda: logger.info(Fore.CYAN + f"[HANDLERS] {dispatcher.stats()} | [ORDER CACHE] {order_cache.stats()} | "
+                                                    f"[FRAGMENT] {fragment_breaker.stats()}"))
+    dispatcher.listen(runner, requests_delay=3.0)
 
 if __name__ == "__main__":
     main()
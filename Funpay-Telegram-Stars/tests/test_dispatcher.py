@@ -0,0 +1,60 @@
+"""
+Dispatcher.listen сохраняет состояние Runner'а только после обработки переданных событий.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from types import SimpleNamespace
+
+from FunPayAPI.common.enums import EventTypes
+from FunPayAPI.updater.dispatcher import Dispatcher
+
+
+class FakeRunner:
+    """Runner с одной пачкой событий, которому всегда пора сохранять состояние."""
+    def __init__(self, events: list):
+        self.events = events
+        self.handled: list = []
+        self.saved_after: list[list] = []
+
+    def listen_batches(self, requests_delay, ignore_exceptions):
+        yield self, self.events
+
+    def checkpoint_due(self) -> bool:
+        return True
+
+    def save_checkpoint(self):
+        self.saved_after.append(list(self.handled))
+
+
+def make_event(buyer_id: int):
+    return SimpleNamespace(type=EventTypes.NEW_ORDER, order=SimpleNamespace(buyer_id=buyer_id))
+
+
+def test_checkpoint_after_handlers():
+    events = [make_event(i % 2) for i in range(4)]
+    runner = FakeRunner(events)
+    dispatcher = Dispatcher(workers=2)
+
+    def handler(event):
+        time.sleep(0.05)
+        runner.handled.append(event)
+
+    dispatcher.register(handler, EventTypes.NEW_ORDER)
+    dispatcher.listen(runner)
+    assert runner.saved_after == [runner.handled]
+    assert len(runner.handled) == 4
+
+
+def test_checkpoint_postponed_on_timeout():
+    release = threading.Event()
+    runner = FakeRunner([make_event(1)])
+    dispatcher = Dispatcher(workers=1)
+    dispatcher.checkpoint_timeout = 0.05
+    dispatcher.register(lambda event: release.wait(5), EventTypes.NEW_ORDER)
+    dispatcher.listen(runner)
+    assert runner.saved_after == []
+    release.set()
+    assert dispatcher.join(5)
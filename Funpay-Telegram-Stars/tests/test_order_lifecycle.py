@@ -0,0 +1,89 @@
+"""
+Проверка снятия состояний заказов в bot_fragment.py: резерв баланса освобождается, когда заказ закрыт или
+возвращён, пока бот ждал тег, и когда покупатель слишком долго не отвечает.
+"""
+from __future__ import annotations
+
+import importlib
+import os
+import sys
+
+import pytest
+
+from FunPayAPI.common.enums import OrderStatuses
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeLedger:
+    def __init__(self):
+        self.reserved: dict[str, int] = {}
+
+    def reserve(self, order_id, stars: int) -> bool:
+        self.reserved[str(order_id)] = stars
+        return True
+
+    def release(self, order_id, spent: bool = False):
+        self.reserved.pop(str(order_id), None)
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    # bot_fragment пишет log.txt в текущую директорию
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(PROJECT_DIR)
+    module = importlib.import_module("bot_fragment")
+    store = module.OrderStateStore(str(tmp_path / "orders_state.db"))
+    monkeypatch.setattr(module, "waiting_for_nick", store)
+    monkeypatch.setattr(module, "ledger", FakeLedger())
+    monkeypatch.setattr(module, "outbox", None)
+    yield module
+    store.close()
+
+
+def add_order(bot, order_id: str, buyer_id: int, state: str = "awaiting_nick", stars: int = 50):
+    bot.ledger.reserve(order_id, stars)
+    bot.waiting_for_nick[buyer_id] = {"chat_id": f"users-1-{buyer_id}", "stars": stars, "order_id": order_id,
+                                      "state": state, "temp_nick": None}
+
+
+@pytest.mark.parametrize("state", ["awaiting_nick", "awaiting_confirmation", "deferred", "manual_check"])
+def test_refund_releases_reservation(bot, state):
+    add_order(bot, "AAAA1111", 2, state)
+    assert bot.finish_order_state("AAAA1111", OrderStatuses.REFUNDED)["state"] == state
+    assert bot.waiting_for_nick.get_order("AAAA1111") is None
+    assert 2 not in bot.waiting_for_nick
+    assert bot.ledger.reserved == {}
+
+
+def test_delivering_order_is_kept(bot):
+    add_order(bot, "AAAA1111", 2, "delivering")
+    assert bot.finish_order_state("AAAA1111", OrderStatuses.CLOSED) is None
+    assert bot.waiting_for_nick.get_order("AAAA1111")["state"] == "delivering"
+    assert bot.ledger.reserved == {"AAAA1111": 50}
+
+
+def test_paid_status_is_ignored(bot):
+    add_order(bot, "AAAA1111", 2)
+    assert bot.finish_order_state("AAAA1111", OrderStatuses.PAID) is None
+    assert bot.ledger.reserved == {"AAAA1111": 50}
+
+
+def test_refund_of_previous_order_keeps_current_dialog(bot):
+    add_order(bot, "AAAA1111", 2, "deferred")
+    add_order(bot, "BBBB2222", 2)
+    bot.finish_order_state("AAAA1111", OrderStatuses.REFUNDED)
+    assert bot.waiting_for_nick[2]["order_id"] == "BBBB2222"
+    assert bot.ledger.reserved == {"BBBB2222": 50}
+
+
+def test_stale_dialogs_expire(bot):
+    add_order(bot, "AAAA1111", 2, "awaiting_nick")
+    add_order(bot, "BBBB2222", 3, "awaiting_confirmation")
+    add_order(bot, "CCCC3333", 4, "deferred")
+    now = bot.waiting_for_nick.get_order("AAAA1111")["updated_at"]
+    assert bot.expire_stale_dialogs(ttl=60, now=now + 30) == []
+    expired = bot.expire_stale_dialogs(ttl=60, now=now + 120)
+    assert sorted(i["order_id"] for i in expired) == ["AAAA1111", "BBBB2222"]
+    assert [i["order_id"] for i in bot.waiting_for_nick.orders()] == ["CCCC3333"]
+    assert bot.ledger.reserved == {"CCCC3333": 50}
@@ -0,0 +1,45 @@
+"""
+Проверка очереди исходящих сообщений bot_fragment.py: разомкнутый предохранитель FunPay не расходует попытки
+отправки.
+"""
+from __future__ import annotations
+
+import importlib
+import os
+
+import pytest
+
+from FunPayAPI.common.exceptions import CircuitOpenError
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeAccount:
+    def __init__(self, circuit_open: int):
+        self.circuit_open = circuit_open
+        self.sent: list[tuple[str, str]] = []
+        self.last_flood_err_time = 0
+        self.last_multiuser_flood_err_time = 0
+
+    def send_message(self, chat_id, text: str):
+        if self.circuit_open:
+            self.circuit_open -= 1
+            raise CircuitOpenError("FunPay send", 0.01)
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    # bot_fragment пишет log.txt в текущую директорию
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(PROJECT_DIR)
+    return importlib.import_module("bot_fragment")
+
+
+def test_circuit_open_is_not_an_attempt(bot):
+    account = FakeAccount(circuit_open=10)
+    scheduler = bot.MessageScheduler(account, interval=0.01, max_attempts=2)
+    scheduler.send("users-1-2", "ваш тег?")
+    assert scheduler.join(timeout=5)
+    assert account.sent == [("users-1-2", "ваш тег?")]
+    assert (scheduler.sent, scheduler.failed) == (1, 0)
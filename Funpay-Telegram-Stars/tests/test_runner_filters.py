@@ -0,0 +1,55 @@
+"""
+Фильтр buyer_ids Runner'а не теряет сообщения покупателя, который попал в фильтр позже (из обработчика заказа).
+Проверяется на локальном симуляторе FunPay.
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from FunPayAPI import Account
+from FunPayAPI.common.enums import EventTypes
+from FunPayAPI.common.simulator import FunPaySimulator
+from FunPayAPI.updater.runner import Runner
+
+BUYER_ID = 2000000
+
+
+@pytest.fixture
+def sim():
+    sim = FunPaySimulator(buyers=3, orders_per_minute=0, messages_per_second=0, seed=1).start()
+    yield sim
+    sim.stop()
+
+
+@pytest.fixture
+def runner(sim):
+    runner = Runner(Account("simulator", session=sim.session()).get())
+    runner.subscribe(event_types={EventTypes.NEW_MESSAGE}, buyer_ids=set())
+    runner.fetch_events()
+    # первое сообщение запрашивается, чтобы узнать собеседника чата
+    sim.send_buyer_message(BUYER_ID, "привет")
+    assert texts(runner) == ["привет"]
+    return runner
+
+
+def texts(runner: Runner) -> list[str]:
+    events, _ = runner.fetch_events()
+    return [e.message.text for e in events if e.type == EventTypes.NEW_MESSAGE]
+
+
+def test_message_returned_when_buyer_subscribed_later(sim, runner):
+    sim.send_buyer_message(BUYER_ID, "@nick")
+    assert texts(runner) == []
+    runner.buyer_ids.add(BUYER_ID)
+    assert texts(runner) == ["@nick"]
+    assert texts(runner) == []
+
+
+def test_message_seen_after_grace(sim, runner):
+    runner.buyer_filter_grace = 0
+    sim.send_buyer_message(BUYER_ID, "@nick")
+    assert texts(runner) == []
+    texts(runner)
+    runner.buyer_ids.add(BUYER_ID)
+    assert texts(runner) == []